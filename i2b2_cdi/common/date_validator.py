@@ -0,0 +1,100 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`date_validator` -- Fast validation of input dates
+=======================================================
+
+.. module:: date_validator
+    :platform: Linux/Windows
+    :synopsis: module contains memoized validator of the YYYY-MM-DD hh:mm:ss date format used in deid loops
+
+
+"""
+
+import re
+import time
+import random
+from functools import lru_cache
+from dateformat import DateFormat
+
+DATETIME_FORMAT = "YYYY-MM-DD hh:mm:ss"
+
+_date_format = DateFormat(DATETIME_FORMAT)
+_canonical_date = re.compile(
+    r'([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})')
+_days_in_month = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+@lru_cache(maxsize=65536)
+def is_valid_datetime(_date):
+    """Checks the date against the YYYY-MM-DD hh:mm:ss format, results are memoized as input dates repeat a lot.
+    The result is the same as parsing the date with DateFormat("YYYY-MM-DD hh:mm:ss").
+
+    Args:
+        _date (:obj:`str`, mandatory): Date to be validated
+
+    Returns:
+        boolean: True if date format is correct else false.
+
+    """
+    match = _canonical_date.fullmatch(_date)
+    if match is None:
+        # Other layouts accepted by DateFormat (single digits, several spaces, unicode digits) are rare
+        try:
+            _date_format.parse(_date)
+            return True
+        except ValueError:
+            return False
+    year, month, day, hour, minute, second = [int(part) for part in match.groups()]
+    if year < 1 or month < 1 or month > 12 or day < 1:
+        return False
+    max_day = _days_in_month[month]
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        max_day = 29
+    return day <= max_day and hour < 24 and minute < 60 and second < 60
+
+
+def benchmark(count=200000, distinct=1000):
+    """Compare is_valid_datetime with DateFormat.parse on generated dates
+
+    Args:
+        count (:obj:`int`, optional): Number of dates validated
+        distinct (:obj:`int`, optional): Number of distinct dates
+
+    Returns:
+        dict: dates per second of both validators
+
+    """
+    dates = ['%04d-%02d-%02d %02d:%02d:%02d' % (random.randint(1990, 2030), random.randint(0, 13), random.randint(0, 32),
+                                                random.randint(0, 25), random.randint(0, 61), random.randint(0, 61)) for i in range(distinct)]
+    dates = [dates[random.randrange(distinct)] for i in range(count)]
+
+    def parse(_date):
+        try:
+            _date_format.parse(_date)
+            return True
+        except ValueError:
+            return False
+
+    result = {}
+    for name, validate in (('dateformat', parse), ('date_validator', is_valid_datetime)):
+        is_valid_datetime.cache_clear()
+        start = time.time()
+        valid = [validate(_date) for _date in dates]
+        result[name] = int(count / (time.time() - start))
+        result[name + '_valid'] = sum(valid)
+    return result
+
+
+if __name__ == "__main__":
+    print(benchmark())
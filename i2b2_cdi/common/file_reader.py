@@ -0,0 +1,297 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`file_reader` -- Readers of the input files
+================================================
+
+.. module:: file_reader
+    :platform: Linux/Windows
+    :synopsis: module contains readers providing the rows of csv (optionally gzip or zstd compressed), Parquet and Arrow input files like the csv reader
+
+
+"""
+
+import io
+import os
+import csv
+import gzip
+from contextlib import contextmanager
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.common.utils import file_len
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+CSV_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst')
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow', '.feather')
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+
+_line_counts = {}
+
+
+def is_columnar(file_path):
+    """Check if the file is a Parquet or Arrow file, by extension"""
+    return str(file_path).lower().endswith(COLUMNAR_EXTENSIONS)
+
+
+def is_compressed(file_path):
+    """Check if the file is a gzip or zstd compressed file, by extension"""
+    return str(file_path).lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def can_split(file_path):
+    """Check if the file can be split in line aligned byte ranges, i.e. it is an uncompressed csv file"""
+    return not is_columnar(file_path) and not is_compressed(file_path)
+
+
+def find_input_file(dir_path, name):
+    """Find the input file of the name in the directory with any of the supported extensions
+
+    Args:
+        dir_path (:obj:`str`, mandatory): Path to the directory
+        name (:obj:`str`, mandatory): Name of the file without extension, e.g. facts
+
+    Returns:
+        str: path to the file, None if not found
+
+    """
+    for extension in CSV_EXTENSIONS + COLUMNAR_EXTENSIONS:
+        file_path = os.path.join(dir_path, name + extension)
+        if os.path.isfile(file_path):
+            return file_path
+    return None
+
+
+class ColumnarFile:
+    """Reads a Parquet or Arrow IPC (Feather v2) file in record batches.
+
+    Iterating the file provides the header first, then the rows as lists of strings like the csv reader,
+    so the same stages process csv and columnar inputs. Columns of a record batch are converted at once,
+    nulls are provided as empty strings.
+    """
+
+    def __init__(self, file_path, batch_size=None):
+        """
+        Args:
+            file_path (:obj:`str`, mandatory): Path to the Parquet or Arrow file.
+            batch_size (:obj:`int`, optional): Rows per record batch, defaults to COLUMNAR_BATCH_SIZE from env.
+
+        """
+        # pyarrow is only needed for columnar inputs
+        import pyarrow
+        if batch_size is None:
+            batch_size = int(os.getenv('COLUMNAR_BATCH_SIZE', 65536))
+        self.pa = pyarrow
+        self.file_path = str(file_path)
+        self.batch_size = max(1, batch_size)
+        self.size = os.path.getsize(self.file_path)
+        if self.file_path.lower().endswith('.parquet'):
+            import pyarrow.parquet
+            self.source = open(self.file_path, 'rb')
+            self.reader = pyarrow.parquet.ParquetFile(self.source)
+            self.schema = self.reader.schema_arrow if hasattr(
+                self.reader, 'schema_arrow') else self.reader.schema.to_arrow_schema()
+            self.num_rows = self.reader.metadata.num_rows
+        else:
+            import pyarrow.ipc
+            # Memory mapped, so counting the rows of the batches reads their metadata only
+            self.source = pyarrow.memory_map(self.file_path, 'r')
+            self.reader = pyarrow.ipc.open_file(self.source)
+            self.schema = self.reader.schema
+            if hasattr(self.reader, 'count_rows'):
+                self.num_rows = self.reader.count_rows()
+            else:
+                self.num_rows = sum(self.reader.get_batch(i).num_rows
+                                    for i in range(self.reader.num_record_batches))
+        self.rows_read = 0
+
+    def __iter__(self):
+        yield list(self.schema.names)
+        for batch in self.batches():
+            columns = [self.column_values(column) for column in batch.columns]
+            self.rows_read += batch.num_rows
+            yield from map(list, zip(*columns))
+
+    def batches(self):
+        """Provide the record batches of the file
+
+        Returns:
+            generator: pyarrow.RecordBatch
+
+        """
+        if hasattr(self.reader, 'iter_batches'):
+            yield from self.reader.iter_batches(batch_size=self.batch_size)
+        elif hasattr(self.reader, 'read_row_group'):
+            for index in range(self.reader.num_row_groups):
+                yield from self.reader.read_row_group(index).to_batches(self.batch_size)
+        else:
+            for index in range(self.reader.num_record_batches):
+                yield self.reader.get_batch(index)
+
+    def column_values(self, column):
+        """Provide the values of the column as strings, nulls as empty strings
+
+        Args:
+            column (:obj:`pyarrow.Array`, mandatory): Column of a record batch
+
+        Returns:
+            list: values as strings
+
+        """
+        if self.pa.types.is_date(column.type) or self.pa.types.is_timestamp(column.type):
+            column = self.format_datetime(column)
+        values = column.to_pylist()
+        if self.pa.types.is_string(column.type) or self.pa.types.is_large_string(column.type):
+            return ['' if value is None else value for value in values]
+        return ['' if value is None else str(value) for value in values]
+
+    def format_datetime(self, column):
+        """Format the date or timestamp column as 'YYYY-MM-DD hh:mm:ss' expected by the deid date check.
+        Fractional seconds are dropped, timestamps with a timezone are formatted as wall time of their timezone.
+
+        Args:
+            column (:obj:`pyarrow.Array`, mandatory): Date or timestamp column of a record batch
+
+        Returns:
+            pyarrow.Array: formatted strings
+
+        """
+        import pyarrow.compute
+        tz = column.type.tz if self.pa.types.is_timestamp(column.type) else None
+        column = column.cast(self.pa.timestamp('s', tz=tz), safe=False)
+        return pyarrow.compute.strftime(column, '%Y-%m-%d %H:%M:%S')
+
+    def tell(self):
+        """Provide the estimated byte offset of the read rows, for progress"""
+        if not self.num_rows:
+            return self.size
+        return self.size * self.rows_read // self.num_rows
+
+    def close(self):
+        self.source.close()
+
+
+def get_row_count(file_path):
+    """Provide the count of rows of the input file without header
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the csv, gzip or zstd compressed csv, Parquet or Arrow file
+
+    Returns:
+        int: count of rows, lines of a csv file
+
+    """
+    if is_columnar(file_path):
+        columnar_file = ColumnarFile(file_path)
+        columnar_file.close()
+        return columnar_file.num_rows
+    if is_compressed(file_path):
+        return max(0, count_compressed_lines(file_path) - 1)
+    return max(0, file_len(file_path) - 1)
+
+
+def count_compressed_lines(file_path):
+    """Provide the line count of the compressed file, lines are counted while decompressing.
+    Counts are memoized by path, size and modification time like :func:`i2b2_cdi.common.utils.file_len`.
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the gzip or zstd file
+
+    Returns:
+        int: count of lines
+
+    """
+    stat = os.stat(file_path)
+    key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+    count = _line_counts.get(key)
+    if count is None:
+        count = 0
+        with open(file_path, 'rb') as raw_file, decompress(file_path, raw_file) as stream:
+            for data in iter(lambda: stream.read(1024 * 1024), b''):
+                count += data.count(b'\n')
+        _line_counts[key] = count
+    return count
+
+
+def decompress(file_path, raw_file):
+    """Provide the decompressed binary stream of the compressed file
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the file, the compression is detected by extension
+        raw_file (:obj:`file`, mandatory): File opened in binary mode
+
+    Returns:
+        file: binary stream of the decompressed content
+
+    """
+    if str(file_path).lower().endswith('.zst'):
+        # zstandard is only needed for zstd compressed inputs
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(raw_file)
+    return gzip.GzipFile(fileobj=raw_file, mode='rb')
+
+
+@contextmanager
+def open_csv(file_path, delimiter):
+    """Open the input file for reading rows, the file type is detected by extension
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the csv, gzip or zstd compressed csv, Parquet or Arrow file
+        delimiter (:obj:`str`, mandatory): Delimiter of the csv file
+
+    Returns:
+        file: opened file, tell() provides the read byte offset (of the compressed file for compressed files)
+        iterable: reader providing the header, then the rows as lists
+
+    """
+    if is_columnar(file_path):
+        csv_file = ColumnarFile(file_path)
+        try:
+            yield csv_file, iter(csv_file)
+        finally:
+            csv_file.close()
+    elif is_compressed(file_path):
+        # Compressed file is streamed, progress is provided by the offset of the compressed file
+        with open(file_path, 'rb') as raw_file, decompress(file_path, raw_file) as stream:
+            with io.TextIOWrapper(stream) as csv_file:
+                yield raw_file, csv.reader(csv_file, delimiter=delimiter)
+    else:
+        with open(file_path, mode='r') as csv_file:
+            yield csv_file, csv.reader(csv_file, delimiter=delimiter)
+
+
+def dict_rows(csv_reader):
+    """Provide the rows as dicts keyed by the header, like csv.DictReader
+
+    Args:
+        csv_reader (:obj:`iterable`, mandatory): Reader providing the header, then the rows as lists
+
+    Returns:
+        generator: rows as dicts
+
+    """
+    header = next(csv_reader, None)
+    if header is None:
+        return
+    width = len(header)
+    for row in csv_reader:
+        if not row:
+            continue
+        values = dict(zip(header, row))
+        if len(row) > width:
+            values[None] = row[width:]
+        elif len(row) < width:
+            for name in header[len(row):]:
+                values[name] = None
+        yield values
@@ -0,0 +1,85 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`file_writer` -- Long lived csv writers
+============================================
+
+.. module:: file_writer
+    :platform: Linux/Windows
+    :synopsis: module contains class keeping csv writers open with a large buffer for the whole run
+
+
+"""
+
+import os
+import csv
+from pathlib import Path
+from dotenv import load_dotenv
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+
+class WriterSession:
+    """Keeps one buffered file handle and csv writer per output file for the whole run.
+    Files are opened in append mode on first use and flushed when the session is closed.
+    """
+
+    def __init__(self, buffer_size=None):
+        if buffer_size is None:
+            buffer_size = int(os.getenv('WRITE_BUFFER_SIZE', 1048576))
+        self.buffer_size = buffer_size
+        self.writers = {}
+
+    def get_writer(self, file_path, **fmtparams):
+        """Provide the csv writer of the file, file is opened if not yet opened in this session
+
+        Args:
+            file_path (:obj:`str`, mandatory): Path to the output file.
+            fmtparams (:obj:`dict`, optional): csv writer format parameters (delimiter, quoting, lineterminator).
+
+        Returns:
+            csv.writer: writer of the file, rows are written as lists
+
+        """
+        entry = self.writers.get(file_path)
+        if entry is None:
+            csv_file = open(file_path, 'a+', buffering=self.buffer_size)
+            writer = csv.writer(csv_file, **fmtparams)
+            entry = (csv_file, writer)
+            self.writers[file_path] = entry
+        return entry[1]
+
+    def flush(self):
+        """Flush the buffered rows of all files"""
+        for csv_file, _ in self.writers.values():
+            csv_file.flush()
+
+    def close(self, file_path=None):
+        """Flush and close the files
+
+        Args:
+            file_path (:obj:`str`, optional): Close the given file only.
+
+        """
+        paths = [file_path] if file_path else list(self.writers)
+        for path in paths:
+            entry = self.writers.pop(path, None)
+            if entry:
+                entry[0].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
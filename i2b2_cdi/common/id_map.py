@@ -0,0 +1,217 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`id_map` -- Compact src id to i2b2 num map
+===============================================
+
+.. module:: id_map
+    :platform: Linux/Windows
+    :synopsis: module contains compact, read only map used for patient and encounter mapping lookups
+
+
+"""
+
+import os
+import hashlib
+from array import array
+import numpy as np
+from i2b2_cdi.common.utils import replace_file
+
+
+class IdMap:
+    """Compact replacement of the ``{src_id: num}`` dict used for patient and encounter mapping.
+
+    Keys are stored as a sorted array of 64 bit hashes with a 32 bit check hash, values as int32.
+    Entries added with :meth:`update` are kept in a small overflow dict.
+    A map saved with :meth:`save` can be loaded memory mapped, so worker processes share the pages read only.
+    """
+
+    hash_file = 'hashes.npy'
+    check_file = 'checks.npy'
+    value_file = 'values.npy'
+
+    def __init__(self, hashes=None, checks=None, values=None, path=None):
+        self.hashes = hashes if hashes is not None else np.empty(0, dtype=np.uint64)
+        self.checks = checks if checks is not None else np.empty(0, dtype=np.uint32)
+        self.values = values if values is not None else np.empty(0, dtype=np.int32)
+        self.path = path
+        self.overflow = {}
+        # Count of overflow entries which are not in the arrays
+        self.added = 0
+        self.cache = {}
+        self.cache_size = 65536
+
+    @staticmethod
+    def hash_key(key):
+        """Provide the 64 bit hash and 32 bit check hash of the key
+
+        Args:
+            key (:obj:`str`, mandatory): Src id
+
+        Returns:
+            int: 64 bit hash
+            int: 32 bit check hash
+
+        """
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=12).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+    @classmethod
+    def from_items(cls, items):
+        """Build the map from (src_id, num) pairs, later pairs win for duplicate src ids like in dict
+
+        Args:
+            items (:obj:`iterable`, mandatory): (src_id, num) pairs
+
+        Returns:
+            IdMap: compact map
+
+        """
+        hashes = array('Q')
+        checks = array('I')
+        values = array('q')
+        for key, value in items:
+            key_hash, key_check = cls.hash_key(key)
+            hashes.append(key_hash)
+            checks.append(key_check)
+            values.append(value)
+        hashes = np.frombuffer(hashes, dtype=np.uint64) if hashes else np.empty(0, dtype=np.uint64)
+        checks = np.frombuffer(checks, dtype=np.uint32) if checks else np.empty(0, dtype=np.uint32)
+        values = np.frombuffer(values, dtype=np.int64).astype(np.int32) if values else np.empty(0, dtype=np.int32)
+        return cls(*cls.sort_unique(hashes, checks, values))
+
+    @staticmethod
+    def sort_unique(hashes, checks, values):
+        """Sort the arrays by hash and keep the last inserted entry of duplicate keys
+
+        Returns:
+            tuple: sorted hashes, checks and values arrays
+
+        """
+        # lexsort is stable, so the last inserted of duplicate keys is the last in its run
+        order = np.lexsort((checks, hashes))
+        hashes, checks, values = hashes[order], checks[order], values[order]
+        if len(hashes) > 1:
+            last = np.ones(len(hashes), dtype=bool)
+            last[:-1] = (hashes[1:] != hashes[:-1]) | (checks[1:] != checks[:-1])
+            hashes, checks, values = hashes[last], checks[last], values[last]
+        return hashes, checks, values
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load the map saved with :meth:`save`
+
+        Args:
+            path (:obj:`str`, mandatory): Directory containing the map files
+            mmap_mode (:obj:`str`, optional): numpy mmap mode, None loads the arrays in memory
+
+        Returns:
+            IdMap: compact map
+
+        """
+        return cls(np.load(os.path.join(path, cls.hash_file), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, cls.check_file), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, cls.value_file), mmap_mode=mmap_mode),
+                   path=path)
+
+    def save(self, path):
+        """Save the map arrays (entries added with update are included)
+
+        Args:
+            path (:obj:`str`, mandatory): Directory for the map files
+
+        """
+        merged = self.merged() if self.overflow else self
+        os.makedirs(path, exist_ok=True)
+        for file_name, data in ((self.hash_file, merged.hashes), (self.check_file, merged.checks), (self.value_file, merged.values)):
+            # Replace the file, so memory mapped readers keep the previous version
+            replace_file(os.path.join(path, file_name), lambda map_file: np.save(map_file, data))
+
+    def merged(self):
+        """Provide a new map with the overflow entries merged into the sorted arrays"""
+        extra = IdMap.from_items(self.overflow.items())
+        # Overflow entries are appended last, so they win over the existing entries
+        return IdMap(*self.sort_unique(np.concatenate([self.hashes, extra.hashes]),
+                                       np.concatenate([self.checks, extra.checks]),
+                                       np.concatenate([self.values, extra.values])))
+
+    def get(self, key, default=None):
+        """Provide the num mapped to the src id
+
+        Args:
+            key (:obj:`str`, mandatory): Src id
+            default (:obj:`int`, optional): Value returned if the src id is not mapped
+
+        Returns:
+            int: mapped num or default
+
+        """
+        if key in self.overflow:
+            return self.overflow[key]
+        value = self.find(key)
+        return default if value is None else value
+
+    def find(self, key):
+        """Provide the num mapped to the src id in the sorted arrays, entries added with update are not searched
+
+        Args:
+            key (:obj:`str`, mandatory): Src id
+
+        Returns:
+            int: mapped num, None if not found
+
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        key_hash, key_check = self.hash_key(key)
+        key_hash = np.uint64(key_hash)
+        index = int(np.searchsorted(self.hashes, key_hash))
+        while index < len(self.hashes) and self.hashes[index] == key_hash:
+            if self.checks[index] == key_check:
+                value = int(self.values[index])
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+                self.cache[key] = value
+                return value
+            index += 1
+        return None
+
+    def update(self, mapping):
+        """Add src id to num mappings
+
+        Args:
+            mapping (:obj:`dict`, mandatory): src id to num mapping
+
+        """
+        for key in mapping:
+            if key not in self.overflow and self.find(key) is None:
+                self.added += 1
+            self.cache.pop(key, None)
+        self.overflow.update(mapping)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.hashes) + self.added
+
+    def __reduce__(self):
+        # Memory mapped maps are shared by path, worker processes map the same pages
+        if self.path and not self.overflow:
+            return (IdMap.load, (self.path,))
+        return (IdMap, (np.asarray(self.hashes), np.asarray(self.checks), np.asarray(self.values)), {'overflow': self.overflow, 'added': self.added})
+
+    def __setstate__(self, state):
+        self.overflow = state.get('overflow', {})
+        self.added = state.get('added', 0)
@@ -0,0 +1,231 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`mapping_cache` -- Local cache of patient and encounter mapping
+====================================================================
+
+.. module:: mapping_cache
+    :platform: Linux/Windows
+    :synopsis: module contains class for caching patient_mapping, encounter_mapping on disk and refreshing it incrementally
+
+
+"""
+
+import os
+import re
+import json
+import pickle
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.id_map import IdMap
+from i2b2_cdi.common.utils import replace_file
+from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
+from i2b2_cdi.database.database_helper import fetch_in_batches
+
+logger = cdi_logging.get_logger(__file__)
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the cache is then locked within the process only
+    fcntl = None
+
+# Lock of each cache directory, shared by the caches of the threads of the process
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class MappingCache:
+    """Cache of a mapping table (src id to num) on local disk.
+
+    The cache records row count, max num and max import_date of the table.
+    Rows with a num greater than the cached max num are fetched on refresh. The cache is reloaded fully if the
+    row count does not add up (e.g. table has been truncated or rows were deleted).
+
+    The cache is kept per server and database. Reading, refreshing and saving it is locked across the threads
+    and processes sharing the cache directory.
+    """
+
+    def __init__(self, table_name, ide_column, num_column, cache_dir=None):
+        self.table_name = table_name
+        self.ide_column = ide_column
+        self.num_column = num_column
+        if cache_dir is None:
+            cache_dir = str(os.getenv('MAPPING_CACHE_DIR', 'data/.cache'))
+        data_source = I2b2demoDataSource()
+        database_dir = re.sub(r'[^\w.-]', '_', data_source.server + '_' + data_source.database)
+        self.cache_dir = os.path.join(cache_dir, database_dir, table_name)
+        self.lock_file = os.path.join(self.cache_dir, 'cache.lock')
+        self.meta_file = os.path.join(self.cache_dir, 'meta.json')
+        self.dict_file = os.path.join(self.cache_dir, 'map.pickle')
+
+    def get_mapping(self, compact=False):
+        """Provide the mapping from cache, refreshing the cache from the database
+
+        Args:
+            compact (:obj:`bool`, optional): Provide :class:`IdMap` instead of dict
+
+        Returns:
+            dict: src id to num mapping
+
+        """
+        with self.locked(), I2b2demoDataSource() as cursor:
+            stats = self.get_table_stats(cursor)
+            meta = self.read_meta()
+            mapping = None
+            if meta and meta.get('compact') == compact:
+                if all(meta.get(key) == stats[key] for key in stats):
+                    logger.info('Using cached ' + self.table_name)
+                    mapping = self.load(compact)
+                elif meta['max_num'] <= stats['max_num'] and meta['row_count'] < stats['row_count']:
+                    logger.info('Refreshing cached ' + self.table_name + ' from ' +
+                                self.num_column + ' > ' + str(meta['max_num']))
+                    new_rows = {}
+                    row_count = 0
+                    for row in self.fetch_rows(cursor, meta['max_num']):
+                        new_rows[row[0]] = row[1]
+                        row_count += 1
+                    if meta['row_count'] + row_count == stats['row_count']:
+                        mapping = self.load(compact)
+                        mapping.update(new_rows)
+                        self.save(mapping, stats, compact)
+            if mapping is None:
+                logger.info('Loading ' + self.table_name + ' into cache')
+                rows = self.fetch_rows(cursor)
+                if compact:
+                    mapping = IdMap.from_items(rows)
+                else:
+                    mapping = {row[0]: row[1] for row in rows}
+                self.save(mapping, stats, compact)
+        return mapping
+
+    @contextmanager
+    def locked(self):
+        """Lock the cache for the thread and the process in the context"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with _locks_lock:
+            lock = _locks.setdefault(self.cache_dir, threading.Lock())
+        with lock, open(self.lock_file, 'a') as lock_file:
+            if fcntl:
+                # Released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def get_table_stats(self, cursor):
+        """Provide row count, max num and max import_date of the mapping table
+
+        Args:
+            cursor (:obj:`pyodbc.Connection.cursor`, mandatory): Database cursor
+
+        Returns:
+            dict: table stats
+
+        """
+        query = 'SELECT COUNT(*), COALESCE(MAX({0}), 0), MAX(import_date) FROM {1}'.format(
+            self.num_column, self.table_name)
+        cursor.execute(query)
+        row = cursor.fetchone()
+        return {'row_count': int(row[0]), 'max_num': int(row[1]), 'import_date': str(row[2])}
+
+    def fetch_rows(self, cursor, min_num=None):
+        """Fetch (src id, num) rows of the mapping table
+
+        Args:
+            cursor (:obj:`pyodbc.Connection.cursor`, mandatory): Database cursor
+            min_num (:obj:`int`, optional): Fetch rows having num greater than min_num only
+
+        Returns:
+            generator: (src id, num) rows
+
+        """
+        query = 'SELECT {0}, {1} FROM {2}'.format(
+            self.ide_column, self.num_column, self.table_name)
+        if min_num is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query + ' WHERE {0} > ?'.format(self.num_column), (min_num,))
+        return fetch_in_batches(cursor, name=self.table_name)
+
+    def read_meta(self):
+        """Provide the cache metadata, None if the cache does not exist"""
+        if not os.path.exists(self.meta_file):
+            return None
+        try:
+            with open(self.meta_file, 'r') as meta_file:
+                return json.load(meta_file)
+        except ValueError:
+            return None
+
+    def load(self, compact):
+        """Load the cached mapping
+
+        Args:
+            compact (:obj:`bool`, mandatory): Load :class:`IdMap` instead of dict
+
+        """
+        if compact:
+            return IdMap.load(self.cache_dir)
+        with open(self.dict_file, 'rb') as dict_file:
+            return pickle.load(dict_file)
+
+    def save(self, mapping, stats, compact):
+        """Save the mapping and the table stats it was loaded for
+
+        Args:
+            mapping (:obj:`dict`, mandatory): src id to num mapping
+            stats (:obj:`dict`, mandatory): table stats
+            compact (:obj:`bool`, mandatory): mapping is :class:`IdMap`
+
+        """
+        # Metadata is removed first, so a partially written cache is never used
+        self.remove_meta()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if compact:
+            mapping.save(self.cache_dir)
+        else:
+            replace_file(self.dict_file, lambda dict_file: pickle.dump(
+                mapping, dict_file, protocol=pickle.HIGHEST_PROTOCOL))
+        meta = dict(stats)
+        meta['compact'] = compact
+        replace_file(self.meta_file, lambda meta_file: json.dump(meta, meta_file), mode='w')
+
+    def invalidate(self):
+        """Invalidate the cache, next load fetches the whole table"""
+        with self.locked():
+            self.remove_meta()
+
+    def remove_meta(self):
+        """Remove the cache metadata, called with the cache locked"""
+        if os.path.exists(self.meta_file):
+            os.remove(self.meta_file)
+
+    def clear(self):
+        """Remove the cache files"""
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+
+def patient_mapping_cache():
+    """Provide the cache of patient_mapping table"""
+    return MappingCache('patient_mapping', 'patient_ide', 'patient_num')
+
+
+def encounter_mapping_cache():
+    """Provide the cache of encounter_mapping table"""
+    return MappingCache('encounter_mapping', 'encounter_ide', 'encounter_num')
@@ -0,0 +1,178 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`pipeline` -- Read, process and write stages
+=================================================
+
+.. module:: pipeline
+    :platform: Linux/Windows
+    :synopsis: module contains class running the read, process and write stages of a file in threads connected by bounded queues
+
+
+"""
+
+import os
+import queue
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+_end = object()
+
+
+class Pipeline:
+    """Runs the stages of a file in blocks of rows: a reader thread parses the rows, the calling thread processes
+    the blocks and a writer thread writes the results. Stages are connected by queues of at most queue_size blocks,
+    so at most about 2 * queue_size + 3 blocks are in memory. Blocks are processed and written in input order.
+
+    The first error of any stage stops the other stages and is raised to the caller.
+    """
+
+    def __init__(self, block_size=None, queue_size=None, enabled=None):
+        """
+        Args:
+            block_size (:obj:`int`, optional): Rows per block, defaults to PIPELINE_BLOCK_SIZE from env.
+            queue_size (:obj:`int`, optional): Blocks per queue, defaults to PIPELINE_QUEUE_SIZE from env.
+            enabled (:obj:`bool`, optional): Run the stages in threads, defaults to PIPELINE_ENABLED from env.
+                Stages run one after the other in the calling thread otherwise.
+
+        """
+        if block_size is None:
+            block_size = int(os.getenv('PIPELINE_BLOCK_SIZE', 10000))
+        if queue_size is None:
+            queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+        if enabled is None:
+            enabled = str(os.getenv('PIPELINE_ENABLED')).lower() == 'true'
+        self.block_size = max(1, block_size)
+        self.queue_size = max(1, queue_size)
+        self.enabled = enabled
+        self.stop = threading.Event()
+        self.errors = []
+
+    def blocks(self, rows):
+        """Provide the rows in lists of block_size rows
+
+        Args:
+            rows (:obj:`iterable`, mandatory): Rows
+
+        Returns:
+            generator: blocks of rows
+
+        """
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == self.block_size:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    def run(self, rows, process, write):
+        """Run the stages until all rows are written
+
+        Args:
+            rows (:obj:`iterable`, mandatory): Rows read by the reader stage, e.g. rows of csv reader
+            process (:obj:`function`, mandatory): Called with each block, returns the result to be written
+            write (:obj:`function`, mandatory): Called with each result
+
+        """
+        if not self.enabled:
+            for block in self.blocks(rows):
+                write(process(block))
+            return
+
+        self.stop.clear()
+        self.errors = []
+        read_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+        reader = threading.Thread(target=self.read_stage, args=(
+            rows, read_queue), name='pipeline-reader', daemon=True)
+        writer = threading.Thread(target=self.write_stage, args=(
+            write_queue, write), name='pipeline-writer', daemon=True)
+        reader.start()
+        writer.start()
+        try:
+            while True:
+                block = self.get(read_queue)
+                if block is _end:
+                    break
+                if not self.put(write_queue, process(block)):
+                    break
+            self.put(write_queue, _end)
+        except BaseException as e:
+            self.fail(e)
+        finally:
+            writer.join()
+            self.stop.set()
+            reader.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def read_stage(self, rows, read_queue):
+        """Put the blocks of rows to the read queue"""
+        try:
+            for block in self.blocks(rows):
+                if not self.put(read_queue, block):
+                    return
+            self.put(read_queue, _end)
+        except BaseException as e:
+            self.fail(e)
+
+    def write_stage(self, write_queue, write):
+        """Write the results of the write queue"""
+        try:
+            while True:
+                result = self.get(write_queue)
+                if result is _end:
+                    return
+                write(result)
+        except BaseException as e:
+            self.fail(e)
+
+    def fail(self, error):
+        """Record the error of a stage and stop the other stages"""
+        self.errors.append(error)
+        self.stop.set()
+
+    def put(self, stage_queue, item):
+        """Put the item to the queue, waiting while the queue is full
+
+        Returns:
+            boolean: False if the pipeline is stopped
+
+        """
+        while not self.stop.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, stage_queue):
+        """Get the next item of the queue, waiting while the queue is empty
+
+        Returns:
+            object: next item, end marker if the pipeline is stopped
+
+        """
+        while not self.stop.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _end
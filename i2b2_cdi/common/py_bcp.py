@@ -26,11 +26,21 @@
 
 import subprocess
 import os
+import re
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.utils import file_len, merge_files, delete_file_if_exists
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
 from i2b2_cdi.exception.cdi_bcp_failed_error import BcpUploadFailedError
 
 logger = cdi_logging.get_logger(__file__)
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+_rows_copied = re.compile(r'([0-9]+) rows copied')
 
 
 class PyBCP:
@@ -42,54 +52,187 @@ class PyBCP:
             import_file,
             delimiter,
             batch_size,
-            error_file):
+            error_file,
+            partitions=None,
+            commit_batch_size=None,
+            packet_size=None):
+        """
+        Args:
+            table_name (:obj:`str`, mandatory): Target table.
+            import_file (:obj:`str`, mandatory): Path to the bcp file.
+            delimiter (:obj:`str`, mandatory): Field delimiter of the bcp file.
+            batch_size (:obj:`int`, mandatory): Max rejected rows of each bcp process (bcp -m).
+            error_file (:obj:`str`, mandatory): Path to the file for rejected rows.
+            partitions (:obj:`int`, optional): Concurrent bcp processes, defaults to BCP_PARTITIONS from env.
+            commit_batch_size (:obj:`int`, optional): Rows per committed batch (bcp -b), defaults to BCP_COMMIT_BATCH_SIZE from env.
+            packet_size (:obj:`int`, optional): Network packet size in bytes (bcp -a), defaults to BCP_PACKET_SIZE from env.
+
+        """
         self.table_name = table_name
         self.import_file = import_file
         self.delimiter = delimiter
         self.batch_size = batch_size
         self.error_file = error_file
+        if partitions is None:
+            partitions = int(os.getenv('BCP_PARTITIONS', 1))
+        if commit_batch_size is None:
+            commit_batch_size = int(os.getenv('BCP_COMMIT_BATCH_SIZE', 0))
+        if packet_size is None:
+            packet_size = int(os.getenv('BCP_PACKET_SIZE', 0))
+        self.partitions = max(1, partitions)
+        self.commit_batch_size = commit_batch_size
+        self.packet_size = packet_size
+        self.row_count = 0
 
     def upload(self):
-        """Wrapper ethod for uploading data file using bcp tool"""
-        try:
-            dbparams = I2b2demoDataSource()
-            with dbparams:
-                user = dbparams.username
-                password = dbparams.password
-                database = dbparams.database
-                server = dbparams.server
-            process = subprocess.Popen(["bcp",
-                                        self.table_name,
-                                        "in",
-                                        self.import_file,
-                                        "-U",
-                                        user,
-                                        "-P",
-                                        password,
-                                        "-d",
-                                        database,
-                                        "-S",
-                                        server,
-                                        "-c",
-                                        "-t",
-                                        self.delimiter,
-                                        "-m",
-                                        str(self.batch_size),
-                                        "-e",
-                                        self.error_file],
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       universal_newlines=True)
-            output, errors = process.communicate()
-            logger.info(output) if output else ""
-            logger.error(errors) if errors else ""
+        """Wrapper ethod for uploading data file using bcp tool.
+        With more than one partition the rows of the file are split in ranges, which are loaded by concurrent bcp processes
+        reading the same file (bcp -F and -L), so the file is not copied.
+
+        Returns:
+            int: count of copied rows
 
-            if "BCP copy in failed" in output or errors:
-                raise BcpUploadFailedError("BCP copy failed")
+        """
+        try:
+            start_time = time.time()
+            login = self.get_login()
+            row_ranges = []
+            if self.partitions > 1:
+                row_ranges = self.get_row_ranges()
+            if len(row_ranges) > 1:
+                self.row_count = self.upload_partitions(row_ranges, login)
+            else:
+                self.row_count = self.run_bcp(self.import_file, self.error_file, login)
+            elapsed = max(time.time() - start_time, 1e-6)
+            logger.info('Copied {0} rows into {1} in {2:.1f}s ({3:.0f} rows/sec)'.format(
+                self.row_count, self.table_name, elapsed, self.row_count / elapsed))
+            return self.row_count
         except Exception as e:
             logger.error(cdi_logging.format_error_log("BCP upload failed", e))
             raise
 
+    def get_row_ranges(self):
+        """Split the rows of the bcp file in ranges of equal size, one per partition
+
+        Returns:
+            list: (first row, last row) of each partition, 1 based, last row of the last partition is None (end of file)
+
+        """
+        row_count = file_len(self.import_file)
+        rows_per_partition = -(-row_count // self.partitions)
+        row_ranges = []
+        for first_row in range(1, row_count + 1, max(1, rows_per_partition)):
+            row_ranges.append((first_row, first_row + rows_per_partition - 1))
+        if row_ranges:
+            # Last line may not end with a line break, it is not counted
+            row_ranges[-1] = (row_ranges[-1][0], None)
+        return row_ranges
+
+    def upload_partitions(self, row_ranges, login):
+        """Load the row ranges of the bcp file with one bcp process each
+
+        Args:
+            row_ranges (:obj:`list`, mandatory): (first row, last row) of the partitions
+            login (:obj:`list`, mandatory): bcp login arguments
+
+        Returns:
+            int: count of copied rows of all partitions
+
+        """
+        error_files = [self.error_file + '.part' + str(i) for i in range(len(row_ranges))]
+        try:
+            logger.info('Uploading {0} in {1} partitions'.format(
+                self.import_file, len(row_ranges)))
+
+            results = []
+            with ThreadPoolExecutor(max_workers=len(row_ranges)) as executor:
+                futures = [executor.submit(self.run_bcp, self.import_file, error_file, login, first_row, last_row)
+                           for (first_row, last_row), error_file in zip(row_ranges, error_files)]
+                for i, future in enumerate(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append(e)
+                        logger.error('BCP partition {0} failed : {1}'.format(i, e))
+
+            # Rejected rows of all partitions end up in the error file, like with a single bcp process
+            delete_file_if_exists(self.error_file)
+            for error_file in error_files:
+                merge_files(self.error_file, error_file)
+
+            failed = [i for i, result in enumerate(results) if isinstance(result, Exception)]
+            row_count = sum(result for result in results if not isinstance(result, Exception))
+            logger.info('Copied {0} rows in {1} partitions, {2} partitions failed'.format(
+                row_count, len(results), len(failed)))
+            if failed:
+                raise BcpUploadFailedError(
+                    "BCP copy failed for partitions : " + ', '.join(str(i) for i in failed))
+            return row_count
+        finally:
+            for _file in error_files:
+                delete_file_if_exists(_file)
+
+    def get_login(self):
+        """Provide the bcp login arguments of the i2b2demodata database
+
+        Returns:
+            list: bcp login arguments
+
+        """
+        dbparams = I2b2demoDataSource()
+        with dbparams:
+            user = dbparams.username
+            password = dbparams.password
+            database = dbparams.database
+            server = dbparams.server
+        return ["-U", user, "-P", password, "-d", database, "-S", server]
+
+    def run_bcp(self, import_file, error_file, login, first_row=None, last_row=None):
+        """Run one bcp process loading the file
+
+        Args:
+            import_file (:obj:`str`, mandatory): Path to the bcp file
+            error_file (:obj:`str`, mandatory): Path to the file for rejected rows
+            login (:obj:`list`, mandatory): bcp login arguments
+            first_row (:obj:`int`, optional): First row of the file to be loaded (bcp -F)
+            last_row (:obj:`int`, optional): Last row of the file to be loaded (bcp -L)
+
+        Returns:
+            int: count of copied rows reported by bcp
+
+        """
+        command = ["bcp",
+                   self.table_name,
+                   "in",
+                   import_file] + login + [
+                   "-c",
+                   "-t",
+                   self.delimiter,
+                   "-m",
+                   str(self.batch_size),
+                   "-e",
+                   error_file]
+        if self.commit_batch_size > 0:
+            command.extend(["-b", str(self.commit_batch_size)])
+        if self.packet_size > 0:
+            command.extend(["-a", str(self.packet_size)])
+        if first_row is not None:
+            command.extend(["-F", str(first_row)])
+        if last_row is not None:
+            command.extend(["-L", str(last_row)])
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        output, errors = process.communicate()
+        logger.info(output) if output else ""
+        logger.error(errors) if errors else ""
+
+        if "BCP copy in failed" in output or errors:
+            raise BcpUploadFailedError("BCP copy failed")
+        match = _rows_copied.search(output)
+        return int(match.group(1)) if match else 0
+
     def execute_sql(self, file_path):
         """Wrapper method to execute the queries using sqlcmd command
 
@@ -140,4 +283,3 @@ if __name__ == "__main__":
         error_file="err.log")
     bcp_test.execute_sql("sql/create_observation_fact_numbered.sql")
     bcp_test.upload()
-    bcp_test.execute_sql("sql/load_observation_fact_from_numbered.sql")
@@ -0,0 +1,105 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`row_plan` -- Column index plan for csv rows
+=================================================
+
+.. module:: row_plan
+    :platform: Linux/Windows
+    :synopsis: module contains class mapping csv rows read as lists to the output column layout by precomputed index
+
+
+"""
+
+from operator import itemgetter
+
+
+class RowPlan:
+    """Column index plan compiled once from the input header.
+
+    Rows are kept as lists in the layout of the output fieldnames, fields are accessed by the index in :attr:`index`.
+    Rows are converted with the same rules as csv.DictReader and csv.DictWriter: blank lines are skipped,
+    short rows are padded with None, output fields missing in the input are written as restval.
+    """
+
+    def __init__(self, header, fieldnames, required=(), restval=''):
+        """
+        Args:
+            header (:obj:`list`, mandatory): Header of the input file, None for an empty file.
+            fieldnames (:obj:`list`, mandatory): Output column layout.
+            required (:obj:`list`, optional): Input columns accessed by the caller.
+            restval (:obj:`str`, optional): Value of the output fields missing in the input.
+
+        """
+        self.header = list(header or [])
+        self.fieldnames = list(fieldnames)
+        self.index = {name: i for i, name in enumerate(self.fieldnames)}
+        # Later duplicate columns win like in csv.DictReader
+        header_index = {name: i for i, name in enumerate(self.header)}
+        self.source = [header_index.get(name) for name in self.fieldnames]
+        self.restval = restval
+        self.width = len(self.header)
+        self.missing = [name for name in required if name not in header_index]
+        self.extra = [name for name in self.header if name not in self.index]
+        self.identity = self.header == self.fieldnames
+        # Missing output fields are taken from the restval appended to the row
+        self.padding = [restval] if None in self.source else []
+        self.getter = itemgetter(
+            *[self.width if i is None else i for i in self.source])
+
+    def convert(self, row):
+        """Provide the row in the output layout
+
+        Args:
+            row (:obj:`list`, mandatory): Row in the input layout
+
+        Returns:
+            list: row in the output layout
+
+        """
+        if self.padding:
+            row = row + self.padding
+        if len(self.source) == 1:
+            return [self.getter(row)]
+        return list(self.getter(row))
+
+    def rows(self, csv_reader):
+        """Provide the rows of the csv reader in the output layout
+
+        Args:
+            csv_reader (:obj:`csv.reader`, mandatory): Reader positioned after the header
+
+        Returns:
+            generator: rows as lists
+
+        """
+        width = self.width
+        identity = self.identity
+        checked = False
+        for row in csv_reader:
+            if not row:
+                continue
+            if not checked:
+                # Same failures as accessing a missing key of csv.DictReader row or writing an unknown key
+                if self.missing:
+                    raise KeyError(self.missing[0])
+                if self.extra:
+                    raise ValueError('dict contains fields not in fieldnames: ' +
+                                     ', '.join([repr(name) for name in self.extra]))
+                checked = True
+            if len(row) != width:
+                if len(row) > width:
+                    raise ValueError(
+                        'dict contains fields not in fieldnames: None')
+                row = row + [None] * (width - len(row))
+            yield row if identity else self.convert(row)
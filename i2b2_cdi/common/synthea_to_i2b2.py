@@ -29,7 +29,7 @@ from collections import OrderedDict
 import os
 from pathlib import Path
 from alive_progress import alive_bar, config_handler
-import subprocess
+from i2b2_cdi.common.utils import progress_total, FileProgress
 
 config_handler.set_global(length=50, spinner='triangles2')
 
@@ -54,7 +54,7 @@ def csv_rw_fact(synthetic_file, delimiter):
         raise Exception
 
     with open(synthetic_file, mode='r') as csv_file:
-        max_line = file_len(synthetic_file)-1
+        max_line = progress_total(synthetic_file)
         write_file_header(fact_file_path, header, delimiter)
         csv_reader = csv.DictReader(csv_file, delimiter=delimiter)
         count = 1
@@ -63,6 +63,7 @@ def csv_rw_fact(synthetic_file, delimiter):
         batch_size = 100
         batch = []
         with alive_bar(max_line, bar='smooth') as bar:
+            progress = FileProgress(csv_file, bar)
             for row in csv_reader:
                 i2b2_row['EncounterID'] = row['ENCOUNTER']
                 i2b2_row['PatientID'] = row['PATIENT']
@@ -78,7 +79,8 @@ def csv_rw_fact(synthetic_file, delimiter):
                     write_to_file(batch, fact_file_path, delimiter, header)
                     batch = []
 
-                bar()
+                progress()
+            progress.update()
 
         write_to_file(batch, fact_file_path, delimiter, header)
 
@@ -103,7 +105,7 @@ def csv_rw_encounter(synthetic_file, delimiter):
         raise Exception
 
     with open(synthetic_file, mode='r') as csv_file:
-        max_line = file_len(synthetic_file)-1
+        max_line = progress_total(synthetic_file)
         write_file_header(fact_file_path, header, delimiter)
         csv_reader = csv.DictReader(csv_file, delimiter=delimiter)
         count = 1
@@ -111,6 +113,7 @@ def csv_rw_encounter(synthetic_file, delimiter):
         batch_size = 100
         batch = []
         with alive_bar(max_line, bar='smooth') as bar:
+            progress = FileProgress(csv_file, bar)
             for row in csv_reader:
                 i2b2_row['EncounterID'] = row['Id']
                 i2b2_row['PatientID'] = row['PATIENT']
@@ -128,7 +131,8 @@ def csv_rw_encounter(synthetic_file, delimiter):
                     write_to_file(batch, fact_file_path, delimiter, header)
                     batch = []
 
-                bar()
+                progress()
+            progress.update()
 
         write_to_file(batch, fact_file_path, delimiter, header)
 
@@ -152,7 +156,7 @@ def csv_rw_mrn(synthetic_file, delimiter):
         raise Exception
 
     with open(synthetic_file, mode='r') as csv_file:
-        max_line = file_len(synthetic_file)-1
+        max_line = progress_total(synthetic_file)
         write_file_header(fact_file_path, header, delimiter)
         csv_reader = csv.DictReader(csv_file, delimiter=delimiter)
         count = 1
@@ -160,6 +164,7 @@ def csv_rw_mrn(synthetic_file, delimiter):
         batch_size = 100
         batch = []
         with alive_bar(max_line, bar='smooth') as bar:
+            progress = FileProgress(csv_file, bar)
             for row in csv_reader:
                 i2b2_row['SYNTHEA'] = row['Id']
                 batch.append(i2b2_row)
@@ -167,7 +172,8 @@ def csv_rw_mrn(synthetic_file, delimiter):
                     write_to_file(batch, fact_file_path, delimiter, header)
                     batch = []
 
-                bar()
+                progress()
+            progress.update()
 
         write_to_file(batch, fact_file_path, delimiter, header)
 
@@ -231,24 +237,6 @@ def delete_file_if_exists(file_path):
         os.remove(file_path)
 
 
-def file_len(fname):
-    """Provide the total number of line counts for the specified file
-
-    Args:
-       fname (str): name or path of the file for which, the lines to be calculated
-
-    Returns:
-        int: count of total number of lines from the provided file
-
-    """
-    p = subprocess.Popen(['wc', '-l', fname], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    result, err = p.communicate()
-    if p.returncode != 0:
-        raise IOError(err)
-    return int(result.strip().split()[0])
-
-
 if __name__ == '__main__':
     print("Transforming synthetic observations to i2b2 observations...")
     csv_rw_fact('data/synthea/observations.csv', ',')
@@ -0,0 +1,264 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`uploader` -- Upload engines for bcp files
+===============================================
+
+.. module:: uploader
+    :platform: Linux/Windows
+    :synopsis: module contains pyodbc bulk insert engine as an alternative to the bcp tool and the engine selection
+
+
+"""
+
+import os
+import time
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.py_bcp import PyBCP
+from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
+from i2b2_cdi.exception.cdi_bcp_failed_error import BcpUploadFailedError
+
+logger = cdi_logging.get_logger(__file__)
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+
+class OdbcUploader:
+    """Uploads bcp files with pyodbc executemany (fast_executemany) over the database connection,
+    so neither the bcp nor the sqlcmd tool is needed.
+
+    The bcp file is read like ``bcp in -c``: fields are split on the delimiter and empty fields are inserted as NULL.
+    A batch failing on the server is retried row by row, rejected rows are written to the error file.
+    """
+
+    def __init__(
+            self,
+            table_name,
+            import_file,
+            delimiter,
+            batch_size,
+            error_file,
+            insert_batch_size=None,
+            data_source=I2b2demoDataSource):
+        """
+        Args:
+            table_name (:obj:`str`, mandatory): Target table.
+            import_file (:obj:`str`, mandatory): Path to the bcp file.
+            delimiter (:obj:`str`, mandatory): Field delimiter of the bcp file.
+            batch_size (:obj:`int`, mandatory): Max rejected rows before the upload fails, like bcp -m.
+            error_file (:obj:`str`, mandatory): Path to the file for rejected rows.
+            insert_batch_size (:obj:`int`, optional): Rows per executemany, defaults to ODBC_BATCH_SIZE from env.
+            data_source (:obj:`class`, optional): DataSource class providing the connection.
+
+        """
+        self.table_name = table_name
+        self.import_file = import_file
+        self.delimiter = delimiter
+        self.batch_size = batch_size
+        self.error_file = error_file
+        if insert_batch_size is None:
+            insert_batch_size = int(os.getenv('ODBC_BATCH_SIZE', 5000))
+        self.insert_batch_size = insert_batch_size
+        self.data_source = data_source
+        self.row_count = 0
+        self.error_count = 0
+
+    def upload(self):
+        """Upload the bcp file to the table
+
+        Returns:
+            int: count of inserted rows
+
+        """
+        try:
+            with open(self.import_file, 'r') as bcp_file:
+                rows = (line.rstrip('\n').split(self.delimiter)
+                        for line in bcp_file)
+                return self.insert_rows(rows)
+        except Exception as e:
+            logger.error(cdi_logging.format_error_log(
+                "ODBC upload failed", e))
+            raise
+
+    def insert_rows(self, rows):
+        """Insert the rows to the table in batches, each batch is committed
+
+        Args:
+            rows (:obj:`iterable`, mandatory): Rows as lists of strings in the table column order.
+
+        Returns:
+            int: count of inserted rows
+
+        """
+        start_time = time.time()
+        self.row_count = 0
+        self.error_count = 0
+        line_num = 0
+        with self.data_source() as cursor:
+            if hasattr(cursor, 'fast_executemany'):
+                cursor.fast_executemany = True
+            query = None
+            batch = []
+            for row in rows:
+                line_num += 1
+                if query is None:
+                    query = 'INSERT INTO {0} VALUES ({1})'.format(
+                        self.table_name, ', '.join(['?'] * len(row)))
+                # Empty fields are NULL like in bcp
+                batch.append([field if field != '' else None for field in row])
+                if len(batch) == self.insert_batch_size:
+                    self.insert_batch(cursor, query, batch, line_num - len(batch) + 1)
+                    batch = []
+            if batch:
+                self.insert_batch(cursor, query, batch,
+                                  line_num - len(batch) + 1)
+        elapsed = max(time.time() - start_time, 1e-6)
+        logger.info('Inserted {0} rows into {1} in {2:.1f}s ({3:.0f} rows/sec), {4} rows rejected'.format(
+            self.row_count, self.table_name, elapsed, self.row_count / elapsed, self.error_count))
+        return self.row_count
+
+    def insert_batch(self, cursor, query, batch, first_line_num):
+        """Insert one batch, rows of a failed batch are inserted one by one to find the rejected rows
+
+        Args:
+            cursor (:obj:`pyodbc.Connection.cursor`, mandatory): Database cursor
+            query (:obj:`str`, mandatory): Parameterized insert query
+            batch (:obj:`list`, mandatory): Rows of the batch
+            first_line_num (:obj:`int`, mandatory): Line number of the first row in the bcp file
+
+        """
+        try:
+            cursor.executemany(query, batch)
+            cursor.connection.commit()
+            self.row_count += len(batch)
+            return
+        except Exception as e:
+            cursor.connection.rollback()
+            logger.warning('Batch at row {0} of {1} failed, inserting rows one by one : {2}'.format(
+                first_line_num, self.table_name, e))
+
+        for line_num, row in enumerate(batch, first_line_num):
+            try:
+                cursor.execute(query, row)
+                cursor.connection.commit()
+                self.row_count += 1
+            except Exception as e:
+                cursor.connection.rollback()
+                self.reject_row(line_num, row, e)
+
+    def reject_row(self, line_num, row, error):
+        """Write the rejected row to the error file, fail the upload if max errors reached
+
+        Args:
+            line_num (:obj:`int`, mandatory): Line number of the row in the bcp file
+            row (:obj:`list`, mandatory): Rejected row
+            error (:obj:`Exception`, mandatory): Database error
+
+        """
+        self.error_count += 1
+        with open(self.error_file, 'a+') as error_file:
+            error_file.write('#@ Row {0}: {1} @#\n'.format(
+                line_num, str(error).replace('\n', ' ')))
+            error_file.write(self.delimiter.join(
+                ['' if field is None else str(field) for field in row]) + '\n')
+        if self.error_count > self.batch_size:
+            raise BcpUploadFailedError(
+                "ODBC upload failed, max errors reached : " + str(self.batch_size))
+
+    def execute_sql(self, file_path):
+        """Execute the sql script over the database connection, in place of sqlcmd
+
+        Args:
+            file_path (str): path to the sql script file
+        """
+        try:
+            with open(file_path, 'r') as sql_file:
+                script = sql_file.read()
+            with self.data_source() as cursor:
+                cursor.execute(script)
+                # Drain all result sets, so every statement of the batch is run
+                while cursor.nextset():
+                    pass
+        except Exception as e:
+            logger.error(
+                cdi_logging.format_error_log(
+                    "Failed to execute the sql - " +
+                    str(file_path),
+                    e))
+            raise
+
+
+def get_uploader(table_name, import_file, delimiter, batch_size, error_file, engine=None):
+    """Provide the upload engine for the bcp file
+
+    Args:
+        table_name (:obj:`str`, mandatory): Target table.
+        import_file (:obj:`str`, mandatory): Path to the bcp file.
+        delimiter (:obj:`str`, mandatory): Field delimiter of the bcp file.
+        batch_size (:obj:`int`, mandatory): Max rejected rows before the upload fails.
+        error_file (:obj:`str`, mandatory): Path to the file for rejected rows.
+        engine (:obj:`str`, optional): 'bcp' or 'odbc', defaults to UPLOAD_ENGINE from env.
+
+    Returns:
+        PyBCP or OdbcUploader: upload engine
+
+    """
+    if engine is None:
+        engine = str(os.getenv('UPLOAD_ENGINE', 'bcp')).lower()
+    if engine == 'odbc':
+        return OdbcUploader(table_name, import_file, delimiter, batch_size, error_file)
+    if engine == 'bcp':
+        return PyBCP(table_name, import_file, delimiter, batch_size, error_file)
+    raise ValueError('Unknown upload engine : ' + engine)
+
+
+def benchmark(table_name, import_file, delimiter, create_table_sql, engines=('bcp', 'odbc')):
+    """Upload the same bcp file with each engine and compare the throughput
+
+    Args:
+        table_name (:obj:`str`, mandatory): Target table.
+        import_file (:obj:`str`, mandatory): Path to the bcp file.
+        delimiter (:obj:`str`, mandatory): Field delimiter of the bcp file.
+        create_table_sql (:obj:`str`, mandatory): Sql script (re)creating the empty target table.
+        engines (:obj:`list`, optional): Engines to compare.
+
+    Returns:
+        dict: rows/sec of each engine
+
+    """
+    with open(import_file, 'r') as bcp_file:
+        row_count = sum(1 for line in bcp_file)
+    result = {'rows': row_count}
+    for engine in engines:
+        uploader = get_uploader(table_name, import_file, delimiter,
+                                10000, import_file + '.' + engine + '.err', engine=engine)
+        uploader.execute_sql(create_table_sql)
+        start_time = time.time()
+        uploader.upload()
+        result[engine] = int(row_count / max(time.time() - start_time, 1e-6))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare bcp and odbc upload engines')
+    parser.add_argument('table_name')
+    parser.add_argument('import_file')
+    parser.add_argument('create_table_sql')
+    parser.add_argument('-t', '--delimiter', default=str(os.getenv('CSV_DELIMITER')))
+    args = parser.parse_args()
+    print(benchmark(args.table_name, args.import_file,
+                    args.delimiter, args.create_table_sql))
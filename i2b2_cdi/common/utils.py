@@ -28,6 +28,8 @@ import subprocess
 import time
 import os
 import psutil
+import shutil
+import tempfile
 from pathlib import Path
 
 
@@ -63,6 +65,32 @@ class Time():
 # Time().timeStep()
 
 
+def get_rss():
+    """Provide the current resident set size of the current process
+
+    Returns:
+        int: RSS in bytes
+
+    """
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def get_peak_rss():
+    """Provide the peak resident set size of the current process
+
+    Returns:
+        int: peak RSS in bytes
+
+    """
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        memory_info = psutil.Process(os.getpid()).memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss)
+
+
 def getHash(_txt):
     d = hashlib.md5(_txt.encode('utf8')).digest()
     return base64.b64encode(d).replace(
@@ -99,28 +127,191 @@ def getParents(_path):
     return arr
 
 
+_line_counts = {}
+
+
 def file_len(fname):
-    """Provide the total number of word counts for the specified file
+    """Provide the total number of line counts for the specified file.
+    Counts are memoized by path, size and modification time, so a file is counted once for all stages.
     
     Args:
-       fname (str): name or path of the file for which, the word count to be calculated
+       fname (str): name or path of the file for which, the lines to be calculated
+
+    Returns:
+        int: count of total number of lines from the provided file
+
+    """
+    stat = os.stat(fname)
+    key = (os.path.realpath(fname), stat.st_size, stat.st_mtime_ns)
+    count = _line_counts.get(key)
+    if count is None:
+        p = subprocess.Popen(['wc', '-l', fname], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        result, err = p.communicate()
+        if p.returncode != 0:
+            raise IOError(err)
+        count = int(result.strip().split()[0])
+        _line_counts[key] = count
+    return count
+
+
+def is_exact_progress():
+    """Check if progress is counted in rows (PROGRESS_EXACT_COUNT) instead of estimated from byte offsets"""
+    return str(os.getenv('PROGRESS_EXACT_COUNT')).lower() == 'true'
+
+
+def progress_total(fname):
+    """Provide the total of the progress bar while reading the csv file
+
+    Args:
+       fname (str): name or path of the file
+
+    Returns:
+        int: count of rows without header if progress is exact, size of the file in bytes otherwise
+
+    """
+    if is_exact_progress():
+        # file_reader depends on utils, rows of columnar files are counted from their metadata
+        from i2b2_cdi.common.file_reader import get_row_count
+        return get_row_count(fname)
+    return os.path.getsize(fname)
+
+
+class FileProgress:
+    """Progress callback of reading a file, wraps the bar of alive_bar created with :func:`progress_total`.
+
+    Without exact progress the bar advances to the byte offset of the file, which is read every check_interval rows,
+    so the file is not counted before processing. Otherwise the bar advances by the count of rows.
+    """
+
+    def __init__(self, csv_file, bar, exact=None, check_interval=1000):
+        """
+        Args:
+            csv_file (:obj:`file`, mandatory): File being read, text or binary.
+            bar (:obj:`function`, mandatory): Bar of alive_bar.
+            exact (:obj:`bool`, optional): Count rows, defaults to PROGRESS_EXACT_COUNT from env.
+            check_interval (:obj:`int`, optional): Rows between reading the byte offset.
+
+        """
+        # Offset of the binary buffer is available while a text file is iterated, it is ahead by the read chunk
+        self.file = getattr(csv_file, 'buffer', csv_file)
+        self.bar = bar
+        self.exact = is_exact_progress() if exact is None else exact
+        self.check_interval = check_interval
+        self.position = 0
+        self.pending = 0
+
+    def __call__(self, incr=1):
+        """Advance the progress by incr rows, called like the bar of alive_bar"""
+        if self.exact:
+            self.bar(incr=incr)
+            return
+        self.pending += incr
+        if self.pending >= self.check_interval:
+            self.pending = 0
+            self.update()
+
+    def update(self):
+        """Advance the bar to the current byte offset of the file"""
+        if self.exact:
+            return
+        position = self.file.tell()
+        if position > self.position:
+            self.bar(incr=position - self.position)
+            self.position = position
+
+
+def get_file_chunks(fname, chunk_count, offset=0):
+    """Split the file in byte ranges aligned to line boundaries
+
+    Args:
+       fname (str): name or path of the file
+       chunk_count (int): number of chunks to be created
+       offset (int): byte offset where the first chunk starts (e.g. size of the header line)
+
+    Returns:
+        list: list of (start, end) byte offsets
+
+    """
+    size = os.path.getsize(fname)
+    chunk_size = max(1, (size - offset) // max(1, chunk_count))
+    chunks = []
+    with open(fname, 'rb') as f:
+        start = offset
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def read_file_chunk(fname, start, end, encoding='utf-8'):
+    """Provide the lines of the file between the given byte offsets
+
+    Args:
+       fname (str): name or path of the file
+       start (int): byte offset of the first line
+       end (int): byte offset where reading stops
 
     Returns:
-        int: count of total number of words from the provided file
+        generator: decoded lines
 
     """
-    p = subprocess.Popen(['wc', '-l', fname], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    result, err = p.communicate()
-    if p.returncode != 0:
-        raise IOError(err)
-    return int(result.strip().split()[0])
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode(encoding)
+
+
+def merge_files(target_file, part_file):
+    """Append the content of the part file to the target file
+
+    Args:
+       target_file (str): path of the file to be appended
+       part_file (str): path of the file to be copied
+
+    """
+    if os.path.exists(part_file):
+        with open(part_file, 'rb') as src, open(target_file, 'ab') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
 
 
 def mkParentDir(filePath):
     if not os.path.exists(filePath):
         return Path(Path(filePath).parent).mkdir(parents=True, exist_ok=True)
 
+def replace_file(file_path, write, mode='wb'):
+    """Write the file to a uniquely named temporary file in the same directory and replace the file with it,
+    so readers and concurrent writers never see a partially written file
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the file
+        write (:obj:`function`, mandatory): Called with the open temporary file
+        mode (:obj:`str`, optional): Mode to open the temporary file, defaults to 'wb'
+
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', prefix=os.path.basename(file_path) + '.')
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def delete_file_if_exists(_file):
     if os.path.exists(_file):
         os.remove(_file)
@@ -28,10 +28,11 @@ import time
 import argparse
 import os
 from dotenv import load_dotenv
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
 from i2b2_cdi.concept import concept_delete
 from i2b2_cdi.common.bcolors import BColors
+from i2b2_cdi.common.file_reader import get_row_count
 
 SUCCESS = BColors.OKGREEN + "Completed \u2714" + BColors.ENDC
 FAILURE = BColors.FAIL + "Failed \u2716" + BColors.ENDC
@@ -69,17 +70,23 @@ def load_concepts(files):
     logger.info(step)
     time.sleep(1)  # Wait for 10 sec
     try:
-        # Create zip structure
-        zip_file = create_concept_zip(files)
-
-        logger.info('Uploading zip file to sftp folder ')
-        with get_sftp_connection(step) as sftp:
-            with sftp.cd('/concept/'):
-                sftp.put(zip_file)
-        logger.info("Concepts uploaded successfully.")
-        
-        # Removing zip file after successful upload
-        os.remove(zip_file)
+        with cdi_metrics.run('load_concepts', files[0] if files else None):
+            # Create zip structure
+            with cdi_metrics.step('create_concept_zip', files) as metrics:
+                zip_file = create_concept_zip(files)
+                row_count = sum(get_row_count(file) for file in files)
+                metrics.count(row_count, row_count)
+                metrics.written(zip_file)
+
+            logger.info('Uploading zip file to sftp folder ')
+            with cdi_metrics.step('sftp_upload', [zip_file]):
+                with get_sftp_connection(step) as sftp:
+                    with sftp.cd('/concept/'):
+                        sftp.put(zip_file)
+            logger.info("Concepts uploaded successfully.")
+
+            # Removing zip file after successful upload
+            os.remove(zip_file)
         logger.info(SUCCESS)
         print('')
     except Exception:
@@ -0,0 +1,249 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`connection_pool` -- Pool of database connections
+======================================================
+
+.. module:: connection_pool
+    :platform: Linux/Windows
+    :synopsis: module contains process wide pool of pyodbc connections shared by the DataSource context managers
+
+
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.exception.cdi_database_error import CdiDatabaseError
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Pool of connections to one database as one user.
+
+    Idle connections are reused last in first out. A connection idle for longer than the check interval is
+    checked with a query before it is handed out, connections idle for longer than the idle timeout are closed.
+    At most max_size connections are open, further borrowers wait for a returned connection.
+    """
+
+    def __init__(self, connect, max_size=None, idle_timeout=None, wait_timeout=None, check_interval=None):
+        """
+        Args:
+            connect (:obj:`function`, mandatory): Function opening a new connection.
+            max_size (:obj:`int`, optional): Max open connections, defaults to DB_POOL_MAX_SIZE from env.
+            idle_timeout (:obj:`int`, optional): Seconds an idle connection is kept, defaults to DB_POOL_IDLE_TIMEOUT from env.
+            wait_timeout (:obj:`int`, optional): Seconds to wait for a connection, defaults to DB_POOL_WAIT_TIMEOUT from env.
+            check_interval (:obj:`int`, optional): Idle seconds after which a connection is checked, defaults to DB_POOL_CHECK_INTERVAL from env.
+
+        """
+        if max_size is None:
+            max_size = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+        if idle_timeout is None:
+            idle_timeout = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+        if wait_timeout is None:
+            wait_timeout = int(os.getenv('DB_POOL_WAIT_TIMEOUT', 60))
+        if check_interval is None:
+            check_interval = int(os.getenv('DB_POOL_CHECK_INTERVAL', 30))
+        self.connect = connect
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.pid = os.getpid()
+        self.idle = []
+        self.inherited = []
+        self.in_use = 0
+        self.stats = {'created': 0, 'closed': 0, 'borrowed': 0, 'reused': 0,
+                      'failed_checks': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+
+    def acquire(self):
+        """Borrow a connection, a new one is opened if no idle connection is available
+
+        Returns:
+            pyodbc.Connection: database connection
+
+        """
+        start_time = time.time()
+        waited = False
+        with self.condition:
+            self.check_fork()
+            while True:
+                self.evict_idle()
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                    self.in_use += 1
+                    break
+                if self.in_use < self.max_size:
+                    connection = None
+                    self.in_use += 1
+                    break
+                remaining = self.wait_timeout - (time.time() - start_time)
+                if remaining <= 0:
+                    raise CdiDatabaseError('No database connection available in {0} seconds, {1} connections in use'.format(
+                        self.wait_timeout, self.in_use))
+                waited = True
+                self.condition.wait(remaining)
+            if waited:
+                wait_time = time.time() - start_time
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += wait_time
+                self.stats['max_wait_time'] = max(self.stats['max_wait_time'], wait_time)
+            self.stats['borrowed'] += 1
+
+        try:
+            if connection is not None:
+                if time.time() - last_used < self.check_interval or self.is_alive(connection):
+                    with self.condition:
+                        self.stats['reused'] += 1
+                    return connection
+                with self.condition:
+                    self.stats['failed_checks'] += 1
+                self.close_connection(connection)
+            connection = self.connect()
+            with self.condition:
+                self.stats['created'] += 1
+            return connection
+        except BaseException:
+            with self.condition:
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """Return the borrowed connection to the pool
+
+        Args:
+            connection (:obj:`pyodbc.Connection`, mandatory): Borrowed connection
+            discard (:obj:`bool`, optional): Close the connection instead of keeping it (e.g. it is broken)
+
+        """
+        with self.condition:
+            if os.getpid() != self.pid:
+                # Borrowed before the process was forked, the parent owns the connection
+                self.inherited.append(connection)
+                return
+            self.in_use -= 1
+            if not discard:
+                self.idle.append((connection, time.time()))
+            self.condition.notify()
+        if discard:
+            self.close_connection(connection)
+
+    def is_alive(self, connection):
+        """Check the connection with a query"""
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def evict_idle(self):
+        """Close the connections idle for longer than the idle timeout, called with the lock held"""
+        now = time.time()
+        expired = [entry for entry in self.idle if now - entry[1] > self.idle_timeout]
+        if expired:
+            self.idle = [entry for entry in self.idle if now - entry[1] <= self.idle_timeout]
+            for connection, _ in expired:
+                self.close_connection(connection)
+
+    def check_fork(self):
+        """Forget the connections of the parent process in a forked child, called with the lock held.
+        The connections are kept referenced and not closed, closing them would close the socket shared with the parent.
+        """
+        if os.getpid() != self.pid:
+            self.inherited.extend(connection for connection, _ in self.idle)
+            self.idle = []
+            self.in_use = 0
+            self.pid = os.getpid()
+
+    def close_connection(self, connection):
+        """Close the connection, errors of an already broken connection are ignored"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.stats['closed'] += 1
+
+    def close(self):
+        """Close all idle connections"""
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+        for connection, _ in idle:
+            self.close_connection(connection)
+
+    def metrics(self):
+        """Provide the pool metrics
+
+        Returns:
+            dict: open, in use and idle connection counts, borrow and wait statistics
+
+        """
+        with self.condition:
+            metrics = dict(self.stats)
+            metrics['in_use'] = self.in_use
+            metrics['idle'] = len(self.idle)
+            metrics['open'] = self.in_use + len(self.idle)
+            metrics['max_size'] = self.max_size
+        return metrics
+
+
+def get_pool(key, connect):
+    """Provide the pool of the key, the pool is created on first use
+
+    Args:
+        key (:obj:`tuple`, mandatory): (server, database, username)
+        connect (:obj:`function`, mandatory): Function opening a new connection
+
+    Returns:
+        ConnectionPool: pool of the key
+
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect)
+            _pools[key] = pool
+        return pool
+
+
+def pool_metrics():
+    """Provide the metrics of all pools
+
+    Returns:
+        dict: metrics by 'server/database/username'
+
+    """
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {'/'.join(key): pool.metrics() for key, pool in pools}
+
+
+def close_pools():
+    """Close the idle connections of all pools"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
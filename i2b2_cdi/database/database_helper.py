@@ -21,12 +21,46 @@
 """
 # __since__ = "2020-05-08"
 
+import os
+import time
 import pyodbc
 from i2b2_cdi.exception.cdi_database_error import CdiDatabaseError
 from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.utils import get_peak_rss
+from i2b2_cdi.database.connection_pool import get_pool
 
 logger = cdi_logging.get_logger(__file__)
 
+
+def fetch_in_batches(cursor, batch_size=None, name='query'):
+    """Provide the rows of the executed query, fetched from the server in batches using fetchmany.
+    Rows/sec and peak RSS are logged once all rows are fetched.
+
+    Args:
+        cursor (:obj:`pyodbc.Connection.cursor`, mandatory): Cursor on which the query has been executed
+        batch_size (:obj:`int`, optional): Rows per fetch, defaults to FETCH_BATCH_SIZE from env
+        name (:obj:`str`, optional): Name of the query used in the log
+
+    Returns:
+        generator: result rows
+
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv('FETCH_BATCH_SIZE', 50000))
+    cursor.arraysize = batch_size
+    start_time = time.time()
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        row_count += len(rows)
+        for row in rows:
+            yield row
+    elapsed = max(time.time() - start_time, 1e-6)
+    logger.info('Fetched {0} rows of {1} in {2:.1f}s ({3:.0f} rows/sec), peak RSS {4:.0f} MB'.format(
+        row_count, name, elapsed, row_count / elapsed, get_peak_rss() / (1024 * 1024)))
+
 class DataSource:
     """Provided the database connection and cursor"""
     def __init__(
@@ -41,31 +75,51 @@ class DataSource:
         self.password = password #: Database password
         self.connection = None
         self.cursor = None
+        self.pool = None
 
     def __enter__(self):
-        """Create the connection to the database.
+        """Create the connection to the database, the connection is borrowed from the pool if pooling is enabled.
 
         Returns:
             pyodbc.Connection.cursor: Provide the database cursor
             
         """
         try:
-            self.connection = pyodbc.connect(
-                'DRIVER={ODBC Driver 17 for SQL Server};SERVER=' +
-                self.server +
-                ';DATABASE=' +
-                self.database +
-                ';UID=' +
-                self.username +
-                ';PWD=' +
-                self.password)
+            if str(os.getenv('DB_POOL_ENABLED')).lower() == 'true':
+                self.pool = get_pool(
+                    (self.server, self.database, self.username), self.connect)
+                self.connection = self.pool.acquire()
+            else:
+                self.pool = None
+                self.connection = self.connect()
             self.cursor = self.connection.cursor()
             return self.cursor
         except Exception as e:
+            if self.pool and self.connection is not None:
+                self.pool.release(self.connection, discard=True)
+                self.connection = None
             raise
 
+    def connect(self):
+        """Open a new connection to the database
+
+        Returns:
+            pyodbc.Connection: database connection
+
+        """
+        return pyodbc.connect(
+            'DRIVER={ODBC Driver 17 for SQL Server};SERVER=' +
+            self.server +
+            ';DATABASE=' +
+            self.database +
+            ';UID=' +
+            self.username +
+            ';PWD=' +
+            self.password)
+
     def __exit__(self, type, value, traceback):
-        """Close the database connection and cursor and also logs errors if any
+        """Close the database connection and cursor and also logs errors if any.
+        A pooled connection is returned to the pool after commit or rollback, it is discarded if that fails.
 
         Args:
             type (:obj:`type`, mandatory): Type of the exception
@@ -73,16 +127,28 @@ class DataSource:
             traceback (:obj:`traceback`, mandatory): traceback of the exception
             
         """
-        if type:
-            self.connection.rollback()
-            logger.error('Type: ', type)
-            logger.error('Value: ', value)
-            logger.error('Traceback: ', traceback)
-        else:
-            self.connection.commit()
+        pool = self.pool
+        try:
+            if type:
+                self.connection.rollback()
+                logger.error('Type: %s', type)
+                logger.error('Value: %s', value)
+                logger.error('Traceback: %s', traceback)
+            else:
+                self.connection.commit()
+        except Exception:
+            if pool:
+                self.cursor.close()
+                pool.release(self.connection, discard=True)
+                self.connection = None
+            raise
 
         self.cursor.close()
-        self.connection.close()
+        if pool:
+            pool.release(self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
 
     def check_database_connection(self):
         """Check whether the database conection is live or not"""
@@ -21,15 +21,19 @@
 
 """
 
-from dateformat import DateFormat
 import os
 from pathlib import Path
 import csv
 from datetime import datetime as DateTime
 from i2b2_cdi.exception.cdi_max_err_reached import MaxErrorCountReachedError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+from i2b2_cdi.common.file_writer import WriterSession
+from i2b2_cdi.common.row_plan import RowPlan
+from i2b2_cdi.common.pipeline import Pipeline
+from i2b2_cdi.common.date_validator import is_valid_datetime
 from alive_progress import alive_bar, config_handler
 from i2b2_cdi.common.utils import *
+from i2b2_cdi.common.file_reader import open_csv
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
 from i2b2_cdi.patient import patient_mapping as PatientMapping
 from i2b2_cdi.encounter import encounter_mapping as EncounterMapping
@@ -45,9 +49,9 @@ class DeidEncounter:
     """The class provides the interface for de-identifying i.e. (mapping src encounter id to i2b2 generated encounter num) encounter file"""
 
     def __init__(self):
-        self.date_format = DateFormat("YYYY-MM-DD hh:mm:ss")
         self.err_records_max = int(os.getenv('MAX_VALIDATION_ERROR_COUNT'))
         self.write_batch_size = 100
+        self.writer_session = WriterSession()
         now = DateTime.now()
         self.import_time = now.strftime("%Y-%m-%d %H:%M:%S")
         self.deid_header = ['EncounterID', 'PatientID', 'StartDate',
@@ -69,8 +73,7 @@ class DeidEncounter:
 
         """
         _error_rows_arr = []
-        _valid_rows_arr = []
-        max_line = file_len(csv_file_path)
+        max_line = progress_total(csv_file_path)
         logger.info('De-identifing encounter file : ' + csv_file_path)
         try:
             # Write file header
@@ -79,47 +82,53 @@ class DeidEncounter:
             print('\n')
 
             # Read input csv file
-            with open(csv_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
-                    csv_file, delimiter=input_csv_delimiter)
+            with open_csv(csv_file_path, input_csv_delimiter) as (csv_file, csv_reader):
+                # Rows are lists in deid file layout, fields are accessed by index
+                columns = ['EncounterID', 'PatientID', 'StartDate', 'EndDate']
+                plan = RowPlan(next(csv_reader, None),
+                               self.deid_header, required=columns)
+                encounter_col, patient_col, start_date_col, end_date_col = [
+                    plan.index[name] for name in columns]
                 row_number = 0
-                with alive_bar(max_line, bar='smooth') as bar:
-                    for row in csv_reader:
+
+                def deidentify_block(rows):
+                    nonlocal row_number
+                    _valid_rows_arr = []
+                    for row in rows:
                         _validation_error = []
                         row_number += 1
 
                         # Validate record
-                        if not row['EncounterID']:
+                        if not row[encounter_col]:
                             _validation_error.append("Encounter ID is Null")
-                        if not row['PatientID']:
+                        if not row[patient_col]:
                             _validation_error.append("Patient ID is Null")
-                        if row['StartDate'] and not self.is_valid_date_format(row['StartDate']):
+                        if row[start_date_col] and not self.is_valid_date_format(row[start_date_col]):
                             _validation_error.append(
                                 "Invalid start date format")
-                        if row['EndDate'] and not self.is_valid_date_format(row['EndDate']):
+                        if row[end_date_col] and not self.is_valid_date_format(row[end_date_col]):
                             _validation_error.append("Invalid end date format")
 
                         # Replace src encounter id by i2b2 encounter num
-                        encounter_num = encounter_map.get(row['EncounterID'])
+                        encounter_num = encounter_map.get(row[encounter_col])
                         if encounter_num is None:
                             _validation_error.append(
                                 "Encounter mapping not found")
                         else:
-                            row['EncounterID'] = encounter_num
+                            row[encounter_col] = encounter_num
 
                         # Replace src patient id by i2b2 patient num
-                        patient_num = patient_map.get(row['PatientID'])
+                        patient_num = patient_map.get(row[patient_col])
                         if patient_num is None:
                             _validation_error.append(
                                 "Patient mapping not found")
                         else:
-                            row['PatientID'] = patient_num
+                            row[patient_col] = patient_num
 
                         # Append error record if found
                         if _validation_error:
-                            row['ValidationError'] = ','.join(
-                                _validation_error)
-                            row['ErrorRowNumber'] = str(row_number)
+                            row.append(','.join(_validation_error))
+                            row.append(str(row_number))
                             _error_rows_arr.append(row)
                         else:
                             _valid_rows_arr.append(row)
@@ -133,26 +142,31 @@ class DeidEncounter:
                             raise MaxErrorCountReachedError(
                                 "Exiting function as max errors records limit reached - " + str(self.err_records_max))
 
-                        # Write valid records to file, if batch size reached.
-                        if len(_valid_rows_arr) == self.write_batch_size:
-                            self.write_to_deid_file(
-                                _valid_rows_arr, deid_file_path, output_deid_delimiter)
-                            _valid_rows_arr = []
+                    # Print progress
+                    progress(incr=len(rows))
+                    return _valid_rows_arr
 
-                        # Print progress
-                        bar()
+                def write_block(_valid_rows_arr):
+                    self.write_to_deid_file(
+                        _valid_rows_arr, deid_file_path, output_deid_delimiter)
 
-                # Writer valid records to file (remaining records when given batch size does not meet)
-                self.write_to_deid_file(
-                    _valid_rows_arr, deid_file_path, output_deid_delimiter)
+                # Parsing, de-identification and writing of blocks overlap
+                with alive_bar(max_line, bar='smooth') as bar:
+                    progress = FileProgress(csv_file, bar)
+                    Pipeline().run(plan.rows(csv_reader),
+                                   deidentify_block, write_block)
+                    progress.update()
 
                 # Write error records to file
                 self.write_to_error_file(error_file_path, _error_rows_arr)
+                cdi_metrics.count(row_number, row_number - len(_error_rows_arr), len(_error_rows_arr))
             print('\n')
         except MaxErrorCountReachedError:
             raise
         except Exception as e:
             raise e
+        finally:
+            self.writer_session.close()
 
     def is_valid_date_format(self, _date):
         """This method checks for date format
@@ -163,11 +177,7 @@ class DeidEncounter:
         Returns:
             boolean: True if date format is correct else false.
         """
-        try:
-            self.date_format.parse(_date)
-            return True
-        except ValueError:
-            return False
+        return is_valid_datetime(_date)
 
     def write_deid_file_header(self, deid_file_path, output_deid_delimiter):
         """This method writes the header of deid file using csv writer
@@ -177,10 +187,9 @@ class DeidEncounter:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerow(self.deid_header)
         except Exception as e:
             raise e
 
@@ -194,10 +203,9 @@ class DeidEncounter:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writerows(_valid_rows_arr)
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerows(_valid_rows_arr)
         except Exception as e:
             raise e
 
@@ -209,10 +217,9 @@ class DeidEncounter:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerow(self.error_file_header)
         except Exception as e:
             raise e
 
@@ -225,10 +232,9 @@ class DeidEncounter:
 
         """
         try:
-            with open(error_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writerows(_error_rows_arr)
+            writer = self.writer_session.get_writer(
+                error_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerows(_error_rows_arr)
         except Exception as e:
             raise e
 
@@ -261,8 +267,9 @@ def do_deidentify(csv_file_path):
         input_csv_delimiter = str(os.getenv('CSV_DELIMITER'))
         output_deid_delimiter = str(os.getenv('CSV_DELIMITER'))
 
-        # Create encounter mapping
-        EncounterMapping.create_encounter_mapping(csv_file_path)
+        # Create encounter mapping, metrics are recorded as a separate step nested in the de-identification
+        with cdi_metrics.step('create_encounter_mapping', [csv_file_path]):
+            EncounterMapping.create_encounter_mapping(csv_file_path)
 
         # Get patient mapping and encounter mapping
         patient_map = PatientMapping.get_patient_mapping()
@@ -25,6 +25,7 @@ import os
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
 from i2b2_cdi.exception.cdi_database_error import CdiDatabaseError
 from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.mapping_cache import encounter_mapping_cache
 
 logger = cdi_logging.get_logger(__file__)
 
@@ -52,6 +53,7 @@ def delete_encounter_mapping():
 
         with I2b2demoDataSource() as cursor:
             delete(cursor, queries)
+        encounter_mapping_cache().invalidate()
     except Exception as e:
         raise CdiDatabaseError("Couldn't delete data: {0}".format(str(e)))
 
@@ -25,10 +25,14 @@ import os
 import csv
 from datetime import datetime as DateTime
 from i2b2_cdi.common.utils import *
+from i2b2_cdi.common.file_reader import open_csv, dict_rows
 from i2b2_cdi.patient import patient_mapping as PatientMapping
+from i2b2_cdi.common.id_map import IdMap
+from i2b2_cdi.common.mapping_cache import encounter_mapping_cache
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
+from i2b2_cdi.database.database_helper import fetch_in_batches
 from i2b2_cdi.exception.cdi_database_error import CdiDatabaseError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from alive_progress import alive_bar, config_handler
 from dotenv import load_dotenv
 
@@ -60,25 +64,26 @@ class EncounterMapping:
             'Creating encounter mapping from input file : ' + csv_file_path)
         try:
             # max lines
-            max_line = file_len(csv_file_path)
+            max_line = progress_total(csv_file_path)
 
             # Get max of encounter_num
             self.encounter_num = self.get_max_encounter_num()
+            max_encounter_num = self.encounter_num
 
             # Get existing encounter mapping
             encounter_map = get_encounter_mapping()
 
             # Read input csv file
-            with open(csv_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
-                    csv_file, delimiter=input_csv_delimiter)
+            with open_csv(csv_file_path, input_csv_delimiter) as (csv_file, csv_reader):
+                csv_reader = dict_rows(csv_reader)
                 row_number = 0
                 with alive_bar(max_line, bar='smooth') as bar:
+                    progress = FileProgress(csv_file, bar)
                     for row in csv_reader:
                         row_number += 1
 
                         # Print progress
-                        bar()
+                        progress()
 
                         if not row['EncounterID']:
                             continue
@@ -98,6 +103,8 @@ class EncounterMapping:
                     
                     # Save remianing encounters (if encounter list size is less then write_batch_size )
                     self.save_encounter_mapping(self.encounter_list)
+                    progress.update()
+                cdi_metrics.count(row_number, self.encounter_num - max_encounter_num)
             print('\n')
         except Exception as e:
             raise e
@@ -194,14 +201,19 @@ def get_encounter_mapping():
     encounter_map = {}
     try:
         logger.info("Getting data from encounter mapping")
+        compact = str(os.getenv('COMPACT_ID_MAP')).lower() == 'true'
+        if str(os.getenv('MAPPING_CACHE_ENABLED')).lower() == 'true':
+            return encounter_mapping_cache().get_mapping(compact)
         query = 'SELECT encounter_ide, encounter_num FROM encounter_mapping'
 
         with I2b2demoDataSource() as cursor:
             cursor.execute(query)
-            result = cursor.fetchall()
-            if result:
+            result = fetch_in_batches(cursor, name='encounter_mapping')
+            if compact:
+                encounter_map = IdMap.from_items(result)
+            else:
                 for row in result:
-                    encounter_map.update({row[0]: row[1]})
+                    encounter_map[row[0]] = row[1]
 
         return encounter_map
     except Exception as e:
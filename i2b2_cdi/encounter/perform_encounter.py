@@ -28,9 +28,9 @@ import os
 from dotenv import load_dotenv
 from i2b2_cdi.encounter import deid_encounter as DeidEncounter
 from i2b2_cdi.encounter import transform_file as TransformFile
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
-from i2b2_cdi.common.py_bcp import PyBCP
+from i2b2_cdi.common.uploader import get_uploader
 from i2b2_cdi.encounter import delete_encounter as DeleteEncounter
 from i2b2_cdi.common.bcolors import BColors
 
@@ -101,9 +101,10 @@ def load_encounters(file_path):
     Args:
         file_path (:obj:`str`, mandatory): Path to the file which needs to be imported
     """
-    deid_file_path = de_identify_encounters(file_path)
-    bcp_file_path = convert_csv_to_bcp(deid_file_path)
-    bcp_upload(bcp_file_path)
+    with cdi_metrics.run('load_encounters', file_path):
+        deid_file_path = de_identify_encounters(file_path)
+        bcp_file_path = convert_csv_to_bcp(deid_file_path)
+        bcp_upload(bcp_file_path)
 
 
 def de_identify_encounters(file_path):
@@ -116,8 +117,10 @@ def de_identify_encounters(file_path):
     step = BColors.HEADER + "De-identify encounters" + BColors.ENDC
     logger.info(step)
     try:
-        deid_file_path, error_file_path = DeidEncounter.do_deidentify(
-            file_path)
+        with cdi_metrics.step('de_identify_encounters', [file_path]) as metrics:
+            deid_file_path, error_file_path = DeidEncounter.do_deidentify(
+                file_path)
+            metrics.written(deid_file_path, error_file_path)
         logger.info(
             "Check error logs of encounter de-identification if any : " + error_file_path)
         logger.info(SUCCESS)
@@ -139,7 +142,9 @@ def convert_csv_to_bcp(file_path):
     step = BColors.HEADER + "Convert CSV to BCP" + BColors.ENDC
     logger.info(step)
     try:
-        bcp_file_path, error_file_path = TransformFile.do_transform(file_path)
+        with cdi_metrics.step('convert_csv_to_bcp', [file_path]) as metrics:
+            bcp_file_path, error_file_path = TransformFile.do_transform(file_path)
+            metrics.written(bcp_file_path, error_file_path)
         logger.info(
             "Check error logs of csv to bcp conversion if any : " + error_file_path)
         logger.info(SUCCESS)
@@ -161,25 +166,27 @@ def bcp_upload(bcp_file_path):
     logger.info(step)
     base_dir = str(Path(bcp_file_path).parents[2])
     try:
-        _bcp = PyBCP(
+        _bcp = get_uploader(
             table_name="visit_dimension_temp",
             import_file=bcp_file_path,
             delimiter=str(os.getenv('CSV_DELIMITER')),
             batch_size=10000,
             error_file= base_dir + "/logs/error_bcp_encounters.log")
-        # Create visit dimension temp table
-        create_table_path = Path('i2b2_cdi/resources/sql') / \
-            'create_visit_dimension_temp.sql'
-        _bcp.execute_sql(create_table_path)
-        _bcp.upload()
-        # Add new columns in visit dimension
-        add_column_path = Path(
-            'i2b2_cdi/resources/sql') / 'add_columns_visit_dimension.sql'
-        _bcp.execute_sql(add_column_path)
-        # Load encounters from temp to visit dimension
-        load_encounter_path = Path(
-            'i2b2_cdi/resources/sql') / 'load_visit_dimension_from_temp.sql'
-        _bcp.execute_sql(load_encounter_path)
+        with cdi_metrics.step('bcp_upload', [bcp_file_path]) as metrics:
+            # Create visit dimension temp table
+            create_table_path = Path('i2b2_cdi/resources/sql') / \
+                'create_visit_dimension_temp.sql'
+            _bcp.execute_sql(create_table_path)
+            row_count = _bcp.upload()
+            metrics.count(row_count, row_count)
+            # Add new columns in visit dimension
+            add_column_path = Path(
+                'i2b2_cdi/resources/sql') / 'add_columns_visit_dimension.sql'
+            _bcp.execute_sql(add_column_path)
+            # Load encounters from temp to visit dimension
+            load_encounter_path = Path(
+                'i2b2_cdi/resources/sql') / 'load_visit_dimension_from_temp.sql'
+            _bcp.execute_sql(load_encounter_path)
         logger.info(SUCCESS)
     except Exception as e:
         logger.error(traceback.format_exc())
@@ -29,7 +29,9 @@ import csv
 from datetime import datetime as DateTime
 from i2b2_cdi.exception.cdi_max_err_reached import MaxErrorCountReachedError
 from i2b2_cdi.exception.cdi_csv_conversion_error import CsvToBcpConversionError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+from i2b2_cdi.common.file_writer import WriterSession
+from i2b2_cdi.common.row_plan import RowPlan
 from alive_progress import alive_bar, config_handler
 import time
 from i2b2_cdi.common.utils import *
@@ -47,6 +49,7 @@ class TransformFile:
     def __init__(self):
         self.date_format = DateFormat("YYYY-MM-DD hh:mm:ss")
         self.write_batch_size = 100
+        self.writer_session = WriterSession()
         self.error_count = 0
         self.error_count_max = 100
         now = DateTime.now()
@@ -67,22 +70,26 @@ class TransformFile:
         """
         _error_rows_arr = []
         _valid_rows_arr = []
-        max_line = file_len(csv_file_path) - 1
+        max_line = progress_total(csv_file_path)
 
         try:
             print('\n')
             # Read input csv file
             with open(csv_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
+                csv_reader = csv.reader(
                     csv_file, delimiter=input_csv_delimiter)
+                # Rows are lists in bcp file layout, fields are accessed by index
+                plan = RowPlan(next(csv_reader, None), self.bcp_header)
+                import_date_col = plan.index['ImportDate']
                 row_number = 0
                 with alive_bar(max_line, bar='smooth') as bar:
-                    for row in csv_reader:
+                    progress = FileProgress(csv_file, bar)
+                    for row in plan.rows(csv_reader):
                         try:
                             _validation_error = []
                             row_number += 1
 
-                            row['ImportDate'] = self.import_time
+                            row[import_date_col] = self.import_time
                             _valid_rows_arr.append(row)
 
                             # Write valid records to file, if batch size reached.
@@ -92,7 +99,7 @@ class TransformFile:
                                 _valid_rows_arr = []
 
                             # Print progress
-                            bar()
+                            progress()
                         except Exception as e:
                             logger.error(e)
                             self.error_count += 1
@@ -103,12 +110,16 @@ class TransformFile:
                     # Writer valid records to file (remaining records when given batch size does not meet)
                     self.write_to_bcp_file(
                         _valid_rows_arr, bcp_file_path, output_bcp_delimiter)
+                    progress.update()
+                cdi_metrics.count(row_number, row_number - self.error_count, self.error_count)
                 print('\n')
         except MaxErrorCountReachedError:
             raise
         except Exception as e:
             raise CsvToBcpConversionError(cdi_logging.format_error_log(
                 "Failed to convert csv to bcp file", e))
+        finally:
+            self.writer_session.close()
 
     def write_to_bcp_file(self, _valid_rows_arr, bcp_file_path, output_bcp_delimiter):
         """This method writes the list of rows to the bcp file using csv writer
@@ -120,10 +131,9 @@ class TransformFile:
 
         """
         try:
-            with open(bcp_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.bcp_header, delimiter=output_bcp_delimiter, lineterminator='\n')
-                writer.writerows(_valid_rows_arr)
+            writer = self.writer_session.get_writer(
+                bcp_file_path, delimiter=output_bcp_delimiter, lineterminator='\n')
+            writer.writerows(_valid_rows_arr)
         except Exception as e:
             raise e
 
@@ -21,18 +21,25 @@
 
 """
 
-from dateformat import DateFormat
 import os
 from pathlib import Path
 import csv
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as DateTime
 from i2b2_cdi.exception.cdi_max_err_reached import MaxErrorCountReachedError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+from i2b2_cdi.common.file_writer import WriterSession
+from i2b2_cdi.common.row_plan import RowPlan
+from i2b2_cdi.common.pipeline import Pipeline
+from i2b2_cdi.common.date_validator import is_valid_datetime
 from alive_progress import alive_bar, config_handler
 from i2b2_cdi.common.utils import *
+from i2b2_cdi.common.file_reader import open_csv, can_split
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
 from i2b2_cdi.patient import patient_mapping as PatientMapping
 from i2b2_cdi.encounter import encounter_mapping as EncounterMapping
+from i2b2_cdi.fact.transform_file import TransformFile
 from dotenv import load_dotenv
 
 config_handler.set_global(length=50, spinner='triangles2')
@@ -40,14 +47,28 @@ logger = cdi_logging.get_logger(__file__)
 env_path = Path('i2b2_cdi/resources') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Mappings and upload id shared with the shard worker processes
+_shard_patient_map = None
+_shard_encounter_map = None
+_shard_upload_id = None
+
 
 class DeidFact:
     """The class provides the interface for de-identifying i.e. (mapping src patient id to i2b2 generated patient num) observation fact file"""
 
-    def __init__(self):
-        self.date_format = DateFormat("YYYY-MM-DD hh:mm:ss")
+    def __init__(self, upload_id=None):
+        """
+        Args:
+            upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows of the fused pipeline
+
+        """
         self.err_records_max = int(os.getenv('MAX_VALIDATION_ERROR_COUNT'))
         self.write_batch_size = 100
+        self.writer_session = WriterSession()
+        self.workers = int(os.getenv('DEID_WORKERS', 1))
+        self.transform = None
+        self.upload_id = upload_id
+        self.bcp_line_num = 0
         now = DateTime.now()
         self.import_time = now.strftime("%Y-%m-%d %H:%M:%S")
         self.deid_header = ['EncounterID', 'PatientID', 'ConceptCD', 'ProviderID',
@@ -55,111 +76,279 @@ class DeidFact:
         self.error_file_header = ['EncounterID', 'PatientID', 'ConceptCD', 'ProviderID', 'StartDate',
                                   'ModifierCD', 'InstanceNum', 'value', 'UnitCD', 'ValidationError', 'ErrorRowNumber']
 
-    def deidentify_fact(self, patient_map, encounter_map, obs_file_path, input_csv_delimiter, deid_file_path, output_deid_delimiter, error_file_path):
-        """This method de-identifies csv file and error records will be logged to log file
+    def deidentify_fact(self, patient_map, encounter_map, obs_file_path, input_csv_delimiter, deid_file_path, output_deid_delimiter, error_file_path, bcp_file_path=None, output_bcp_delimiter=None, max_line=None):
+        """This method de-identifies csv file and error records will be logged to log file.
+        If bcp file path is provided, valid records are also converted to bcp rows in the same pass (fused mode).
 
         Args:
             patient_map (:obj:`str`, mandatory): Patient map for de-identification.
             encounter_map (:obj:`str`, mandatory): Encounter map for de-identification.
             obs_file_path (:obj:`str`, mandatory): Path to the input csv file which needs to be de-identified
             input_csv_delimiter (:obj:`str`, mandatory): Delimiter of the input csv file, which will be used while reading csv file.
-            deid_file_path (:obj:`str`, mandatory): Path to the de-identified output file.
+            deid_file_path (:obj:`str`, mandatory): Path to the de-identified output file, deid file is not written if None.
             output_deid_delimiter (:obj:`str`, mandatory): Delimiter of the output file, which will be used while writing deid file.
             error_file_path (:obj:`str`, mandatory): Path to the error file, which contains error records
+            bcp_file_path (:obj:`str`, optional): Path to the output bcp file.
+            output_bcp_delimiter (:obj:`str`, optional): Delimiter of the output bcp file.
+            max_line (:obj:`int`, optional): Total of the progress bar, see :func:`progress_total`.
 
         """
 
-        _error_rows_arr = []
-        _valid_rows_arr = []
-        max_line = file_len(obs_file_path)
+        if max_line is None:
+            max_line = progress_total(obs_file_path)
         logger.info('De-identifing observation fact file : ' + obs_file_path)
         try:
             # Write file header
-            self.write_deid_file_header(deid_file_path, output_deid_delimiter)
+            if deid_file_path:
+                self.write_deid_file_header(
+                    deid_file_path, output_deid_delimiter)
             self.write_error_file_header(error_file_path)
             print('\n')
 
             # Read input csv file
-            with open(obs_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
-                    csv_file, delimiter=input_csv_delimiter)
-                row_number = 0
+            with open_csv(obs_file_path, input_csv_delimiter) as (csv_file, csv_reader):
+                fieldnames = next(csv_reader, None)
                 with alive_bar(max_line, bar='smooth') as bar:
-                    for row in csv_reader:
-                        _validation_error = []
-                        row_number += 1
-
-                        # Validate record
-                        if not row['PatientID']:
-                            _validation_error.append("PatientID is Null")
-                        if not row['ConceptCD']:
-                            _validation_error.append("ConceptCD is Null")
-                        if not row['ProviderID']:
-                            row['ProviderID'] = 0
-                        if row['StartDate'] and not self.is_valid_date_format(row['StartDate']):
-                            _validation_error.append(
-                                "Invalid start date format")
-                        if not row['ModifierCD']:
-                            row['ModifierCD'] = '@'
-                        if not row['InstanceNum']:
-                            row['InstanceNum'] = 1
-
-                        # Replace src patient id by i2b2 patient num
-                        patient_num = patient_map.get(row['PatientID'])
-                        if patient_num is None:
-                            _validation_error.append(
-                                "Patient mapping not found")
-                        else:
-                            row['PatientID'] = patient_num
-
-                        # Replace src encounter id by i2b2 encounter num
-                        if row['EncounterID']:
-                            encounter_num = encounter_map.get(row['EncounterID'])
-                            if encounter_num is None:
-                                _validation_error.append("Encounter mapping not found")
-                            else:
-                                row['EncounterID'] = encounter_num
-                        else:
-                            row['EncounterID'] = 0
-
-                        # Append error record if found
-                        if _validation_error:
-                            row['ValidationError'] = ','.join(
-                                _validation_error)
-                            row['ErrorRowNumber'] = str(row_number)
-                            _error_rows_arr.append(row)
-                        else:
-                            _valid_rows_arr.append(row)
-
-                        # Exit processing, if max error records limit reached.
-                        if len(_error_rows_arr) > self.err_records_max:
-                            self.write_to_error_file(
-                                error_file_path, _error_rows_arr)
-                            logger.error(
-                                'Exiting observation fact de-identifying as max errors records limit reached - ' + str(self.err_records_max))
-                            raise MaxErrorCountReachedError(
-                                "Exiting function as max errors records limit reached - " + str(self.err_records_max))
-
-                        # Write valid records to file, if batch size reached.
-                        if len(_valid_rows_arr) == self.write_batch_size:
-                            self.write_to_deid_file(
-                                _valid_rows_arr, deid_file_path, output_deid_delimiter)
-                            _valid_rows_arr = []
-
-                        # Print progress
-                        bar()
-
-                # Writer valid records to file (remaining records when given batch size does not meet)
-                self.write_to_deid_file(
-                    _valid_rows_arr, deid_file_path, output_deid_delimiter)
-
-                # Write error records to file
-                self.write_to_error_file(error_file_path, _error_rows_arr)
+                    progress = FileProgress(csv_file, bar)
+                    row_count, error_count = self.deidentify_rows(csv_reader, fieldnames, patient_map, encounter_map, deid_file_path, output_deid_delimiter,
+                                                                  error_file_path, bcp_file_path, output_bcp_delimiter, progress)
+                    progress.update()
+                cdi_metrics.count(row_count, row_count - error_count, error_count)
             print('\n')
         except MaxErrorCountReachedError:
             raise
         except Exception as e:
             raise e
+        finally:
+            self.close_writers()
+
+    def deidentify_rows(self, csv_reader, fieldnames, patient_map, encounter_map, deid_file_path, output_deid_delimiter, error_file_path, bcp_file_path=None, output_bcp_delimiter=None, bar=None):
+        """This method de-identifies the rows provided by the csv reader, file headers are not written
+
+        Args:
+            csv_reader (:obj:`csv.reader`, mandatory): Reader providing the fact rows, positioned after the header.
+            fieldnames (:obj:`list`, mandatory): Header of the fact file.
+            patient_map (:obj:`str`, mandatory): Patient map for de-identification.
+            encounter_map (:obj:`str`, mandatory): Encounter map for de-identification.
+            deid_file_path (:obj:`str`, mandatory): Path to the de-identified output file, deid file is not written if None.
+            output_deid_delimiter (:obj:`str`, mandatory): Delimiter of the output file, which will be used while writing deid file.
+            error_file_path (:obj:`str`, mandatory): Path to the error file, which contains error records
+            bcp_file_path (:obj:`str`, optional): Path to the output bcp file.
+            output_bcp_delimiter (:obj:`str`, optional): Delimiter of the output bcp file.
+            bar (:obj:`function`, optional): Progress callback invoked once per block of rows with the row count as incr.
+
+        Returns:
+            int: count of rows read
+            int: count of error rows
+
+        """
+        _error_rows_arr = []
+        pipeline = Pipeline()
+        if bcp_file_path:
+            self.transform = TransformFile(self.upload_id)
+            self.bcp_line_num = 0
+        # Rows are lists in deid file layout, fields are accessed by index
+        columns = ['EncounterID', 'PatientID', 'ConceptCD',
+                   'ProviderID', 'StartDate', 'ModifierCD', 'InstanceNum']
+        plan = RowPlan(fieldnames, self.deid_header, required=columns)
+        (encounter_col, patient_col, concept_col, provider_col, start_date_col,
+         modifier_col, instance_col) = [plan.index[name] for name in columns]
+        row_number = 0
+
+        def deidentify_block(rows):
+            nonlocal row_number
+            _valid_rows_arr = []
+            for row in rows:
+                _validation_error = []
+                row_number += 1
+
+                # Validate record
+                if not row[patient_col]:
+                    _validation_error.append("PatientID is Null")
+                if not row[concept_col]:
+                    _validation_error.append("ConceptCD is Null")
+                if not row[provider_col]:
+                    row[provider_col] = 0
+                if row[start_date_col] and not self.is_valid_date_format(row[start_date_col]):
+                    _validation_error.append(
+                        "Invalid start date format")
+                if not row[modifier_col]:
+                    row[modifier_col] = '@'
+                if not row[instance_col]:
+                    row[instance_col] = 1
+
+                # Replace src patient id by i2b2 patient num
+                patient_num = patient_map.get(row[patient_col])
+                if patient_num is None:
+                    _validation_error.append(
+                        "Patient mapping not found")
+                else:
+                    row[patient_col] = patient_num
+
+                # Replace src encounter id by i2b2 encounter num
+                if row[encounter_col]:
+                    encounter_num = encounter_map.get(row[encounter_col])
+                    if encounter_num is None:
+                        _validation_error.append("Encounter mapping not found")
+                    else:
+                        row[encounter_col] = encounter_num
+                else:
+                    row[encounter_col] = 0
+
+                # Append error record if found
+                if _validation_error:
+                    row.append(','.join(_validation_error))
+                    row.append(str(row_number))
+                    _error_rows_arr.append(row)
+                else:
+                    _valid_rows_arr.append(row)
+
+                # Exit processing, if max error records limit reached.
+                if len(_error_rows_arr) > self.err_records_max:
+                    self.write_to_error_file(
+                        error_file_path, _error_rows_arr)
+                    logger.error(
+                        'Exiting observation fact de-identifying as max errors records limit reached - ' + str(self.err_records_max))
+                    raise MaxErrorCountReachedError(
+                        "Exiting function as max errors records limit reached - " + str(self.err_records_max))
+
+            # Print progress
+            if bar:
+                bar(incr=len(rows))
+            return _valid_rows_arr
+
+        def write_block(_valid_rows_arr):
+            self.write_valid_rows(
+                _valid_rows_arr, deid_file_path, output_deid_delimiter, bcp_file_path, output_bcp_delimiter)
+
+        # Parsing, de-identification and writing (with bcp conversion in fused mode) of blocks overlap
+        pipeline.run(plan.rows(csv_reader), deidentify_block, write_block)
+
+        # Write error records to file
+        self.write_to_error_file(error_file_path, _error_rows_arr)
+        return row_number, len(_error_rows_arr)
+
+    def deidentify_fact_parallel(self, patient_map, encounter_map, obs_file_path, input_csv_delimiter, deid_file_path, output_deid_delimiter, error_file_path, bcp_file_path=None, output_bcp_delimiter=None, workers=2):
+        """This method splits the csv file in line aligned chunks and de-identifies them in a process pool.
+        Shard outputs are merged in input order, ErrorRowNumber and bcp LINE_NUM are renumbered while merging.
+        Input rows must not contain quoted line breaks.
+
+        Args:
+            patient_map (:obj:`str`, mandatory): Patient map for de-identification.
+            encounter_map (:obj:`str`, mandatory): Encounter map for de-identification.
+            obs_file_path (:obj:`str`, mandatory): Path to the input csv file which needs to be de-identified
+            input_csv_delimiter (:obj:`str`, mandatory): Delimiter of the input csv file, which will be used while reading csv file.
+            deid_file_path (:obj:`str`, mandatory): Path to the de-identified output file, deid file is not written if None.
+            output_deid_delimiter (:obj:`str`, mandatory): Delimiter of the output file, which will be used while writing deid file.
+            error_file_path (:obj:`str`, mandatory): Path to the error file, which contains error records
+            bcp_file_path (:obj:`str`, optional): Path to the output bcp file.
+            output_bcp_delimiter (:obj:`str`, optional): Delimiter of the output bcp file.
+            workers (:obj:`int`, optional): Number of worker processes.
+
+        """
+        logger.info('De-identifing observation fact file using ' +
+                    str(workers) + ' workers : ' + obs_file_path)
+        with open(obs_file_path, mode='rb') as csv_file:
+            header_line = csv_file.readline()
+        fieldnames = next(csv.reader(
+            [header_line.decode('utf-8')], delimiter=input_csv_delimiter))
+        chunks = get_file_chunks(
+            obs_file_path, workers * 4, offset=len(header_line))
+
+        tasks = []
+        for index, (start, end) in enumerate(chunks):
+            part = '.part' + str(index)
+            tasks.append((obs_file_path, start, end, fieldnames, input_csv_delimiter,
+                          deid_file_path + part if deid_file_path else None, output_deid_delimiter,
+                          error_file_path + part, bcp_file_path + part if bcp_file_path else None, output_bcp_delimiter))
+
+        # Write file header
+        if deid_file_path:
+            self.write_deid_file_header(deid_file_path, output_deid_delimiter)
+        self.write_error_file_header(error_file_path)
+        # Headers must be on disk before forking and merging the shard outputs
+        self.close_writers()
+
+        results = []
+        try:
+            print('\n')
+            with multiprocessing.Pool(workers, initializer=_init_shard_worker, initargs=(patient_map, encounter_map, self.upload_id)) as pool:
+                with alive_bar(len(tasks), bar='smooth') as bar:
+                    for result in pool.imap(_deidentify_shard, tasks):
+                        results.append(result)
+                        bar()
+            print('\n')
+        finally:
+            # Merge shard outputs, error records are merged even if a shard failed
+            row_offset = 0
+            line_offset = 0
+            for index, task in enumerate(tasks):
+                if index > len(results):
+                    break
+                self.merge_error_file(error_file_path, task[7], row_offset)
+                if index < len(results):
+                    if deid_file_path:
+                        merge_files(deid_file_path, task[5])
+                    if bcp_file_path:
+                        self.merge_bcp_file(
+                            bcp_file_path, task[8], output_bcp_delimiter, line_offset)
+                    row_offset += results[index][0]
+                    line_offset += results[index][0] - results[index][1]
+            for task in tasks:
+                for part_file in (task[5], task[7], task[8]):
+                    if part_file:
+                        delete_file_if_exists(part_file)
+
+        row_count = sum(result[0] for result in results)
+        error_count = sum(result[1] for result in results)
+        cdi_metrics.count(row_count, row_count - error_count, error_count)
+        if error_count > self.err_records_max:
+            logger.error(
+                'Exiting observation fact de-identifying as max errors records limit reached - ' + str(self.err_records_max))
+            raise MaxErrorCountReachedError(
+                "Exiting function as max errors records limit reached - " + str(self.err_records_max))
+
+    def close_writers(self):
+        """This method flushes and closes the deid, error and bcp files kept open by the writer sessions"""
+        self.writer_session.close()
+        if self.transform:
+            self.transform.writer_session.close()
+
+    def merge_error_file(self, error_file_path, part_file_path, row_offset):
+        """This method appends shard error records to the error file and shifts ErrorRowNumber by the row offset
+
+        Args:
+            error_file_path (:obj:`str`, mandatory): Path to the error file.
+            part_file_path (:obj:`str`, mandatory): Path to the shard error file.
+            row_offset (:obj:`int`, mandatory): Count of input rows in the preceding shards.
+
+        """
+        if not os.path.exists(part_file_path):
+            return
+        with open(part_file_path, mode='r') as part_file, open(error_file_path, 'a+') as csvfile:
+            writer = csv.writer(csvfile, delimiter=',',
+                                quoting=csv.QUOTE_ALL)
+            for row in csv.reader(part_file, delimiter=','):
+                row[-1] = str(int(row[-1]) + row_offset)
+                writer.writerow(row)
+
+    def merge_bcp_file(self, bcp_file_path, part_file_path, output_bcp_delimiter, line_offset):
+        """This method appends shard bcp rows to the bcp file and shifts LINE_NUM by the line offset
+
+        Args:
+            bcp_file_path (:obj:`str`, mandatory): Path to the bcp file.
+            part_file_path (:obj:`str`, mandatory): Path to the shard bcp file.
+            output_bcp_delimiter (:obj:`str`, mandatory): Delimeter used in bcp file.
+            line_offset (:obj:`int`, mandatory): Count of bcp rows in the preceding shards.
+
+        """
+        if not os.path.exists(part_file_path):
+            return
+        with open(part_file_path, mode='r') as part_file, open(bcp_file_path, 'a+') as bcpfile:
+            for line in part_file:
+                line_num, rest = line.split(output_bcp_delimiter, 1)
+                bcpfile.write(str(int(line_num) + line_offset) +
+                              output_bcp_delimiter + rest)
 
     def is_valid_date_format(self, _date):
         """This method checks for date format
@@ -170,11 +359,33 @@ class DeidFact:
         Returns:
             boolean: True if date format is correct else false.
         """
-        try:
-            self.date_format.parse(_date)
-            return True
-        except ValueError:
-            return False
+        return is_valid_datetime(_date)
+
+    def write_valid_rows(self, _valid_rows_arr, deid_file_path, output_deid_delimiter, bcp_file_path, output_bcp_delimiter):
+        """This method writes the list of valid rows to the deid file and/or the bcp file
+
+        Args:
+            _valid_rows_arr (:obj:`str`, mandatory): List of valid facts.
+            deid_file_path (:obj:`str`, mandatory): Path to the output deid file, skipped if None.
+            output_deid_delimiter (:obj:`str`, mandatory): Delimeter to be used in deid file.
+            bcp_file_path (:obj:`str`, mandatory): Path to the output bcp file, skipped if None.
+            output_bcp_delimiter (:obj:`str`, mandatory): Delimeter to be used in bcp file.
+
+        """
+        if deid_file_path:
+            self.write_to_deid_file(
+                _valid_rows_arr, deid_file_path, output_deid_delimiter)
+        if bcp_file_path:
+            value_col = self.deid_header.index('value')
+            for row in _valid_rows_arr:
+                # Empty value is read back as '' from the deid file in two pass mode
+                if row[value_col] is None:
+                    row[value_col] = ''
+            bcp_rows = self.transform.transform_rows(
+                _valid_rows_arr, self.bcp_line_num + 1)
+            self.bcp_line_num += len(bcp_rows)
+            self.transform.write_to_bcp_file(
+                bcp_rows, bcp_file_path, output_bcp_delimiter)
 
     def write_deid_file_header(self, deid_file_path, output_deid_delimiter):
         """This method writes the header of deid file using csv writer
@@ -184,10 +395,9 @@ class DeidFact:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerow(self.deid_header)
         except Exception as e:
             raise e
 
@@ -201,10 +411,9 @@ class DeidFact:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writerows(_valid_rows_arr)
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerows(_valid_rows_arr)
         except Exception as e:
             raise e
 
@@ -216,10 +425,9 @@ class DeidFact:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerow(self.error_file_header)
         except Exception as e:
             raise e
 
@@ -232,14 +440,66 @@ class DeidFact:
 
         """
         try:
-            with open(error_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writerows(_error_rows_arr)
+            writer = self.writer_session.get_writer(
+                error_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerows(_error_rows_arr)
         except Exception as e:
             raise e
 
 
+def _init_shard_worker(patient_map, encounter_map, upload_id=None):
+    """Initializes the shard worker process with the patient and encounter mappings and the upload id of the load"""
+    global _shard_patient_map, _shard_encounter_map, _shard_upload_id
+    _shard_patient_map = patient_map
+    _shard_encounter_map = encounter_map
+    _shard_upload_id = upload_id
+
+
+def _deidentify_shard(task):
+    """De-identifies one line aligned chunk of the fact file in a worker process
+
+    Args:
+        task (:obj:`tuple`, mandatory): Chunk of the input file and the shard output paths.
+
+    Returns:
+        int: count of rows read
+        int: count of error rows
+
+    """
+    (obs_file_path, start, end, fieldnames, input_csv_delimiter, deid_file_path, output_deid_delimiter,
+     error_file_path, bcp_file_path, output_bcp_delimiter) = task
+    D = DeidFact(_shard_upload_id)
+    csv_reader = csv.reader(read_file_chunk(
+        obs_file_path, start, end), delimiter=input_csv_delimiter)
+    try:
+        return D.deidentify_rows(csv_reader, fieldnames, _shard_patient_map, _shard_encounter_map, deid_file_path,
+                                 output_deid_delimiter, error_file_path, bcp_file_path, output_bcp_delimiter)
+    finally:
+        D.close_writers()
+
+
+def get_mappings(obs_file_path, count_lines=True):
+    """Get patient mapping and encounter mapping, the progress total of the input file is provided meanwhile
+    (lines are counted only with exact progress)
+
+    Args:
+        obs_file_path (:obj:`str`, mandatory): Path to the input observation fact csv file.
+        count_lines (:obj:`bool`, optional): Provide the progress total of the input file.
+
+    Returns:
+        dict: patient mapping
+        dict: encounter mapping
+        int: progress total of the input file, None if not provided
+
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        line_count = executor.submit(
+            progress_total, obs_file_path) if count_lines else None
+        encounter_map = executor.submit(EncounterMapping.get_encounter_mapping)
+        patient_map = PatientMapping.get_patient_mapping()
+        return patient_map, encounter_map.result(), line_count.result() if line_count else None
+
+
 def do_deidentify(obs_file_path):
     """This methods contains housekeeping needs to be done before de-identifing observation fact file.
 
@@ -267,14 +527,79 @@ def do_deidentify(obs_file_path):
         input_csv_delimiter = str(os.getenv('CSV_DELIMITER'))
         output_deid_delimiter = str(os.getenv('CSV_DELIMITER'))
 
+        # Columnar and compressed files are not split in byte ranges, they are de-identified in one process
+        workers = D.workers if can_split(obs_file_path) else 1
+
         # Get patient mapping and encounter mapping
-        patient_map = PatientMapping.get_patient_mapping()
-        encounter_map = EncounterMapping.get_encounter_mapping()
+        patient_map, encounter_map, max_line = get_mappings(
+            obs_file_path, workers == 1)
 
-        D.deidentify_fact(patient_map, encounter_map, obs_file_path, input_csv_delimiter,
-                          deid_file_path, output_deid_delimiter, error_file_path)
+        if workers > 1:
+            D.deidentify_fact_parallel(patient_map, encounter_map, obs_file_path, input_csv_delimiter,
+                                       deid_file_path, output_deid_delimiter, error_file_path, workers=D.workers)
+        else:
+            D.deidentify_fact(patient_map, encounter_map, obs_file_path, input_csv_delimiter,
+                              deid_file_path, output_deid_delimiter, error_file_path, max_line=max_line)
 
         return deid_file_path, error_file_path
 
     else:
         logger.error('File does not exist : ' + obs_file_path)
+
+
+def do_deidentify_to_bcp(obs_file_path, keep_deid_file=False, upload_id=None):
+    """This methods de-identifies the observation fact file and writes the bcp file in a single pass.
+
+    Args:
+        obs_file_path (:obj:`str`, mandatory): Path to the input observation fact csv file.
+        keep_deid_file (:obj:`bool`, optional): Write the intermediate de-identified file as well (for debugging).
+        upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows.
+    Returns:
+        str: Path to the bcp file
+        str: path to the error log file
+
+    """
+
+    if os.path.exists(obs_file_path):
+        D = DeidFact(upload_id)
+        deid_file_path = os.path.join(
+            Path(obs_file_path).parent, "deid", 'facts.csv')
+        bcp_file_path = os.path.join(
+            Path(deid_file_path).parent, "bcp", 'observation_fact.bcp')
+        error_file_path = os.path.join(
+            Path(obs_file_path).parent, "logs", 'error_deid_facts.csv')
+
+        # Delete deid, bcp and error file if already exists
+        delete_file_if_exists(deid_file_path)
+        delete_file_if_exists(bcp_file_path)
+        delete_file_if_exists(error_file_path)
+
+        mkParentDir(deid_file_path)
+        mkParentDir(bcp_file_path)
+        mkParentDir(error_file_path)
+        input_csv_delimiter = str(os.getenv('CSV_DELIMITER'))
+        output_deid_delimiter = str(os.getenv('CSV_DELIMITER'))
+        output_bcp_delimiter = str(os.getenv('CSV_DELIMITER'))
+
+        # Columnar and compressed files are not split in byte ranges, they are de-identified in one process
+        workers = D.workers if can_split(obs_file_path) else 1
+
+        # Get patient mapping and encounter mapping
+        patient_map, encounter_map, max_line = get_mappings(
+            obs_file_path, workers == 1)
+
+        if not keep_deid_file:
+            deid_file_path = None
+        if workers > 1:
+            D.deidentify_fact_parallel(patient_map, encounter_map, obs_file_path, input_csv_delimiter,
+                                       deid_file_path, output_deid_delimiter, error_file_path,
+                                       bcp_file_path, output_bcp_delimiter, workers=D.workers)
+        else:
+            D.deidentify_fact(patient_map, encounter_map, obs_file_path, input_csv_delimiter,
+                              deid_file_path, output_deid_delimiter, error_file_path,
+                              bcp_file_path, output_bcp_delimiter, max_line=max_line)
+
+        return bcp_file_path, error_file_path
+
+    else:
+        logger.error('File does not exist : ' + obs_file_path)
@@ -0,0 +1,230 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`load_fact` -- Load observation_fact from the staging table
+================================================================
+
+.. module:: load_fact
+    :platform: Linux/Windows
+    :synopsis: module contains methods moving the uploaded facts from observation_fact_numbered to observation_fact in patient_num range batches
+
+
+"""
+
+import os
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+from alive_progress import alive_bar, config_handler
+from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
+from i2b2_cdi.database.database_helper import fetch_in_batches
+
+logger = cdi_logging.get_logger(__file__)
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+config_handler.set_global(length=50, spinner='triangles2')
+
+sql_dir = Path('i2b2_cdi/resources/sql')
+
+
+def read_sql(file_name):
+    """Provide the content of the sql file from the resources
+
+    Args:
+        file_name (:obj:`str`, mandatory): Name of the sql file
+
+    Returns:
+        str: sql statements
+
+    """
+    with open(sql_dir / file_name, 'r') as sql_file:
+        return sql_file.read()
+
+
+def get_patient_ranges(patient_nums, batch_size):
+    """Group the sorted patient numbers in ranges of batch_size patients
+
+    Args:
+        patient_nums (:obj:`list`, mandatory): Distinct patient numbers in ascending order
+        batch_size (:obj:`int`, mandatory): Patients per range
+
+    Returns:
+        list: (first patient_num, last patient_num, patient count) of each range
+
+    """
+    ranges = []
+    for start in range(0, len(patient_nums), batch_size):
+        batch = patient_nums[start:start + batch_size]
+        ranges.append((batch[0], batch[-1], len(batch)))
+    return ranges
+
+
+def load_observation_fact_from_numbered(batch_size=None, data_source=I2b2demoDataSource, mode=None, delete_missing=None):
+    """Move the facts of observation_fact_numbered to observation_fact, INSTANCE_NUM is numbered per fact key.
+    Staging table is indexed on the fact key first, then the facts are moved in patient_num ranges,
+    each range is committed on its own.
+
+    With the insert mode the facts are appended to observation_fact. With the merge mode the facts are upserted
+    on the observation_fact primary key, unchanged facts are not rewritten. With delete_missing the facts of the
+    loaded patients which are not in the staged facts are deleted as well.
+
+    Args:
+        batch_size (:obj:`int`, optional): Patients per batch, defaults to FACT_LOAD_BATCH_SIZE from env
+        data_source (:obj:`class`, optional): DataSource class providing the connection
+        mode (:obj:`str`, optional): 'insert' or 'merge', defaults to FACT_LOAD_MODE from env
+        delete_missing (:obj:`bool`, optional): Delete facts missing in the merged patients, defaults to FACT_MERGE_DELETE from env
+
+    Returns:
+        int: count of facts inserted or merged into observation_fact
+
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv('FACT_LOAD_BATCH_SIZE', 1000))
+    batch_size = max(1, batch_size)
+    if mode is None:
+        mode = str(os.getenv('FACT_LOAD_MODE', 'insert')).lower()
+    if delete_missing is None:
+        delete_missing = str(os.getenv('FACT_MERGE_DELETE')).lower() == 'true'
+    if mode == 'insert':
+        load_query = read_sql('load_observation_fact_from_numbered.sql')
+        delete_query = None
+    elif mode == 'merge':
+        load_query = read_sql('merge_observation_fact_from_numbered.sql')
+        delete_query = read_sql(
+            'delete_observation_fact_not_in_numbered.sql') if delete_missing else None
+    else:
+        raise ValueError('Unknown fact load mode : ' + mode)
+
+    start_time = time.time()
+    with data_source() as cursor:
+        cursor.execute(read_sql('index_observation_fact_numbered.sql'))
+        cursor.connection.commit()
+        logger.info('Indexed observation_fact_numbered in {0:.1f}s'.format(
+            time.time() - start_time))
+
+        cursor.execute('SELECT COUNT(*) FROM OBSERVATION_FACT_NUMBERED')
+        staged_count = int(cursor.fetchone()[0])
+        cursor.execute(
+            'SELECT DISTINCT PATIENT_NUM FROM OBSERVATION_FACT_NUMBERED ORDER BY PATIENT_NUM')
+        patient_nums = [row[0] for row in fetch_in_batches(
+            cursor, name='observation_fact_numbered patients')]
+        ranges = get_patient_ranges(patient_nums, batch_size)
+        logger.info('Loading ({0}) {1} facts of {2} patients into observation_fact in {3} batches'.format(
+            mode, staged_count, len(patient_nums), len(ranges)))
+
+        row_count = 0
+        deleted_count = 0
+        with alive_bar(len(patient_nums), bar='smooth') as bar:
+            for first_patient, last_patient, patient_count in ranges:
+                if delete_query:
+                    cursor.execute(delete_query, first_patient,
+                                   last_patient, first_patient, last_patient)
+                    deleted_count += max(cursor.rowcount, 0)
+                cursor.execute(load_query, first_patient, last_patient)
+                row_count += max(cursor.rowcount, 0)
+                cursor.connection.commit()
+                bar(incr=patient_count)
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    if mode == 'merge':
+        logger.info('Merged {0} of {1} staged facts into observation_fact, deleted {2} facts in {3:.1f}s'.format(
+            row_count, staged_count, deleted_count, elapsed))
+    else:
+        logger.info('Inserted {0} facts into observation_fact in {1:.1f}s ({2:.0f} rows/sec)'.format(
+            row_count, elapsed, row_count / elapsed))
+        if row_count != staged_count:
+            logger.warning('{0} facts of observation_fact_numbered were not inserted into observation_fact'.format(
+                staged_count - row_count))
+    return row_count
+
+
+def register_upload(input_file_name, data_source=I2b2demoDataSource):
+    """Create the upload_status record of a fact load, its UPLOAD_ID is written to the loaded facts
+
+    Args:
+        input_file_name (:obj:`str`, mandatory): Path to the loaded fact file
+        data_source (:obj:`class`, optional): DataSource class providing the connection
+
+    Returns:
+        int: upload id
+
+    """
+    query = ("INSERT INTO upload_status (upload_label, user_id, source_cd, load_date, load_status, input_file_name) "
+             "OUTPUT INSERTED.upload_id VALUES (?, ?, ?, GETDATE(), 'PROCESSING', ?)")
+    with data_source() as cursor:
+        cursor.execute(query, os.path.basename(input_file_name), 'i2b2-cdi',
+                       str(os.getenv('SOURCESYSTEM_CD', '')), input_file_name)
+        upload_id = int(cursor.fetchone()[0])
+    logger.info('Registered upload ' + str(upload_id) + ' of ' + input_file_name)
+    return upload_id
+
+
+def finish_upload(upload_id, load_status, loaded_record=None, data_source=I2b2demoDataSource):
+    """Update the status of the upload_status record
+
+    Args:
+        upload_id (:obj:`int`, mandatory): Upload id
+        load_status (:obj:`str`, mandatory): Status of the load e.g. COMPLETED, FAILED
+        loaded_record (:obj:`int`, optional): Count of loaded facts
+        data_source (:obj:`class`, optional): DataSource class providing the connection
+
+    """
+    query = "UPDATE upload_status SET load_status = ?, loaded_record = ?, end_date = GETDATE() WHERE upload_id = ?"
+    with data_source() as cursor:
+        cursor.execute(query, load_status, loaded_record, upload_id)
+
+
+def delete_facts_of_upload(upload_id=None, sourcesystem_cd=None, batch_size=None, data_source=I2b2demoDataSource):
+    """Delete the facts loaded by an upload or from a source system, in batches each committed on its own
+
+    Args:
+        upload_id (:obj:`int`, optional): UPLOAD_ID of the facts to be deleted
+        sourcesystem_cd (:obj:`str`, optional): SOURCESYSTEM_CD of the facts to be deleted
+        batch_size (:obj:`int`, optional): Facts deleted per batch, defaults to FETCH_BATCH_SIZE from env
+        data_source (:obj:`class`, optional): DataSource class providing the connection
+
+    Returns:
+        int: count of deleted facts
+
+    """
+    conditions = []
+    params = []
+    if upload_id is not None:
+        conditions.append('UPLOAD_ID = ?')
+        params.append(upload_id)
+    if sourcesystem_cd is not None:
+        conditions.append('SOURCESYSTEM_CD = ?')
+        params.append(sourcesystem_cd)
+    if not conditions:
+        raise ValueError('upload_id or sourcesystem_cd is required')
+    if batch_size is None:
+        batch_size = int(os.getenv('FETCH_BATCH_SIZE', 50000))
+    query = 'DELETE TOP ({0}) FROM observation_fact WHERE {1}'.format(
+        int(batch_size), ' AND '.join(conditions))
+    deleted_count = 0
+    with data_source() as cursor:
+        while True:
+            cursor.execute(query, *params)
+            count = max(cursor.rowcount, 0)
+            cursor.connection.commit()
+            deleted_count += count
+            if count < batch_size:
+                break
+        if upload_id is not None:
+            cursor.execute(
+                "UPDATE upload_status SET load_status = 'DELETED', deleted_record = ? WHERE upload_id = ?",
+                deleted_count, upload_id)
+    logger.info('Deleted {0} facts of {1}'.format(deleted_count, ' AND '.join(
+        condition.replace('?', repr(param)) for condition, param in zip(conditions, params))))
+    return deleted_count
@@ -28,10 +28,11 @@ from dotenv import load_dotenv
 from i2b2_cdi.fact import deid_fact as DeidFact
 from i2b2_cdi.fact import transform_file as TransformFile
 from i2b2_cdi.encounter import perform_encounter as PerformEncounter
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
-from i2b2_cdi.common.py_bcp import PyBCP
+from i2b2_cdi.common.uploader import get_uploader
 from i2b2_cdi.fact import delete_fact
+from i2b2_cdi.fact.load_fact import load_observation_fact_from_numbered, register_upload, finish_upload, delete_facts_of_upload
 from i2b2_cdi.common.bcolors import BColors
 
 SUCCESS = BColors.OKGREEN + "Completed \u2714" + BColors.ENDC
@@ -60,6 +61,27 @@ def delete_facts():
         raise
 
 
+def delete_facts_by_upload(upload_id=None, sourcesystem_cd=None):
+    """Delete the facts loaded by an upload or from a source system
+
+    Args:
+        upload_id (:obj:`int`, optional): UPLOAD_ID of the facts to be deleted
+        sourcesystem_cd (:obj:`str`, optional): SOURCESYSTEM_CD of the facts to be deleted
+
+    """
+    step = BColors.HEADER + "Delete facts by upload" + BColors.ENDC
+    logger.info(step)
+    try:
+        delete_facts_of_upload(upload_id=upload_id,
+                               sourcesystem_cd=sourcesystem_cd)
+        logger.info(SUCCESS)
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        logger.error('cdi-pipeline-error: (' + step + '):' + str(e))
+        logger.error(FAILURE)
+        raise
+
+
 def get_argument_parser():
     """Reads the command line arguments and passes to the ArgumentParser
 
@@ -73,20 +95,77 @@ def get_argument_parser():
                         action='store_true', help="Delete facts from i2b2")
     parser.add_argument('-if', '--import-facts', dest='fact_file', type=argparse.FileType(
         'r', encoding='UTF-8'), help="Import observation facts into i2b2")
+    parser.add_argument('-lm', '--load-mode', choices=['insert', 'merge'],
+                        help="Insert the imported facts or merge them on the observation_fact key, defaults to FACT_LOAD_MODE")
+    parser.add_argument('-du', '--delete-upload-id', type=int,
+                        help="Delete facts having the UPLOAD_ID from i2b2")
+    parser.add_argument('-ds', '--delete-sourcesystem-cd',
+                        help="Delete facts having the SOURCESYSTEM_CD from i2b2")
     args = parser.parse_args()
     return args
 
 
-def load_facts_using_bcp(obs_file_path):
+def load_facts_using_bcp(obs_file_path, load_mode=None):
     """Load the facts from the given file to the i2b2 instance using bcp tool.
 
     Args:
         file_path (:obj:`str`, mandatory): Path to the file which needs to be imported
+        load_mode (:obj:`str`, optional): 'insert' or 'merge', defaults to FACT_LOAD_MODE from env
+
+    """
+    with cdi_metrics.run('load_facts', obs_file_path):
+        registered_upload_id = start_upload(obs_file_path)
+        # UPLOAD_ID configured in env is written as it is
+        upload_id = registered_upload_id if registered_upload_id is not None else os.getenv('UPLOAD_ID') or None
+        try:
+            if str(os.getenv('FUSED_FACT_PIPELINE')).lower() == 'true':
+                bcp_file_path = de_identify_facts_to_bcp(obs_file_path, upload_id)
+            else:
+                deid_file_path = de_identify_facts(obs_file_path)
+                bcp_file_path = convert_csv_to_bcp(deid_file_path, upload_id)
+            row_count = bcp_upload(bcp_file_path, load_mode)
+            end_upload(registered_upload_id, 'COMPLETED', row_count)
+        except Exception:
+            end_upload(registered_upload_id, 'FAILED')
+            raise
+
+
+def start_upload(obs_file_path):
+    """Register the upload of the fact file, its UPLOAD_ID is passed to the stages writing the bcp rows of this run.
+    Nothing is registered if UPLOAD_ID is configured in env.
+
+    Args:
+        obs_file_path (:obj:`str`, mandatory): Path to the file which needs to be imported
+
+    Returns:
+        int: registered upload id, None if not registered
+
+    """
+    if os.getenv('UPLOAD_ID') or str(os.getenv('TRACK_UPLOAD_ID')).lower() != 'true':
+        return None
+    try:
+        upload_id = register_upload(obs_file_path)
+    except Exception as e:
+        logger.warning('Facts are loaded without UPLOAD_ID, upload could not be registered : ' + str(e))
+        return None
+    return upload_id
+
+
+def end_upload(upload_id, load_status, loaded_record=None):
+    """Update the status of the registered upload
+
+    Args:
+        upload_id (:obj:`int`, mandatory): Registered upload id, nothing is done if None
+        load_status (:obj:`str`, mandatory): Status of the load
+        loaded_record (:obj:`int`, optional): Count of loaded facts
 
     """
-    deid_file_path = de_identify_facts(obs_file_path)
-    bcp_file_path = convert_csv_to_bcp(deid_file_path)
-    bcp_upload(bcp_file_path)
+    if upload_id is None:
+        return
+    try:
+        finish_upload(upload_id, load_status, loaded_record)
+    except Exception as e:
+        logger.warning('Could not update status of upload ' + str(upload_id) + ' : ' + str(e))
 
 
 def de_identify_facts(obs_file_path):
@@ -103,7 +182,9 @@ def de_identify_facts(obs_file_path):
     logger.info(step)
     try:
         #data_shift_flag = False
-        deid_file_path, error_file_path = DeidFact.do_deidentify(obs_file_path)
+        with cdi_metrics.step('de_identify_facts', [obs_file_path]) as metrics:
+            deid_file_path, error_file_path = DeidFact.do_deidentify(obs_file_path)
+            metrics.written(deid_file_path, error_file_path)
         logger.info(
             "Check error logs of fact de-identification if any : " + error_file_path)
         logger.info(SUCCESS)
@@ -115,11 +196,42 @@ def de_identify_facts(obs_file_path):
         raise
 
 
-def convert_csv_to_bcp(deid_file_path):
+def de_identify_facts_to_bcp(obs_file_path, upload_id=None):
+    """DeIdentify the fact data and transform it to the bcp fact file in a single pass
+
+    Args:
+        obs_file_path (:obj:`str`, mandatory): Path to the file which needs to be deidentified
+        upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows
+
+    Returns:
+        str: path to the bcp file
+
+    """
+    step = BColors.HEADER + "De-identify facts and convert to BCP" + BColors.ENDC
+    logger.info(step)
+    try:
+        keep_deid_file = str(os.getenv('KEEP_DEID_FACT_FILE')).lower() == 'true'
+        with cdi_metrics.step('de_identify_facts_to_bcp', [obs_file_path]) as metrics:
+            bcp_file_path, error_file_path = DeidFact.do_deidentify_to_bcp(
+                obs_file_path, keep_deid_file, upload_id)
+            metrics.written(bcp_file_path, error_file_path)
+        logger.info(
+            "Check error logs of fact de-identification if any : " + error_file_path)
+        logger.info(SUCCESS)
+        return bcp_file_path
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        logger.error('cdi-pipeline-error: (' + step + '):' + str(e))
+        logger.error(FAILURE)
+        raise
+
+
+def convert_csv_to_bcp(deid_file_path, upload_id=None):
     """Transform the cdi fact file to the bcp fact file
 
     Args:
         deid_file_path (:obj:`str`, mandatory): Path to the deidentified file which needs to be converted to bcp file
+        upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows
 
     Returns:
         str: path to the bcp file
@@ -128,7 +240,9 @@ def convert_csv_to_bcp(deid_file_path):
     step = BColors.HEADER + "Convert CSV to BCP" + BColors.ENDC
     logger.info(step)
     try:
-        bcp_file_path = TransformFile.csv_to_bcp(deid_file_path)
+        with cdi_metrics.step('convert_csv_to_bcp', [deid_file_path]) as metrics:
+            bcp_file_path = TransformFile.csv_to_bcp(deid_file_path, upload_id)
+            metrics.written(bcp_file_path)
         logger.info(SUCCESS)
         return bcp_file_path
     except Exception as e:
@@ -138,11 +252,15 @@ def convert_csv_to_bcp(deid_file_path):
         raise
 
 
-def bcp_upload(bcp_file_path):
+def bcp_upload(bcp_file_path, load_mode=None):
     """Upload the fact data from bcp file to the i2b2 instance
 
     Args:
         bcp_file_path (:obj:`str`, mandatory): Path to the bcp file having fact data
+        load_mode (:obj:`str`, optional): 'insert' or 'merge', defaults to FACT_LOAD_MODE from env
+
+    Returns:
+        int: count of facts inserted or merged into observation_fact
 
     """
     step = BColors.HEADER + \
@@ -150,7 +268,7 @@ def bcp_upload(bcp_file_path):
     logger.info(step)
     base_dir = str(Path(bcp_file_path).parents[2])
     try:
-        _bcp = PyBCP(
+        _bcp = get_uploader(
             table_name="observation_fact_numbered",
             import_file=bcp_file_path,
             delimiter=str(os.getenv('CSV_DELIMITER')),
@@ -159,12 +277,13 @@ def bcp_upload(bcp_file_path):
 
         create_table_path = Path('i2b2_cdi/resources/sql') / \
             'create_observation_fact_numbered.sql'
-        _bcp.execute_sql(create_table_path)
-        _bcp.upload()
-        load_fact_path = Path('i2b2_cdi/resources/sql') / \
-            'load_observation_fact_from_numbered.sql'
-        _bcp.execute_sql(load_fact_path)
+        with cdi_metrics.step('bcp_upload', [bcp_file_path]) as metrics:
+            _bcp.execute_sql(create_table_path)
+            upload_count = _bcp.upload()
+            row_count = load_observation_fact_from_numbered(mode=load_mode)
+            metrics.count(upload_count, row_count)
         logger.info(SUCCESS)
+        return row_count
     except Exception as e:
         logger.error(traceback.format_exc())
         logger.error('cdi-pipeline-error: (' + step + '):' + str(e))
@@ -177,9 +296,12 @@ if __name__ == "__main__":
 
     if args.delete_facts:
         delete_facts()
+    elif args.delete_upload_id is not None or args.delete_sourcesystem_cd:
+        delete_facts_by_upload(args.delete_upload_id,
+                               args.delete_sourcesystem_cd)
     elif args.fact_file:
         # Check database connection before load
         demodata_connection = I2b2demoDataSource()
         demodata_connection.check_database_connection()
-        load_facts_using_bcp(args.fact_file.name)
+        load_facts_using_bcp(args.fact_file.name, args.load_mode)
         args.fact_file.close()
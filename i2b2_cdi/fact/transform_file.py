@@ -23,6 +23,8 @@
 
 import math
 import csv
+import re
+import numpy as np
 import pandas as pd
 import sys
 import os
@@ -32,7 +34,9 @@ from i2b2_cdi.common.utils import *
 from datetime import datetime as DateTime
 from i2b2_cdi.exception.cdi_max_err_reached import MaxErrorCountReachedError
 from i2b2_cdi.exception.cdi_csv_conversion_error import CsvToBcpConversionError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+from i2b2_cdi.common.file_writer import WriterSession
+from i2b2_cdi.common.row_plan import RowPlan
 from alive_progress import alive_bar, config_handler
 from dotenv import load_dotenv
 
@@ -42,20 +46,42 @@ logger = cdi_logging.get_logger(__file__)
 env_path = Path('i2b2_cdi/resources') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Values python float may parse but pandas does not (nan, inf, overflow, underscores, non ascii digits or spaces)
+_float_only_value = re.compile(
+    r'[nN][aA][nN]|[iI][nN][fF]|[eE][+-]?[0-9]{3}|[0-9]{300}|_|[^\x00-\x7f]')
+
 
 class TransformFile:
     """The class provides the various methods for transforming csv data to bcp file"""
 
-    def __init__(self):
+    def __init__(self, upload_id=None):
+        """
+        Args:
+            upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows, so a load can be deleted later
+
+        """
         self.date_format = DateFormat("YYYY-MM-DD hh:mm:ss")
         self.float_precision_digits = 10
         self.write_batch_size = 100
+        self.chunk_size = int(os.getenv('TRANSFORM_CHUNK_SIZE', 10000))
+        self.valtype_compat = str(
+            os.getenv('VALTYPE_COMPAT', 'true')).lower() == 'true'
+        self.writer_session = WriterSession()
         self.error_count = 0
         self.error_count_max = 100
         now = DateTime.now()
         self.import_time = now.strftime("%Y-%m-%d %H:%M:%S")
+        self.upload_id = '' if upload_id is None else str(upload_id)
+        self.sourcesystem_cd = str(os.getenv('SOURCESYSTEM_CD', ''))
         self.bcp_header = ['LINE_NUM', 'EncounterID', 'PatientID', 'ConceptCD', 'ProviderID', 'StartDate', 'ModifierCD', 'InstanceNum', 'VALTYPE_CD', 'TVAL_CHAR', 'NVAL_NUM', 'VALUEFLAG_CD', 'QUANTITY_NUM', 'UnitCD',
                            'END_DATE', 'LOCATION_CD', 'OBSERVATION_BLOB', 'CONFIDENCE_NUM', 'UPDATE_DATE', 'DOWNLOAD_DATE', 'IMPORT_DATE', 'SOURCESYSTEM_CD', 'UPLOAD_ID', 'TEXT_SEARCH_INDEX']
+        self.deid_header = ['EncounterID', 'PatientID', 'ConceptCD', 'ProviderID',
+                            'StartDate', 'ModifierCD', 'InstanceNum', 'value', 'UnitCD']
+        # Column index plan from de-identified fact row to bcp row
+        self.bcp_plan = RowPlan(self.deid_header, self.bcp_header)
+        self.value_col = self.deid_header.index('value')
+        self.bcp_cols = [self.bcp_plan.index[name] for name in (
+            'LINE_NUM', 'VALTYPE_CD', 'TVAL_CHAR', 'NVAL_NUM', 'IMPORT_DATE', 'SOURCESYSTEM_CD', 'UPLOAD_ID', 'TEXT_SEARCH_INDEX')]
 
     def csv_to_bcp(self, csv_file_path, input_csv_delimiter, bcp_file_path, output_bcp_delimiter):
         """This method transforms csv file to bcp, Error records will be logged to log file
@@ -68,66 +94,128 @@ class TransformFile:
 
         """
 
-        _valid_rows_arr = []
-        max_line = file_len(csv_file_path) - 1
+        _chunk = []
+        max_line = progress_total(csv_file_path)
         try:
             print('\n')
             # Read input csv file
             with open(csv_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
+                csv_reader = csv.reader(
                     csv_file, delimiter=input_csv_delimiter)
+                plan = RowPlan(next(csv_reader, None),
+                               self.deid_header, required=['value'])
                 row_number = 0
                 with alive_bar(max_line, bar='smooth') as bar:
-                    for row in csv_reader:
-                        try:
-                            row_number += 1
-                            nval_num = ''
-                            tval_char = ''
-                            valtype_cd = 'T'
-                            if not pd.isnull(row['value']) and (self.getValType(row['value']) == 'float' or self.getValType(row['value']) == 'nan'):
-                                nval_num = row['value'][0:self.float_precision_digits]
-                                tval_char = 'E'
-                                valtype_cd = 'N'
-                            elif pd.isnull(row['value']):
-                                nval_num = 'NaN'
-                                tval_char = ''
-                                valtype_cd = '@'
-                            else:
-                                nval_num = ''
-                                tval_char = row['value']
-                                valtype_cd = 'T'
-                            row['LINE_NUM'] = row_number
-                            row['VALTYPE_CD'] = valtype_cd
-                            row['TVAL_CHAR'] = tval_char
-                            row['NVAL_NUM'] = nval_num
-                            row['IMPORT_DATE'] = self.import_time
-                            row['TEXT_SEARCH_INDEX'] = 1
-                            row.pop('value', None)
-                            _valid_rows_arr.append(row)
+                    progress = FileProgress(csv_file, bar)
+                    for row in plan.rows(csv_reader):
+                        _chunk.append(row)
 
+                        # Transform and write records, if chunk size reached.
+                        if len(_chunk) == self.chunk_size:
+                            self.write_to_bcp_file(self.transform_rows(
+                                _chunk, row_number + 1), bcp_file_path, output_bcp_delimiter)
+                            row_number += len(_chunk)
                             # Print progress
-                            bar()
-                        except Exception as e:
-                            logger.error(e)
-                            self.error_count += 1
-                            if self.error_count > self.error_count_max:
-                                raise MaxErrorCountReachedError(
-                                    "Exiting function as max errors reached :" + self.error_count_max)
-
-                        # Write valid records to file, if batch size reached.
-                        if len(_valid_rows_arr) == self.write_batch_size:
-                            self.write_to_bcp_file(
-                                _valid_rows_arr, bcp_file_path, output_bcp_delimiter)
-                            _valid_rows_arr = []
-
-                    # Writer valid records to file (remaining records when given batch size does not meet)
-                    self.write_to_bcp_file(
-                        _valid_rows_arr, bcp_file_path, output_bcp_delimiter)
+                            progress(incr=len(_chunk))
+                            _chunk = []
+
+                    # Transform and write remaining records
+                    self.write_to_bcp_file(self.transform_rows(
+                        _chunk, row_number + 1), bcp_file_path, output_bcp_delimiter)
+                    row_number += len(_chunk)
+                    progress(incr=len(_chunk))
+                    progress.update()
+                cdi_metrics.count(row_number, row_number, 0)
         except MaxErrorCountReachedError:
             raise
         except Exception as e:
             raise CsvToBcpConversionError(cdi_logging.format_error_log(
                 "Failed to convert csv to bcp file", e))
+        finally:
+            self.writer_session.close()
+
+    def transform_rows(self, rows, first_line_num):
+        """This method converts a chunk of de-identified fact rows to the bcp row format
+
+        Args:
+            rows (:obj:`list`, mandatory): De-identified fact rows in :attr:`deid_header` layout.
+            first_line_num (:obj:`int`, mandatory): Line number of the first row in the bcp file.
+
+        Returns:
+            list: bcp rows in :attr:`bcp_header` layout
+
+        """
+        value_col = self.value_col
+        line_num_col, valtype_col, tval_col, nval_col, import_date_col, sourcesystem_col, upload_id_col, text_search_col = self.bcp_cols
+        classes = self.classify_values([row[value_col] for row in rows])
+        bcp_rows = []
+        line_num = first_line_num
+        for row, (valtype_cd, tval_char, nval_num) in zip(rows, classes):
+            bcp_row = self.bcp_plan.convert(row)
+            bcp_row[line_num_col] = line_num
+            bcp_row[valtype_col] = valtype_cd
+            bcp_row[tval_col] = tval_char
+            bcp_row[nval_col] = nval_num
+            bcp_row[import_date_col] = self.import_time
+            bcp_row[sourcesystem_col] = self.sourcesystem_cd
+            bcp_row[upload_id_col] = self.upload_id
+            bcp_row[text_search_col] = 1
+            bcp_rows.append(bcp_row)
+            line_num += 1
+        return bcp_rows
+
+    def classify_values(self, values):
+        """This method classifies a chunk of fact values into VALTYPE_CD, TVAL_CHAR and NVAL_NUM.
+        Values are parsed with pandas at once, only values pandas does not parse but python float may parse
+        (nan, inf, overflow, underscores, non ascii digits) are checked one by one.
+
+        In compatibility mode (VALTYPE_COMPAT) the classification of :meth:`getValType` is kept: zero is a text value,
+        nan and inf are numeric values. Otherwise every finite number is numeric and nan, inf are text values.
+
+        Args:
+            values (:obj:`list`, mandatory): Fact values, None for a missing value.
+
+        Returns:
+            iterator: (VALTYPE_CD, TVAL_CHAR, NVAL_NUM) of the values
+
+        """
+        series = pd.Series(values, dtype=object)
+        missing = series.isnull().to_numpy()
+        numbers = pd.to_numeric(
+            series, errors='coerce').to_numpy(dtype=float)
+        if self.valtype_compat:
+            # float(x) is falsy for zero, nan is truthy
+            numeric = ~np.isnan(numbers) & (numbers != 0)
+        else:
+            numeric = np.isfinite(numbers)
+        for i in np.flatnonzero(np.isnan(numbers) & ~missing):
+            value = values[i]
+            if _float_only_value.search(value):
+                if self.valtype_compat:
+                    numeric[i] = self.getValType(value) in ('float', 'nan')
+                else:
+                    numeric[i] = self.is_finite_number(value)
+
+        numeric[missing] = False
+        valtype_cd = np.full(len(values), 'T', dtype=object)
+        valtype_cd[numeric] = 'N'
+        valtype_cd[missing] = '@'
+        tval_char = series.to_numpy(dtype=object, copy=True)
+        tval_char[numeric] = 'E'
+        tval_char[missing] = ''
+        nval_num = np.full(len(values), '', dtype=object)
+        numeric_index = np.flatnonzero(numeric)
+        digits = self.float_precision_digits
+        nval_num[numeric_index] = [values[i][0:digits] for i in numeric_index]
+        nval_num[missing] = 'NaN'
+        return zip(valtype_cd.tolist(), tval_char.tolist(), nval_num.tolist())
+
+    def is_finite_number(self, x):
+        """Returns True if the value is a finite number"""
+        try:
+            return math.isfinite(float(x))
+        except (ValueError, TypeError):
+            return False
 
     def write_to_bcp_file(self, _valid_rows_arr, bcp_file_path, output_bcp_delimiter):
         """This method writes the list of rows to the bcp file using csv writer
@@ -139,10 +227,9 @@ class TransformFile:
 
         """
         try:
-            with open(bcp_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.bcp_header, delimiter=output_bcp_delimiter, lineterminator='\n')
-                writer.writerows(_valid_rows_arr)
+            writer = self.writer_session.get_writer(
+                bcp_file_path, delimiter=output_bcp_delimiter, lineterminator='\n')
+            writer.writerows(_valid_rows_arr)
         except Exception as e:
             raise e
 
@@ -168,11 +255,12 @@ class TransformFile:
             return 'str'
 
 
-def csv_to_bcp(csv_file_path):
+def csv_to_bcp(csv_file_path, upload_id=None):
     """Convert the csv file to bcp file and provide the path to the bcp file
 
     Args:
         _file (str): path to the csv file
+        upload_id (:obj:`int`, optional): UPLOAD_ID written to the bcp rows
 
     Returns:
         str: path to the bcp file
@@ -180,7 +268,7 @@ def csv_to_bcp(csv_file_path):
     """
     if os.path.exists(csv_file_path):
         logger.info('converting csv to bcp : ' + csv_file_path)
-        T = TransformFile()
+        T = TransformFile(upload_id)
         bcp_file_path = os.path.join(
             Path(csv_file_path).parent, "bcp", 'observation_fact.bcp')
 
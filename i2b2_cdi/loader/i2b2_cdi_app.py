@@ -13,23 +13,63 @@
 import os
 from flask import Flask, flash, request, redirect, url_for, jsonify
 from i2b2_cdi.loader import i2b2_cdi_loader as I2b2CdiLoader
+from i2b2_cdi.loader.job_queue import JobQueue
+from i2b2_cdi.loader.upload_stream import StreamingRequest, remove_upload
+from i2b2_cdi.common.file_reader import CSV_EXTENSIONS, COLUMNAR_EXTENSIONS
 
 UPLOAD_FOLDER = 'data/'
 ALLOWED_EXTENSIONS = {'csv'}
+DATA_EXTENSIONS = CSV_EXTENSIONS + COLUMNAR_EXTENSIONS
+
+# Load and delete functions of the data kinds served by /cdi-api/<kind>
+DATA_JOBS = {
+    'patient-mapping': (I2b2CdiLoader.load_patient_mapping, I2b2CdiLoader.delete_patient_mappings),
+    'patient': (I2b2CdiLoader.load_patients, I2b2CdiLoader.delete_patients),
+    'encounter': (I2b2CdiLoader.load_encounters, I2b2CdiLoader.delete_encounters),
+    'fact': (I2b2CdiLoader.load_facts, I2b2CdiLoader.delete_facts),
+}
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploaded files are written to UPLOAD_FOLDER while the request is parsed
+app.request_class = StreamingRequest
 app.secret_key = os.urandom(24)
 
+# Loads and deletes run in background jobs, requests return the job id at once
+jobs = JobQueue()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def allowed_data_file(filename):
+    return filename.lower().endswith(DATA_EXTENSIONS)
+
+def save_upload(file):
+    """Keep the uploaded file, it was already written to its own directory by :class:`StreamingRequest`
+
+    Args:
+        file (:obj:`FileStorage`, mandatory): Uploaded file
+
+    Returns:
+        str: path to the saved file
+
+    """
+    return file.stream.finish()
+
+@app.teardown_request
+def discard_uploads(error=None):
+    # Uploaded files which are not kept for a job are deleted
+    if isinstance(request, StreamingRequest):
+        request.discard_uploads()
+
+def job_response(job_id):
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': url_for('get_job', job_id=job_id)}), 202
+
 @app.route('/cdi-api/concept', methods=['DELETE', 'POST'])
 def perform_concept():
     if request.method == 'DELETE':
-        I2b2CdiLoader.delete_concepts()
-        return "Concepts deleted successfully"
+        return job_response(jobs.submit('concept', 'delete', I2b2CdiLoader.delete_concepts))
     if request.method == 'POST':
         # check if the post request has the file part
         if 'file' not in request.files:
@@ -42,12 +82,38 @@ def perform_concept():
             flash('No selected file')
             return "File not selected"
         if file and allowed_file(file.filename):
-            filename = file.filename
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            file_list = [ UPLOAD_FOLDER + filename]
-            I2b2CdiLoader.load_concepts(file_list)
-            return "Concepts uploaded successfully"
+            file_list = [save_upload(file)]
+            return job_response(jobs.submit('concept', 'load', I2b2CdiLoader.load_concepts, file_list, files=file_list,
+                                            cleanup=lambda: remove_upload(file_list[0])))
+        return "File type not supported"
+
+@app.route('/cdi-api/<any("patient-mapping", patient, encounter, fact):kind>', methods=['DELETE', 'POST'])
+def perform_data(kind):
+    load, delete = DATA_JOBS[kind]
+    if request.method == 'DELETE':
+        return job_response(jobs.submit(kind, 'delete', delete))
+    if 'file' not in request.files:
+        return "File not provided"
+    file = request.files['file']
+    if file.filename == '':
+        return "File not selected"
+    if not allowed_data_file(file.filename):
+        return "File type not supported"
+    file_path = save_upload(file)
+    return job_response(jobs.submit(kind, 'load', load, file_path, files=[file_path],
+                                    cleanup=lambda: remove_upload(file_path)))
+
+@app.route('/cdi-api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/cdi-api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(jobs.store.list(request.args.get('limit', 100, type=int)))
 
 # driver function
 if __name__ == '__main__':
-    app.run(debug = True, host='0.0.0.0')
\ No newline at end of file
+    app.run(debug = True, host='0.0.0.0')
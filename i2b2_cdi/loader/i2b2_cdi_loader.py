@@ -37,6 +37,7 @@ from i2b2_cdi.concept import perform_concept
 from i2b2_cdi.patient import perform_patient
 from i2b2_cdi.encounter import perform_encounter
 from i2b2_cdi.common.bcolors import BColors
+from i2b2_cdi.common.file_reader import find_input_file
 from i2b2_cdi.encounter import perform_encounter
 
 SUCCESS = BColors.OKGREEN + "Completed \u2714" + BColors.ENDC
@@ -173,22 +174,19 @@ def load_data(dir_path):
     """Load the concepts, facts, encounters etc
     Args:
         dir_path (:obj:`str`, mandatory): Path to the directory where files are placed to load.
+            Data files are detected by extension: csv (.csv, .csv.gz, .csv.zst), Parquet (.parquet) or Arrow (.arrow, .feather).
     """
-    mrn_file = 'mrn.csv'
-    encounter_file = 'encounters.csv'
-    fact_file = 'facts.csv'
-    patient_file = 'patients.csv'
     concept_files_map = {'concepts.csv': False,
                          'derived_concepts.csv': False, 'concept_mappings.csv': False}
-    data_files_map = {mrn_file: False, encounter_file: False, fact_file: False, patient_file: False}
     # Get all files in a folder
     files = os.listdir(dir_path)
     for file in files:
         if file in concept_files_map:
             concept_files_map[file] = True
-    for file in files:
-        if file in data_files_map:
-            data_files_map[file] = True
+    mrn_file = find_input_file(dir_path, 'mrn')
+    encounter_file = find_input_file(dir_path, 'encounters')
+    fact_file = find_input_file(dir_path, 'facts')
+    patient_file = find_input_file(dir_path, 'patients')
     # Import concepts
     concept_files = []
     for file in concept_files_map:
@@ -198,14 +196,14 @@ def load_data(dir_path):
         load_concepts(concept_files)
 
     # Import facts, encounters, patients and mrns
-    if data_files_map.get(mrn_file):
-        load_patient_mapping(dir_path + '/' + mrn_file)
-    if data_files_map.get(patient_file):
-        load_patients(dir_path + '/' + patient_file)
-    if data_files_map.get(encounter_file):
-        load_encounters(dir_path + '/' + encounter_file)
-    if data_files_map.get(fact_file):
-        load_facts(dir_path + '/' + fact_file)
+    if mrn_file:
+        load_patient_mapping(mrn_file)
+    if patient_file:
+        load_patients(patient_file)
+    if encounter_file:
+        load_encounters(encounter_file)
+    if fact_file:
+        load_facts(fact_file)
 
 
 def dir_path(dir):
@@ -227,7 +225,7 @@ def get_argument_parser():
     parser.add_argument('-dd', '--delete-data',
                         action='store_true', help="Delete all data from i2b2")
     parser.add_argument('-ld', '--load-data', type=dir_path,
-                        help="Load data into i2b2. In this command, file names should be strictly followed. For concepts [concepts.csv', 'derived_concepts.csv', 'concept_mappings.csv'] and for data ['mrn.csv', 'patients.csv', 'encounters.csv', 'facts.csv']")
+                        help="Load data into i2b2. In this command, file names should be strictly followed. For concepts [concepts.csv', 'derived_concepts.csv', 'concept_mappings.csv'] and for data ['mrn', 'patients', 'encounters', 'facts'] with .csv, .csv.gz, .csv.zst, .parquet, .arrow or .feather extension")
     parser.add_argument('-dc', '--delete-concepts',
                         action='store_true', help="Delete concepts from i2b2")
     parser.add_argument('-ic', '--import-concepts', nargs='+', type=argparse.FileType(
@@ -0,0 +1,232 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`job_queue` -- Background jobs of the api
+==============================================
+
+.. module:: job_queue
+    :platform: Linux/Windows
+    :synopsis: module contains the sqlite store of the jobs and the queue running the loads and deletes of the api in worker threads
+
+Jobs run on two workers: patient mapping, patient, encounter and fact jobs share the data worker and run one after the
+other, concept jobs run on the concept worker. At most two jobs run at the same time, there is no further limit.
+
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import datetime
+import threading
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+logger = cdi_logging.get_logger(__file__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Patients, encounters and facts depend on the mappings and on each other, their jobs share one worker
+_queues = {'patient-mapping': 'data', 'patient': 'data', 'encounter': 'data', 'fact': 'data'}
+
+_columns = ['job_id', 'kind', 'action', 'status', 'files', 'created', 'started', 'finished', 'progress', 'stages', 'error']
+_json_columns = ('files', 'progress', 'stages')
+
+
+def now():
+    return datetime.datetime.now().isoformat()
+
+
+class JobStore:
+    """Stores the jobs in a local sqlite database, so their status is available after they finished.
+    Jobs which were queued or running when the api stopped are marked as failed on start.
+    """
+
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path (:obj:`str`, optional): Path to the sqlite database, defaults to JOB_STORE_PATH from env.
+
+        """
+        self.db_path = db_path or os.getenv('JOB_STORE_PATH', 'data/jobs.db')
+        self.lock = threading.Lock()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS job (job_id TEXT PRIMARY KEY, kind TEXT, action TEXT, status TEXT, '
+                               'files TEXT, created TEXT, started TEXT, finished TEXT, progress TEXT, stages TEXT, error TEXT)')
+            connection.execute('UPDATE job SET status = ?, error = ?, finished = ? WHERE status IN (?, ?)',
+                               (FAILED, 'Interrupted by restart of the api', now(), QUEUED, RUNNING))
+
+    @contextmanager
+    def connect(self):
+        """Open a connection which is committed and closed at the end of the context,
+        each operation uses its own connection as jobs are updated from the worker threads"""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, kind, action, files=None):
+        """Create a queued job
+
+        Args:
+            kind (:obj:`str`, mandatory): Kind of the data, e.g. concept, fact
+            action (:obj:`str`, mandatory): load or delete
+            files (:obj:`list`, optional): Paths to the files to be loaded
+
+        Returns:
+            dict: the job
+
+        """
+        job = {'job_id': uuid.uuid4().hex, 'kind': kind, 'action': action, 'status': QUEUED, 'files': files or [],
+               'created': now(), 'started': None, 'finished': None, 'progress': {}, 'stages': [], 'error': None}
+        with self.lock, self.connect() as connection:
+            connection.execute('INSERT INTO job (' + ', '.join(_columns) + ') VALUES (' + ', '.join('?' * len(_columns)) + ')',
+                               [self.to_column(name, job[name]) for name in _columns])
+        return job
+
+    def update(self, job_id, **values):
+        """Update the values of the job, e.g. status=RUNNING"""
+        names = list(values)
+        with self.lock, self.connect() as connection:
+            connection.execute('UPDATE job SET ' + ', '.join(name + ' = ?' for name in names) + ' WHERE job_id = ?',
+                               [self.to_column(name, values[name]) for name in names] + [job_id])
+
+    def get(self, job_id):
+        """Provide the job
+
+        Returns:
+            dict: the job, None if not found
+
+        """
+        with self.connect() as connection:
+            row = connection.execute('SELECT ' + ', '.join(_columns) + ' FROM job WHERE job_id = ?',
+                                     (job_id,)).fetchone()
+        return self.to_job(row) if row else None
+
+    def list(self, limit=100):
+        """Provide the latest jobs, newest first
+
+        Returns:
+            list: jobs
+
+        """
+        with self.connect() as connection:
+            rows = connection.execute('SELECT ' + ', '.join(_columns) + ' FROM job ORDER BY created DESC LIMIT ?',
+                                      (limit,)).fetchall()
+        return [self.to_job(row) for row in rows]
+
+    def to_column(self, name, value):
+        return json.dumps(value) if name in _json_columns else value
+
+    def to_job(self, row):
+        job = dict(zip(_columns, row))
+        for name in _json_columns:
+            job[name] = json.loads(job[name]) if job[name] else None
+        return job
+
+
+class JobQueue:
+    """Runs the jobs in worker threads. Jobs of patient mappings, patients, encounters and facts share one worker and run
+    one after the other in the order they were queued, as they depend on each other (patients, then encounters, then facts)
+    and share the mapping cache, the staging tables and the progress output. Concept jobs run in their own worker.
+
+    Progress and timings of the job are taken from the steps recorded by :mod:`i2b2_cdi.log.cdi_metrics`.
+    """
+
+    def __init__(self, store=None):
+        """
+        Args:
+            store (:obj:`JobStore`, optional): Store of the jobs, defaults to the store at JOB_STORE_PATH.
+
+        """
+        self.store = store or JobStore()
+        self.executors = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, action, function, *args, files=None, cleanup=None):
+        """Queue the job, returns at once
+
+        Args:
+            kind (:obj:`str`, mandatory): Kind of the data, e.g. concept, fact
+            action (:obj:`str`, mandatory): load or delete
+            function (:obj:`function`, mandatory): Function running the job, called with args
+            files (:obj:`list`, optional): Paths to the files to be loaded
+            cleanup (:obj:`function`, optional): Called when the job finished, even if it failed
+
+        Returns:
+            str: job id
+
+        """
+        job = self.store.create(kind, action, files)
+        self.get_executor(_queues.get(kind, kind)).submit(self.run, job['job_id'], function, args, cleanup)
+        logger.info('Queued job ' + job['job_id'] + ' : ' + action + ' ' + kind)
+        return job['job_id']
+
+    def get_executor(self, queue_name):
+        """Provide the single worker of the queue, it is created on first use"""
+        with self.lock:
+            executor = self.executors.get(queue_name)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cdi-job-' + queue_name)
+                self.executors[queue_name] = executor
+            return executor
+
+    def run(self, job_id, function, args, cleanup=None):
+        """Run the job in a worker thread and record its status, progress and stages"""
+        stages = []
+        progress = {'stage': None, 'completed_stages': 0, 'failed_stages': 0}
+
+        def on_step(event, metrics):
+            if event == 'started':
+                progress['stage'] = metrics.name
+            else:
+                stages.append(metrics.to_dict())
+                progress['completed_stages' if metrics.status == COMPLETED else 'failed_stages'] += 1
+            self.store.update(job_id, progress=progress, stages=stages)
+
+        self.store.update(job_id, status=RUNNING, started=now())
+        try:
+            with cdi_metrics.observe(on_step):
+                function(*args)
+            self.store.update(job_id, status=COMPLETED, finished=now())
+            logger.info('Completed job ' + job_id)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self.store.update(job_id, status=FAILED, finished=now(), error=str(e) or type(e).__name__)
+            logger.error('Failed job ' + job_id)
+        finally:
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning(cdi_logging.format_error_log(
+                        'Failed to clean up job ' + job_id, e))
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads after the queued jobs"""
+        with self.lock:
+            executors = list(self.executors.values())
+        for executor in executors:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,149 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`upload_stream` -- Streaming upload of the api files
+=========================================================
+
+.. module:: upload_stream
+    :platform: Linux/Windows
+    :synopsis: module contains the request class of the api writing uploaded files directly to their target file while the request is parsed
+
+
+"""
+
+import io
+import os
+import uuid
+import shutil
+from pathlib import Path
+from dotenv import load_dotenv
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+from i2b2_cdi.common.file_reader import is_columnar, is_compressed
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+
+class UploadFile(io.FileIO):
+    """Target file of an uploaded file, chunks of the request are written to it as they are parsed.
+    Size and rows (lines of csv files, not known for compressed and columnar files) are checked on every write,
+    the file is deleted and the request is rejected as soon as a limit is exceeded.
+    """
+
+    def __init__(self, file_path, max_size=None, max_rows=None):
+        """
+        Args:
+            file_path (:obj:`str`, mandatory): Path to the target file.
+            max_size (:obj:`int`, optional): Max bytes of the file, defaults to UPLOAD_MAX_SIZE from env, 0 is unlimited.
+            max_rows (:obj:`int`, optional): Max rows of a csv file without header, defaults to UPLOAD_MAX_ROWS from env, 0 is unlimited.
+
+        """
+        if max_size is None:
+            max_size = int(os.getenv('UPLOAD_MAX_SIZE', 0))
+        if max_rows is None:
+            max_rows = int(os.getenv('UPLOAD_MAX_ROWS', 0))
+        super().__init__(file_path, 'w+')
+        self.path = file_path
+        self.max_size = max_size
+        self.max_rows = 0 if is_columnar(file_path) or is_compressed(file_path) else max_rows
+        self.size = 0
+        self.lines = 0
+        self.last_byte = b''
+        self.finished = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            self.discard()
+            raise RequestEntityTooLarge('Uploaded file exceeds ' + str(self.max_size) + ' bytes')
+        if self.max_rows and data:
+            self.lines += data.count(b'\n')
+            self.last_byte = data[-1:]
+            self.check_rows(self.lines)
+        return super().write(data)
+
+    def check_rows(self, lines):
+        """Reject the upload if the lines without header exceed the max rows"""
+        if lines - 1 > self.max_rows:
+            self.discard()
+            raise RequestEntityTooLarge('Uploaded file exceeds ' + str(self.max_rows) + ' rows')
+
+    def finish(self):
+        """Close the file after the request is parsed, files which are not finished are deleted at the end of the request
+
+        Returns:
+            str: path to the uploaded file
+
+        """
+        if self.max_rows and self.last_byte not in (b'', b'\n'):
+            # Last line without line break
+            self.check_rows(self.lines + 1)
+        self.close()
+        self.finished = True
+        return self.path
+
+    def discard(self):
+        """Close and delete the file with its upload directory"""
+        self.close()
+        shutil.rmtree(Path(self.path).parent, ignore_errors=True)
+
+
+class StreamingRequest(Request):
+    """Request writing each uploaded file directly to a new directory in UPLOAD_FOLDER of the app while the request
+    is parsed, instead of spooling it in memory or a temporary file and copying it with FileStorage.save.
+    Each upload gets its own directory, so outputs of jobs running in parallel do not overwrite each other.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], uuid.uuid4().hex)
+        os.makedirs(upload_dir, exist_ok=True)
+        upload = UploadFile(os.path.join(upload_dir, secure_filename(filename or '') or 'upload'))
+        self.uploads.append(upload)
+        return upload
+
+    def discard_uploads(self):
+        """Delete the uploaded files which were not finished, e.g. rejected or of a failed request"""
+        for upload in self.uploads:
+            if not upload.finished:
+                upload.discard()
+
+
+def remove_upload(file_path):
+    """Delete the uploaded file and the outputs written next to it (deid and bcp files) when its job finished.
+    The logs directory with the run report and the error logs is kept, unless KEEP_UPLOAD_FILES is set
+    all files are kept.
+
+    Args:
+        file_path (:obj:`str`, mandatory): Path to the uploaded file
+
+    """
+    if str(os.getenv('KEEP_UPLOAD_FILES')).lower() == 'true':
+        return
+    upload_dir = Path(file_path).parent
+    if not upload_dir.is_dir():
+        return
+    for path in upload_dir.iterdir():
+        if path.name == 'logs' and path.is_dir():
+            continue
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink()
+    if not any(upload_dir.iterdir()):
+        upload_dir.rmdir()
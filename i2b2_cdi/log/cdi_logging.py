@@ -24,13 +24,83 @@
 
 import logging
 import sys
-import logstash
+import threading
 import os
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.log.logstash_handler import BatchedLogstashHandler
 
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+_loggers = {}
+_logstash_handler = None
+_stream_handler = None
+_lock = threading.RLock()
+
+
+def get_log_level():
+    """Provide the log level configured by LOG_LEVEL (e.g. DEBUG, INFO, WARNING), INFO by default"""
+    level = logging.getLevelName(str(os.getenv('LOG_LEVEL', 'INFO')).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def get_logstash_handler():
+    """Provide the process wide logstash handler, it is created on first use
+
+    Returns:
+        BatchedLogstashHandler: handler shipping the records to logstash from a background thread
+
+    """
+    global _logstash_handler
+    with _lock:
+        if _logstash_handler is None:
+            _logstash_handler = BatchedLogstashHandler()
+        return _logstash_handler
+
+
+def get_stream_handler():
+    """Provide the process wide handler printing the logs on console/terminal, it is created on first use
+
+    Returns:
+        StreamHandler: console handler
+
+    """
+    global _stream_handler
+    with _lock:
+        if _stream_handler is None:
+            _stream_handler = logging.StreamHandler()
+            _stream_handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        return _stream_handler
+
+
+def set_log_level(level):
+    """Set the level of all loggers provided by :func:`get_logger`
+
+    Args:
+        level (:obj:`int`, mandatory): Log level, e.g. logging.DEBUG
+
+    """
+    with _lock:
+        os.environ['LOG_LEVEL'] = logging.getLevelName(level)
+        for logger in _loggers.values():
+            logger.setLevel(level)
+
+
+def logstash_metrics():
+    """Provide the counts of sent, dropped and failed logstash records
+
+    Returns:
+        dict: record counts, see :meth:`BatchedLogstashHandler.metrics`
+
+    """
+    return get_logstash_handler().metrics()
 
 
 def get_logger(logger_name):
-    """Provide the logger instance which has been configured to print logs of different log levels and streams the logs to the Kibana as well as to the console
+    """Provide the logger instance which has been configured to print logs of different log levels and streams the logs to the Kibana as well as to the console.
+    Loggers are configured once per name and share the process wide handlers, so calling it again for a name adds no handlers.
 
     Args:
         logger_name (str): name of the resource to which the loggers need to be added
@@ -39,21 +109,18 @@ def get_logger(logger_name):
         Logger: logger for the provided resource
 
     """
-    host = 'localhost'
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.INFO)
-
-    # logger handler for printing logs on kibana
-    logger.addHandler(logstash.TCPLogstashHandler(host, 5000, version=1))
-
-    # logger handler for printing logs on console/terminal
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+    with _lock:
+        logger = _loggers.get(logger_name)
+        if logger is None:
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(get_log_level())
+
+            # Shared handlers printing logs on kibana (records are queued and sent in batches) and on console/terminal
+            for handler in (get_logstash_handler(), get_stream_handler()):
+                if handler not in logger.handlers:
+                    logger.addHandler(handler)
+            _loggers[logger_name] = logger
+        return logger
 
 
 def format_error_log(message='', error=None):
@@ -0,0 +1,315 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`cdi_metrics` -- Metrics of the load steps
+===============================================
+
+.. module:: cdi_metrics
+    :platform: Linux/Windows
+    :synopsis: module contains context managers recording rows, bytes, time and memory of each step of a load and writing the run report
+
+Each load runs in :func:`run`, each of its steps in :func:`step`. The stages count their rows with :func:`count`.
+Metrics of every step are logged as logstash fields, the run report of the load is logged and written as json.
+
+"""
+
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from dotenv import load_dotenv
+from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.common.utils import get_rss, get_peak_rss
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+logger = cdi_logging.get_logger(__file__)
+
+# Loads and steps in progress of each thread, jobs of the api run loads in parallel threads
+_state = threading.local()
+
+
+def get_state():
+    """Provide the loads, steps and observers in progress of the current thread"""
+    if not hasattr(_state, 'runs'):
+        _state.runs = []
+        _state.steps = []
+        _state.observers = []
+    return _state
+
+
+def is_enabled():
+    """Check if the metrics are recorded (RUN_METRICS_ENABLED)"""
+    return str(os.getenv('RUN_METRICS_ENABLED', 'true')).lower() == 'true'
+
+
+def get_cpu_time():
+    """Provide the user and system cpu time of the whole process and its terminated child processes (e.g. worker pools),
+    it includes the threads of other jobs running at the same time
+
+    Returns:
+        float: cpu time in seconds
+
+    """
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+    except ImportError:
+        return time.process_time()
+
+
+def get_size(*file_paths):
+    """Provide the total size of the existing files
+
+    Returns:
+        int: size in bytes
+
+    """
+    return sum(os.path.getsize(file_path) for file_path in file_paths
+               if file_path and os.path.isfile(file_path))
+
+
+class StepMetrics:
+    """Metrics of one step: rows in, out and rejected, bytes read and written, wall time and RSS at start and end of the step.
+    Cpu time and peak RSS are of the whole process (process_cpu_time, process_peak_rss), they include other jobs
+    running at the same time and the peak may have been reached before the step.
+    """
+
+    def __init__(self, name, read_files=()):
+        """
+        Args:
+            name (:obj:`str`, mandatory): Name of the step, e.g. de_identify_facts.
+            read_files (:obj:`list`, optional): Paths to the input files, their size is counted as bytes read.
+
+        """
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.rows_rejected = None
+        self.bytes_read = get_size(*read_files)
+        self.bytes_written = 0
+        self.status = None
+        self.start_time = time.time()
+        self.start_cpu_time = get_cpu_time()
+        self.rss_start = get_rss()
+        self.rss_end = None
+        self.wall_time = None
+        self.process_cpu_time = None
+        self.process_peak_rss = None
+
+    def count(self, rows_in=None, rows_out=None, rows_rejected=None):
+        """Add the counts of rows, counts which are not provided are left unchanged"""
+        if rows_in is not None:
+            self.rows_in = (self.rows_in or 0) + rows_in
+        if rows_out is not None:
+            self.rows_out = (self.rows_out or 0) + rows_out
+        if rows_rejected is not None:
+            self.rows_rejected = (self.rows_rejected or 0) + rows_rejected
+
+    def read(self, *file_paths):
+        """Add the size of the files to the bytes read"""
+        self.bytes_read += get_size(*file_paths)
+
+    def written(self, *file_paths):
+        """Add the size of the files to the bytes written"""
+        self.bytes_written += get_size(*file_paths)
+
+    def stop(self, status):
+        self.status = status
+        self.wall_time = round(time.time() - self.start_time, 3)
+        self.process_cpu_time = round(get_cpu_time() - self.start_cpu_time, 3)
+        self.rss_end = get_rss()
+        self.process_peak_rss = get_peak_rss()
+
+    def to_dict(self):
+        rows_per_sec = None
+        if self.rows_in is not None and self.wall_time:
+            rows_per_sec = round(self.rows_in / self.wall_time, 1)
+        return {'step': self.name, 'status': self.status,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out, 'rows_rejected': self.rows_rejected,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'wall_time': self.wall_time, 'rows_per_sec': rows_per_sec,
+                'rss_start': self.rss_start, 'rss_end': self.rss_end,
+                'process_cpu_time': self.process_cpu_time, 'process_peak_rss': self.process_peak_rss}
+
+
+class RunReport:
+    """Metrics of the steps of one load"""
+
+    def __init__(self, name, input_file=None):
+        """
+        Args:
+            name (:obj:`str`, mandatory): Name of the load, e.g. load_facts.
+            input_file (:obj:`str`, optional): Path to the loaded file, the report is written to its logs directory.
+
+        """
+        self.name = name
+        self.input_file = str(input_file) if input_file else None
+        self.steps = []
+        self.status = None
+        self.started = datetime.datetime.now()
+        self.start_time = time.time()
+        self.start_cpu_time = get_cpu_time()
+
+    def to_dict(self):
+        # Pools are created on first database access
+        from i2b2_cdi.database.connection_pool import pool_metrics
+        return {'load': self.name, 'input_file': self.input_file, 'status': self.status,
+                'started': self.started.isoformat(),
+                'wall_time': round(time.time() - self.start_time, 3),
+                'process_cpu_time': round(get_cpu_time() - self.start_cpu_time, 3),
+                'process_peak_rss': get_peak_rss(),
+                'steps': [metrics.to_dict() for metrics in self.steps],
+                'database_pools': pool_metrics(),
+                'logstash': cdi_logging.logstash_metrics()}
+
+    def get_report_path(self):
+        """Provide the path of the json report, in RUN_REPORT_DIR or the logs directory next to the input file"""
+        report_dir = os.getenv('RUN_REPORT_DIR')
+        if not report_dir:
+            if not self.input_file:
+                return None
+            report_dir = os.path.join(Path(self.input_file).parent, 'logs')
+        file_name = 'run_report_' + self.name + '_' + \
+            self.started.strftime('%Y%m%d_%H%M%S') + '.json'
+        return os.path.join(report_dir, file_name)
+
+    def write(self, report):
+        """Write the report as json
+
+        Returns:
+            str: path to the report, None if there is no report directory
+
+        """
+        report_path = self.get_report_path()
+        if report_path:
+            Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(report_path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        return report_path
+
+
+@contextmanager
+def run(name, input_file=None):
+    """Record the steps run in the context as one load, the run report is logged and written when the load ends
+
+    Args:
+        name (:obj:`str`, mandatory): Name of the load, e.g. load_facts
+        input_file (:obj:`str`, optional): Path to the loaded file
+
+    Returns:
+        RunReport: report of the load, None if metrics are disabled
+
+    """
+    if not is_enabled():
+        yield None
+        return
+    runs = get_state().runs
+    report = RunReport(name, input_file)
+    runs.append(report)
+    status = 'failed'
+    try:
+        yield report
+        status = 'completed'
+    finally:
+        runs.remove(report)
+        report.status = status
+        try:
+            report_dict = report.to_dict()
+            report_path = report.write(report_dict)
+            logger.info('Run report of ' + name + (' : ' + report_path if report_path else ''),
+                        extra={'cdi_run_report': report_dict})
+        except Exception as e:
+            # Metrics must not fail the load
+            logger.warning(cdi_logging.format_error_log(
+                'Failed to write the run report', e))
+
+
+@contextmanager
+def step(name, read_files=()):
+    """Record the metrics of the step run in the context, the metrics are logged as logstash fields when the step ends
+
+    Args:
+        name (:obj:`str`, mandatory): Name of the step, e.g. de_identify_facts
+        read_files (:obj:`list`, optional): Paths to the input files of the step
+
+    Returns:
+        StepMetrics: metrics of the step, to add rows and written files
+
+    """
+    state = get_state()
+    metrics = StepMetrics(name, read_files)
+    state.steps.append(metrics)
+    notify(state, 'started', metrics)
+    status = 'failed'
+    try:
+        yield metrics
+        status = 'completed'
+    finally:
+        state.steps.remove(metrics)
+        metrics.stop(status)
+        if is_enabled():
+            if state.runs:
+                state.runs[-1].steps.append(metrics)
+            fields = {'cdi_' + key: value for key,
+                      value in metrics.to_dict().items()}
+            if state.runs:
+                fields['cdi_load'] = state.runs[-1].name
+            logger.info('Metrics of ' + name + ' : ' + json.dumps(metrics.to_dict()),
+                        extra=fields)
+        notify(state, 'finished', metrics)
+
+
+@contextmanager
+def observe(callback):
+    """Call the callback when a step of the current thread starts or finishes while in the context, e.g. to report progress of a job
+
+    Args:
+        callback (:obj:`function`, mandatory): Called with 'started' or 'finished' and the :class:`StepMetrics`
+
+    """
+    observers = get_state().observers
+    observers.append(callback)
+    try:
+        yield
+    finally:
+        observers.remove(callback)
+
+
+def notify(state, event, metrics):
+    """Call the observers of the thread, errors of an observer do not fail the step"""
+    for callback in list(state.observers):
+        try:
+            callback(event, metrics)
+        except Exception as e:
+            logger.warning(cdi_logging.format_error_log(
+                'Failed to notify the step observer', e))
+
+
+def count(rows_in=None, rows_out=None, rows_rejected=None):
+    """Add the counts of rows to the current step, called by the stages. Counts outside of a step are ignored.
+
+    Args:
+        rows_in (:obj:`int`, optional): Rows read
+        rows_out (:obj:`int`, optional): Rows written
+        rows_rejected (:obj:`int`, optional): Rows written to the error file
+
+    """
+    steps = get_state().steps
+    if steps:
+        steps[-1].count(rows_in, rows_out, rows_rejected)
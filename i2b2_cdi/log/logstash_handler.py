@@ -0,0 +1,194 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`logstash_handler` -- Non-blocking logstash handler
+========================================================
+
+.. module:: logstash_handler
+    :platform: Linux/Windows
+    :synopsis: module contains logging handler queueing the records and shipping them to logstash in batches from a background thread
+
+
+"""
+
+import os
+import copy
+import queue
+import atexit
+import logging
+import threading
+import logstash
+
+_flush = object()
+_stop = object()
+
+
+class BatchedLogstashHandler(logging.Handler):
+    """Logging handler which puts the records to a bounded queue, a background thread sends them to logstash over tcp
+    in batches. Logging never waits for the network: when the queue is full, records below WARNING are dropped and
+    warnings and errors replace the oldest queued record. Dropped records and records of failed sends are counted.
+
+    Queued records are sent when the handler is closed, which is done on exit.
+    """
+
+    def __init__(self, host=None, port=None, queue_size=None, batch_size=None, flush_interval=None, close_timeout=None):
+        """
+        Args:
+            host (:obj:`str`, optional): Host of logstash, defaults to LOGSTASH_HOST from env.
+            port (:obj:`int`, optional): Tcp port of logstash, defaults to LOGSTASH_PORT from env.
+            queue_size (:obj:`int`, optional): Max queued records, defaults to LOGSTASH_QUEUE_SIZE from env.
+            batch_size (:obj:`int`, optional): Max records per send, defaults to LOGSTASH_BATCH_SIZE from env.
+            flush_interval (:obj:`float`, optional): Seconds a record waits for the batch to fill, defaults to LOGSTASH_FLUSH_INTERVAL from env.
+            close_timeout (:obj:`float`, optional): Seconds to wait for the queued records on close, defaults to LOGSTASH_CLOSE_TIMEOUT from env.
+
+        """
+        super().__init__()
+        self.host = host or os.getenv('LOGSTASH_HOST', 'localhost')
+        self.port = int(port or os.getenv('LOGSTASH_PORT', 5000))
+        self.queue_size = max(1, int(queue_size or os.getenv('LOGSTASH_QUEUE_SIZE', 10000)))
+        self.batch_size = max(1, int(batch_size or os.getenv('LOGSTASH_BATCH_SIZE', 500)))
+        self.flush_interval = float(flush_interval or os.getenv('LOGSTASH_FLUSH_INTERVAL', 1))
+        self.close_timeout = float(close_timeout or os.getenv('LOGSTASH_CLOSE_TIMEOUT', 5))
+        self.dropped = 0
+        self.failed = 0
+        self.sent = 0
+        self.closed = False
+        self.start()
+        atexit.register(self.close)
+
+    def start(self):
+        """Create the queue, the transport and the sender thread, called again in a forked child process"""
+        self.pid = os.getpid()
+        self.queue = queue.Queue(self.queue_size)
+        # Transport formats the records as logstash events and reconnects with backoff
+        self.transport = logstash.TCPLogstashHandler(self.host, self.port, version=1)
+        self.thread = threading.Thread(target=self.run, name='logstash-sender', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        """Queue the record, never waits"""
+        if self.closed:
+            return
+        if os.getpid() != self.pid:
+            # Sender thread of the parent does not exist in a forked child
+            self.start()
+        try:
+            record = self.prepare(record)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.drop(record)
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """Provide a copy of the record with the arguments merged into the message, like QueueHandler,
+        so the record is formatted later by the sender thread
+
+        Returns:
+            LogRecord: record to be queued
+
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def drop(self, record):
+        """Drop the record, or the oldest queued record to make room for a warning or error.
+        Flush and stop requests in the queue are never dropped."""
+        if record.levelno >= logging.WARNING:
+            with self.queue.mutex:
+                items = self.queue.queue
+                for index, item in enumerate(items):
+                    if isinstance(item, logging.LogRecord):
+                        # Size of the queue is unchanged, no waiting thread needs to be notified
+                        del items[index]
+                        items.append(record)
+                        break
+        with self.lock:
+            self.dropped += 1
+
+    def run(self):
+        """Send the queued records in batches until the handler is closed"""
+        batch = []
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                item = _flush
+            if isinstance(item, logging.LogRecord):
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+            self.send(batch)
+            batch = []
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _stop:
+                return
+
+    def send(self, batch):
+        """Send the records as newline separated logstash events in one write"""
+        if not batch:
+            return
+        try:
+            self.transport.send(b''.join(self.transport.makePickle(record) for record in batch))
+            sent = self.transport.sock is not None
+        except Exception:
+            sent = False
+        with self.lock:
+            if sent:
+                self.sent += len(batch)
+            else:
+                # Logstash is not reachable, records are not kept for a retry
+                self.failed += len(batch)
+
+    def flush(self, timeout=None):
+        """Wait until the records queued so far are sent
+
+        Args:
+            timeout (:obj:`float`, optional): Seconds to wait, defaults to close_timeout
+
+        """
+        if self.closed or not self.thread.is_alive():
+            return
+        flushed = threading.Event()
+        timeout = self.close_timeout if timeout is None else timeout
+        try:
+            self.queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return
+        flushed.wait(timeout)
+
+    def close(self):
+        """Send the queued records and stop the sender thread"""
+        if not self.closed and self.thread.is_alive() and os.getpid() == self.pid:
+            try:
+                self.queue.put(_stop, timeout=self.close_timeout)
+                self.thread.join(self.close_timeout)
+            except queue.Full:
+                pass
+        self.closed = True
+        self.transport.close()
+        super().close()
+
+    def metrics(self):
+        """Provide the counts of sent, dropped and failed records
+
+        Returns:
+            dict: sent, dropped, failed and queued record counts
+
+        """
+        with self.lock:
+            return {'sent': self.sent, 'dropped': self.dropped, 'failed': self.failed,
+                    'queued': self.queue.qsize()}
@@ -21,15 +21,19 @@
 
 """
 
-from dateformat import DateFormat
 import os
 from pathlib import Path
 import csv
 from datetime import datetime as DateTime
 from i2b2_cdi.exception.cdi_max_err_reached import MaxErrorCountReachedError
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
+from i2b2_cdi.common.file_writer import WriterSession
+from i2b2_cdi.common.row_plan import RowPlan
+from i2b2_cdi.common.pipeline import Pipeline
+from i2b2_cdi.common.date_validator import is_valid_datetime
 from alive_progress import alive_bar, config_handler
 from i2b2_cdi.common.utils import *
+from i2b2_cdi.common.file_reader import open_csv
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
 from i2b2_cdi.patient import patient_mapping as PatientMapping
 from i2b2_cdi.encounter import encounter_mapping as EncounterMapping
@@ -45,9 +49,9 @@ class DeidPatient:
     """The class provides the interface for de-identifying i.e. (mapping src patient id to i2b2 generated patient num) patients file"""
 
     def __init__(self):
-        self.date_format = DateFormat("YYYY-MM-DD hh:mm:ss")
         self.err_records_max = int(os.getenv('MAX_VALIDATION_ERROR_COUNT'))
         self.write_batch_size = 100
+        self.writer_session = WriterSession()
         now = DateTime.now()
         self.import_time = now.strftime("%Y-%m-%d %H:%M:%S")
         self.deid_header = ['PatientID', 'VitalStatusCD', 'BirthDate', 'DeathDate', 'SexCD', 'AgeInYears',
@@ -67,8 +71,7 @@ class DeidPatient:
             error_file_path (:obj:`str`, mandatory): Path to the error file, which contains error records
         """
         _error_rows_arr = []
-        _valid_rows_arr = []
-        max_line = file_len(csv_file_path)
+        max_line = progress_total(csv_file_path)
         logger.info('De-identifing patient file : ' + csv_file_path)
         try:
             # Write file header
@@ -77,35 +80,41 @@ class DeidPatient:
             print('\n')
 
             # Read input csv file
-            with open(csv_file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(
-                    csv_file, delimiter=input_csv_delimiter)
+            with open_csv(csv_file_path, input_csv_delimiter) as (csv_file, csv_reader):
+                # Rows are lists in deid file layout, fields are accessed by index
+                columns = ['PatientID', 'BirthDate', 'DeathDate']
+                plan = RowPlan(next(csv_reader, None),
+                               self.deid_header, required=columns)
+                patient_col, birth_date_col, death_date_col = [
+                    plan.index[name] for name in columns]
                 row_number = 0
-                with alive_bar(max_line, bar='smooth') as bar:
-                    for row in csv_reader:
+
+                def deidentify_block(rows):
+                    nonlocal row_number
+                    _valid_rows_arr = []
+                    for row in rows:
                         _validation_error = []
                         row_number += 1
 
                         # Validate record
-                        if not row['PatientID']:
+                        if not row[patient_col]:
                             _validation_error.append("Patient ID is Null")
-                        if row['BirthDate'] and not self.is_valid_date_format(row['BirthDate']):
+                        if row[birth_date_col] and not self.is_valid_date_format(row[birth_date_col]):
                             _validation_error.append("Invalid birth date format")
-                        if row['DeathDate'] and not self.is_valid_date_format(row['DeathDate']):
+                        if row[death_date_col] and not self.is_valid_date_format(row[death_date_col]):
                             _validation_error.append("Invalid death date format")
 
                         # Replace src patient id by i2b2 patient num
-                        patient_num = patient_map.get(row['PatientID'])
+                        patient_num = patient_map.get(row[patient_col])
                         if patient_num is None:
                             _validation_error.append("Patient mapping not found")
                         else:
-                            row['PatientID'] = patient_num
+                            row[patient_col] = patient_num
 
                         # Append error record if found
                         if _validation_error:
-                            row['ValidationError'] = ','.join(
-                                _validation_error)
-                            row['ErrorRowNumber'] = str(row_number)
+                            row.append(','.join(_validation_error))
+                            row.append(str(row_number))
                             _error_rows_arr.append(row)
                         else:
                             _valid_rows_arr.append(row)
@@ -119,26 +128,31 @@ class DeidPatient:
                             raise MaxErrorCountReachedError(
                                 "Exiting function as max errors records limit reached - " + str(self.err_records_max))
 
-                        # Write valid records to file, if batch size reached.
-                        if len(_valid_rows_arr) == self.write_batch_size:
-                            self.write_to_deid_file(
-                                _valid_rows_arr, deid_file_path, output_deid_delimiter)
-                            _valid_rows_arr = []
+                    # Print progress
+                    progress(incr=len(rows))
+                    return _valid_rows_arr
 
-                        # Print progress
-                        bar()
+                def write_block(_valid_rows_arr):
+                    self.write_to_deid_file(
+                        _valid_rows_arr, deid_file_path, output_deid_delimiter)
 
-                # Writer valid records to file (remaining records when given batch size does not meet)
-                self.write_to_deid_file(
-                    _valid_rows_arr, deid_file_path, output_deid_delimiter)
+                # Parsing, de-identification and writing of blocks overlap
+                with alive_bar(max_line, bar='smooth') as bar:
+                    progress = FileProgress(csv_file, bar)
+                    Pipeline().run(plan.rows(csv_reader),
+                                   deidentify_block, write_block)
+                    progress.update()
 
                 # Write error records to file
                 self.write_to_error_file(error_file_path, _error_rows_arr)
+                cdi_metrics.count(row_number, row_number - len(_error_rows_arr), len(_error_rows_arr))
             print('\n')
         except MaxErrorCountReachedError:
             raise
         except Exception as e:
             raise e
+        finally:
+            self.writer_session.close()
 
     def is_valid_date_format(self, _date):
         """This method checks for date format
@@ -149,11 +163,7 @@ class DeidPatient:
         Returns:
             boolean: True if date format is correct else false.
         """
-        try:
-            self.date_format.parse(_date)
-            return True
-        except ValueError:
-            return False
+        return is_valid_datetime(_date)
 
     def write_deid_file_header(self, deid_file_path, output_deid_delimiter):
         """This method writes the header of deid file using csv writer
@@ -163,10 +173,9 @@ class DeidPatient:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerow(self.deid_header)
         except Exception as e:
             raise e
 
@@ -180,10 +189,9 @@ class DeidPatient:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.deid_header, delimiter=output_deid_delimiter, lineterminator='\n')
-                writer.writerows(_valid_rows_arr)
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=output_deid_delimiter, lineterminator='\n')
+            writer.writerows(_valid_rows_arr)
         except Exception as e:
             raise e
 
@@ -195,10 +203,9 @@ class DeidPatient:
 
         """
         try:
-            with open(deid_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writeheader()
+            writer = self.writer_session.get_writer(
+                deid_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerow(self.error_file_header)
         except Exception as e:
             raise e
 
@@ -211,10 +218,9 @@ class DeidPatient:
 
         """
         try:
-            with open(error_file_path, 'a+') as csvfile:
-                writer = csv.DictWriter(
-                    csvfile, fieldnames=self.error_file_header, delimiter=',', quoting=csv.QUOTE_ALL)
-                writer.writerows(_error_rows_arr)
+            writer = self.writer_session.get_writer(
+                error_file_path, delimiter=',', quoting=csv.QUOTE_ALL)
+            writer.writerows(_error_rows_arr)
         except Exception as e:
             raise e
 
@@ -22,13 +22,18 @@
 """
 
 import os
+import time
 from pathlib import Path
 import csv
 from datetime import datetime as DateTime
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from alive_progress import alive_bar, config_handler
 from i2b2_cdi.common.utils import *
+from i2b2_cdi.common.file_reader import open_csv
+from i2b2_cdi.common.id_map import IdMap
+from i2b2_cdi.common.mapping_cache import patient_mapping_cache
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource
+from i2b2_cdi.database.database_helper import fetch_in_batches
 from dotenv import load_dotenv
 from i2b2_cdi.exception.cdi_database_error import CdiDatabaseError
 
@@ -59,20 +64,21 @@ class PatientMapping:
         logger.info('Creating patient mapping from mrn file : ' + mrn_file_path)
         try:
             # max lines
-            max_line = file_len(mrn_file_path)
+            max_line = progress_total(mrn_file_path)
 
             # Get max of patient_num
             self.patient_num = self.get_max_patient_num()
+            max_patient_num = self.patient_num
 
             # Get existing patient mapping
             patient_map = get_patient_mapping()
 
             # Read input csv file
-            with open(mrn_file_path, mode='r') as csv_file:
-                csv_reader = csv.reader(csv_file, delimiter=mrn_file_delimiter)
+            with open_csv(mrn_file_path, mrn_file_delimiter) as (csv_file, csv_reader):
                 row_number = 0
                 header = next(csv_reader)
                 with alive_bar(max_line, bar='smooth') as bar:
+                    progress = FileProgress(csv_file, bar)
                     for row in csv_reader:
                         _validation_error = []
                         row_number += 1
@@ -88,13 +94,98 @@ class PatientMapping:
                                 patient_num, row, header, patient_map)
 
                         # Print progress
-                        bar()
+                        progress()
                     # Save remianing patients (if patient list size is less then write_batch_size )
                     self.save_patient_mapping(self.patient_list)
+                    progress.update()
+                cdi_metrics.count(row_number, self.patient_num - max_patient_num)
             print('\n')
         except Exception as e:
             raise e
 
+    def create_patient_mapping_bulk(self, mrn_file_path, mrn_file_delimiter):
+        """This method creates patient mapping like :meth:`create_patient_mapping`, but the new mappings are collected
+        while reading the file and saved at once by :meth:`bulk_save_patient_mapping`
+
+        Args:
+            mrn_file_path (:obj:`str`, mandatory): Path to the mrn file.
+            mrn_file_delimiter (:obj:`str`, mandatory): Delimiter to be used while reading the file
+
+        """
+        logger.info('Creating patient mapping in bulk from mrn file : ' + mrn_file_path)
+        max_line = progress_total(mrn_file_path)
+
+        # Get existing patient mapping
+        patient_map = get_patient_mapping()
+
+        # New patients of the file, each is the list of its (src id, src), their nums are assigned after reading
+        new_patients = []
+        # Src id of a new patient to its index in new_patients
+        new_map = {}
+        row_number = 0
+        with open_csv(mrn_file_path, mrn_file_delimiter) as (csv_file, csv_reader):
+            header = next(csv_reader)
+            with alive_bar(max_line, bar='smooth') as bar:
+                progress = FileProgress(csv_file, bar)
+                for row in csv_reader:
+                    # Rows having a src id which is mapped already, or new in an earlier row, are not new patients
+                    if not any(pt_id in new_map or pt_id in patient_map for pt_id in row):
+                        new_ids = [(pt_id, header[count]) for count, pt_id in enumerate(row) if pt_id != '']
+                        for pt_id, _ in new_ids:
+                            new_map[pt_id] = len(new_patients)
+                        new_patients.append(new_ids)
+                    row_number += 1
+                    progress()
+                progress.update()
+        print('\n')
+        # Patient nums relative to the max patient_num in one pass, the max patient_num is added while saving
+        new_mappings = [(pt_id, src, index + 1)
+                        for index, new_ids in enumerate(new_patients) for pt_id, src in new_ids]
+        self.bulk_save_patient_mapping(new_mappings)
+        cdi_metrics.count(row_number, len(new_patients))
+
+    def bulk_save_patient_mapping(self, new_mappings):
+        """This method saves the new patient mappings on one connection in one transaction.
+        Mappings are bulk loaded in a temporary staging table, then inserted into patient_mapping with one
+        INSERT...SELECT adding the max patient_num, which is read under lock in the same transaction.
+
+        Args:
+            new_mappings (:obj:`list`, mandatory): (src patient id, src, relative patient num) of new patients.
+
+        Returns:
+            int: count of inserted patient mappings
+
+        """
+        if not new_mappings:
+            return 0
+        start_time = time.time()
+        batch_size = int(os.getenv('ODBC_BATCH_SIZE', 5000))
+        with I2b2demoDataSource() as cursor:
+            # Pooled connections keep the session, a stage table left by a failed run is dropped first
+            cursor.execute(
+                "IF OBJECT_ID('tempdb..#patient_mapping_stage') IS NOT NULL DROP TABLE #patient_mapping_stage")
+            cursor.execute(
+                'CREATE TABLE #patient_mapping_stage (patient_ide varchar(200), patient_ide_source varchar(50), patient_num int)')
+            if hasattr(cursor, 'fast_executemany'):
+                cursor.fast_executemany = True
+            query = 'INSERT INTO #patient_mapping_stage (patient_ide, patient_ide_source, patient_num) VALUES (?, ?, ?)'
+            for start in range(0, len(new_mappings), batch_size):
+                cursor.executemany(
+                    query, new_mappings[start:start + batch_size])
+
+            cursor.execute(
+                'SELECT COALESCE(MAX(patient_num), 0) FROM patient_mapping WITH (UPDLOCK, HOLDLOCK)')
+            self.patient_num = cursor.fetchone()[0]
+            cursor.execute('INSERT INTO patient_mapping (patient_ide, patient_ide_source, patient_num, project_id, import_date) '
+                           "SELECT patient_ide, patient_ide_source, patient_num + ?, 'demo', ? FROM #patient_mapping_stage",
+                           self.patient_num, self.import_time)
+            row_count = cursor.rowcount
+            cursor.execute('DROP TABLE #patient_mapping_stage')
+        elapsed = max(time.time() - start_time, 1e-6)
+        logger.info('Inserted {0} patient mappings after patient_num {1} in {2:.1f}s ({3:.0f} rows/sec)'.format(
+            row_count, self.patient_num, elapsed, row_count / elapsed))
+        return row_count
+
     def insert_patient_mapping(self, patient_num, pt_ids, pt_id_srcs, patient_map):
         """This method writes patient mapping to the database table using pyodbc connection cursor
 
@@ -187,7 +278,10 @@ def create_patient_mapping(mrn_file_path):
     if os.path.exists(mrn_file_path):
         D = PatientMapping()
         mrn_file_delimiter = str(os.getenv('CSV_DELIMITER'))
-        D.create_patient_mapping(mrn_file_path, mrn_file_delimiter)
+        if str(os.getenv('BULK_PATIENT_MAPPING')).lower() == 'true':
+            D.create_patient_mapping_bulk(mrn_file_path, mrn_file_delimiter)
+        else:
+            D.create_patient_mapping(mrn_file_path, mrn_file_delimiter)
     else:
         logger.error('File does not exist : ' + mrn_file_path)
 
@@ -197,13 +291,18 @@ def get_patient_mapping():
     patient_map = {}
     try:
         logger.info('Getting data from patient mapping')
+        compact = str(os.getenv('COMPACT_ID_MAP')).lower() == 'true'
+        if str(os.getenv('MAPPING_CACHE_ENABLED')).lower() == 'true':
+            return patient_mapping_cache().get_mapping(compact)
         query = 'SELECT patient_ide, patient_num FROM patient_mapping'
         with I2b2demoDataSource() as (cursor):
             cursor.execute(query)
-            result = cursor.fetchall()
-            if result:
+            result = fetch_in_batches(cursor, name='patient_mapping')
+            if compact:
+                patient_map = IdMap.from_items(result)
+            else:
                 for row in result:
-                    patient_map.update({row[0]: row[1]})
+                    patient_map[row[0]] = row[1]
 
         return patient_map
     except Exception as e:
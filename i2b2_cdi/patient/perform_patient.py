@@ -26,13 +26,13 @@ import traceback
 import argparse
 import os
 from dotenv import load_dotenv
-from i2b2_cdi.log import cdi_logging
+from i2b2_cdi.log import cdi_logging, cdi_metrics
 from i2b2_cdi.database.cdi_database_connections import I2b2demoDataSource, I2b2metaDataSource
 from i2b2_cdi.patient import delete_patient
 from i2b2_cdi.patient import patient_mapping
 from i2b2_cdi.patient import transform_file as TransformFile
 from i2b2_cdi.patient import deid_patient as DeidPatient
-from i2b2_cdi.common.py_bcp import PyBCP
+from i2b2_cdi.common.uploader import get_uploader
 from i2b2_cdi.common.bcolors import BColors
 
 SUCCESS = BColors.OKGREEN + "Completed \u2714" + BColors.ENDC
@@ -109,7 +109,9 @@ def load_patient_mapping(mrn_file_path):
     step = BColors.HEADER + "Import patient mapping" + BColors.ENDC
     logger.info(step)
     try:
-        patient_mapping.create_patient_mapping(mrn_file_path)
+        with cdi_metrics.run('load_patient_mapping', mrn_file_path):
+            with cdi_metrics.step('create_patient_mapping', [mrn_file_path]):
+                patient_mapping.create_patient_mapping(mrn_file_path)
     except Exception:
         logger.error(traceback.format_exc())
         logger.error(
@@ -127,9 +129,10 @@ def load_patients(patient_file_path):
     Args:
         patient_file_path (:obj:`str`, mandatory): Path to the file which needs to be imported
     """
-    deid_file_path = de_identify_patients(patient_file_path)
-    bcp_file_path = convert_csv_to_bcp(deid_file_path)
-    bcp_upload(bcp_file_path)
+    with cdi_metrics.run('load_patients', patient_file_path):
+        deid_file_path = de_identify_patients(patient_file_path)
+        bcp_file_path = convert_csv_to_bcp(deid_file_path)
+        bcp_upload(bcp_file_path)
 
 
 def de_identify_patients(file_path):
@@ -144,7 +147,9 @@ def de_identify_patients(file_path):
     step = BColors.HEADER + "De-identify patients" + BColors.ENDC
     logger.info(step)
     try:
-        deid_file_path, error_file_path = DeidPatient.do_deidentify(file_path)
+        with cdi_metrics.step('de_identify_patients', [file_path]) as metrics:
+            deid_file_path, error_file_path = DeidPatient.do_deidentify(file_path)
+            metrics.written(deid_file_path, error_file_path)
         logger.info(
             "Check error logs of patients de-identification if any : " + error_file_path)
         logger.info(SUCCESS)
@@ -168,7 +173,9 @@ def convert_csv_to_bcp(file_path):
     step = BColors.HEADER + "Convert CSV to BCP" + BColors.ENDC
     logger.info(step)
     try:
-        bcp_file_path = TransformFile.do_transform(file_path)
+        with cdi_metrics.step('convert_csv_to_bcp', [file_path]) as metrics:
+            bcp_file_path = TransformFile.do_transform(file_path)
+            metrics.written(bcp_file_path)
         logger.info(SUCCESS)
         return bcp_file_path
     except Exception as e:
@@ -190,7 +197,7 @@ def bcp_upload(bcp_file_path):
     logger.info(step)
     base_dir = str(Path(bcp_file_path).parents[2])
     try:
-        _bcp = PyBCP(
+        _bcp = get_uploader(
             table_name="patient_dimension_temp",
             import_file=bcp_file_path,
             delimiter=str(os.getenv('CSV_DELIMITER')),
@@ -198,11 +205,13 @@ def bcp_upload(bcp_file_path):
             error_file=base_dir + "/logs/error_bcp_patients.log")
         create_table_path = Path('i2b2_cdi/resources/sql') / \
             'create_patient_dimension_temp.sql'
-        _bcp.execute_sql(create_table_path)
-        _bcp.upload()
-        load_patient_path = Path('i2b2_cdi/resources/sql') / \
-            'load_patient_dimension_from_temp.sql'
-        _bcp.execute_sql(load_patient_path)
+        with cdi_metrics.step('bcp_upload', [bcp_file_path]) as metrics:
+            _bcp.execute_sql(create_table_path)
+            row_count = _bcp.upload()
+            metrics.count(row_count, row_count)
+            load_patient_path = Path('i2b2_cdi/resources/sql') / \
+                'load_patient_dimension_from_temp.sql'
+            _bcp.execute_sql(load_patient_path)
         logger.info(SUCCESS)
     except Exception as e:
         logger.error(traceback.format_exc())
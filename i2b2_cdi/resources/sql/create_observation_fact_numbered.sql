@@ -15,7 +15,13 @@ use i2b2demodata;
 IF EXISTS (SELECT * FROM sys.objects 
 WHERE object_id = OBJECT_ID(N'[dbo].[OBSERVATION_FACT_NUMBERED]') AND type in (N'U'))
 BEGIN 
-   DELETE [dbo].[OBSERVATION_FACT_NUMBERED]
+   TRUNCATE TABLE [dbo].[OBSERVATION_FACT_NUMBERED]
+END
+
+IF EXISTS (SELECT * FROM sys.indexes
+WHERE object_id = OBJECT_ID(N'[dbo].[OBSERVATION_FACT_NUMBERED]') AND name = N'OFN_IDX_KEY')
+BEGIN
+   DROP INDEX [OFN_IDX_KEY] ON [dbo].[OBSERVATION_FACT_NUMBERED]
 END
 
 IF  NOT EXISTS (SELECT * FROM sys.objects 
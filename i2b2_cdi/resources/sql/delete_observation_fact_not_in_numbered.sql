@@ -0,0 +1,35 @@
+--
+-- This Source Code Form is subject to the terms of the Mozilla Public License, v.
+-- 2.0 with a Healthcare Disclaimer.
+-- A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+-- be found under the top level directory, named LICENSE.
+-- If a copy of the MPL was not distributed with this file, You can obtain one at
+-- http://mozilla.org/MPL/2.0/.
+-- If a copy of the Healthcare Disclaimer was not distributed with this file, You
+-- can obtain one at the project website https://github.com/igia.
+--Copyright (C) 2021-2022 Persistent Systems, Inc.
+--
+-- Delete the facts of the patients of one patient_num range of OBSERVATION_FACT_NUMBERED which are not in the
+-- staged facts any more, so the staged facts replace the facts of each loaded patient.
+-- Parameters (?, ?, ?, ?) are the first and the last patient_num of the batch, twice. The statement is run by
+-- i2b2_cdi.fact.load_fact when FACT_LOAD_MODE=merge and FACT_MERGE_DELETE=true.
+WITH numbered AS (
+select  *,ROW_NUMBER() OVER (PARTITION BY [PATIENT_NUM],[CONCEPT_CD],[MODIFIER_CD],[START_DATE],[ENCOUNTER_NUM],[INSTANCE_NUM],[PROVIDER_ID]
+order by [PATIENT_NUM],[CONCEPT_CD],[MODIFIER_CD],[START_DATE],[ENCOUNTER_NUM],[INSTANCE_NUM],[PROVIDER_ID])
+as row_num
+from [dbo].[OBSERVATION_FACT_NUMBERED]
+where PATIENT_NUM >= ? and PATIENT_NUM <= ?
+)
+DELETE f FROM [dbo].[observation_fact] f
+WHERE f.PATIENT_NUM >= ? and f.PATIENT_NUM <= ?
+AND EXISTS (select 1 from [dbo].[OBSERVATION_FACT_NUMBERED] p where p.PATIENT_NUM = f.PATIENT_NUM)
+AND NOT EXISTS (
+select 1 from numbered s
+where s.[PATIENT_NUM] = f.[PATIENT_NUM]
+AND s.[CONCEPT_CD] = f.[CONCEPT_CD]
+AND s.[MODIFIER_CD] = f.[MODIFIER_CD]
+AND s.[START_DATE] = f.[START_DATE]
+AND s.[ENCOUNTER_NUM] = f.[ENCOUNTER_NUM]
+AND s.row_num -1 = f.[INSTANCE_NUM]
+AND s.[PROVIDER_ID] = f.[PROVIDER_ID]
+);
@@ -0,0 +1,19 @@
+--
+-- This Source Code Form is subject to the terms of the Mozilla Public License, v.
+-- 2.0 with a Healthcare Disclaimer.
+-- A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+-- be found under the top level directory, named LICENSE.
+-- If a copy of the MPL was not distributed with this file, You can obtain one at
+-- http://mozilla.org/MPL/2.0/.
+-- If a copy of the Healthcare Disclaimer was not distributed with this file, You
+-- can obtain one at the project website https://github.com/igia.
+--Copyright (C) 2021-2022 Persistent Systems, Inc.
+--
+-- Clustered index on the key of observation_fact, created once the staging table is loaded
+-- so bcp inserts into a heap.
+IF NOT EXISTS (SELECT * FROM sys.indexes
+WHERE object_id = OBJECT_ID(N'[dbo].[OBSERVATION_FACT_NUMBERED]') AND name = N'OFN_IDX_KEY')
+BEGIN
+    CREATE CLUSTERED INDEX [OFN_IDX_KEY] ON [dbo].[OBSERVATION_FACT_NUMBERED]
+    ([PATIENT_NUM],[CONCEPT_CD],[MODIFIER_CD],[START_DATE],[ENCOUNTER_NUM],[INSTANCE_NUM],[PROVIDER_ID])
+END
@@ -0,0 +1,79 @@
+--
+-- This Source Code Form is subject to the terms of the Mozilla Public License, v.
+-- 2.0 with a Healthcare Disclaimer.
+-- A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+-- be found under the top level directory, named LICENSE.
+-- If a copy of the MPL was not distributed with this file, You can obtain one at
+-- http://mozilla.org/MPL/2.0/.
+-- If a copy of the Healthcare Disclaimer was not distributed with this file, You
+-- can obtain one at the project website https://github.com/igia.
+--Copyright (C) 2021-2022 Persistent Systems, Inc.
+--
+-- Upsert the facts of one patient_num range of OBSERVATION_FACT_NUMBERED into observation_fact on its primary key.
+-- Parameters (?, ?) are the first and the last patient_num of the batch, the statement is run by
+-- i2b2_cdi.fact.load_fact for consecutive ranges when FACT_LOAD_MODE=merge.
+-- Facts whose values did not change are left untouched, IMPORT_DATE and UPLOAD_ID are not compared.
+WITH numbered AS (
+select  *,ROW_NUMBER() OVER (PARTITION BY [PATIENT_NUM],[CONCEPT_CD],[MODIFIER_CD],[START_DATE],[ENCOUNTER_NUM],[INSTANCE_NUM],[PROVIDER_ID]
+order by [PATIENT_NUM],[CONCEPT_CD],[MODIFIER_CD],[START_DATE],[ENCOUNTER_NUM],[INSTANCE_NUM],[PROVIDER_ID])
+as row_num
+from [dbo].[OBSERVATION_FACT_NUMBERED]
+where PATIENT_NUM >= ? and PATIENT_NUM <= ?
+)
+MERGE [dbo].[observation_fact] WITH (HOLDLOCK) AS t
+USING (
+select
+r.[ENCOUNTER_NUM] as ENCOUNTER_NUM,
+r.[PATIENT_NUM] as PATIENT_NUM,
+r.[CONCEPT_CD] as CONCEPT_CD,
+r.[PROVIDER_ID] as PROVIDER_ID,
+r.[START_DATE] as START_DATE,
+r.[MODIFIER_CD] as MODIFIER_CD,
+r.row_num -1 as INSTANCE_NUM,
+r.[VALTYPE_CD] as VALTYPE_CD,
+r.[TVAL_CHAR] as TVAL_CHAR,
+r.[NVAL_NUM] as NVAL_NUM,
+r.[VALUEFLAG_CD] as VALUEFLAG_CD,
+r.[QUANTITY_NUM] as QUANTITY_NUM,
+r.[UNITS_CD] as UNITS_CD,
+r.[END_DATE] as END_DATE,
+r.[LOCATION_CD] as LOCATION_CD,
+r.[OBSERVATION_BLOB] as OBSERVATION_BLOB,
+r.[CONFIDENCE_NUM] as CONFIDENCE_NUM,
+r.[UPDATE_DATE] as UPDATE_DATE,
+r.[DOWNLOAD_DATE] as DOWNLOAD_DATE,
+r.[IMPORT_DATE] as IMPORT_DATE,
+r.[SOURCESYSTEM_CD] as SOURCESYSTEM_CD,
+r.[UPLOAD_ID] as UPLOAD_ID
+from numbered r
+) AS s
+ON t.[PATIENT_NUM] = s.[PATIENT_NUM]
+AND t.[CONCEPT_CD] = s.[CONCEPT_CD]
+AND t.[MODIFIER_CD] = s.[MODIFIER_CD]
+AND t.[START_DATE] = s.[START_DATE]
+AND t.[ENCOUNTER_NUM] = s.[ENCOUNTER_NUM]
+AND t.[INSTANCE_NUM] = s.[INSTANCE_NUM]
+AND t.[PROVIDER_ID] = s.[PROVIDER_ID]
+WHEN MATCHED AND EXISTS (
+select s.[VALTYPE_CD], s.[TVAL_CHAR], s.[NVAL_NUM], s.[VALUEFLAG_CD], s.[QUANTITY_NUM], s.[UNITS_CD], s.[END_DATE], s.[LOCATION_CD], CAST(s.[OBSERVATION_BLOB] AS varchar(max)), s.[CONFIDENCE_NUM], s.[UPDATE_DATE], s.[DOWNLOAD_DATE], s.[SOURCESYSTEM_CD]
+except
+select t.[VALTYPE_CD], t.[TVAL_CHAR], t.[NVAL_NUM], t.[VALUEFLAG_CD], t.[QUANTITY_NUM], t.[UNITS_CD], t.[END_DATE], t.[LOCATION_CD], CAST(t.[OBSERVATION_BLOB] AS varchar(max)), t.[CONFIDENCE_NUM], t.[UPDATE_DATE], t.[DOWNLOAD_DATE], t.[SOURCESYSTEM_CD]
+) THEN UPDATE SET
+[VALTYPE_CD] = s.[VALTYPE_CD],
+[TVAL_CHAR] = s.[TVAL_CHAR],
+[NVAL_NUM] = s.[NVAL_NUM],
+[VALUEFLAG_CD] = s.[VALUEFLAG_CD],
+[QUANTITY_NUM] = s.[QUANTITY_NUM],
+[UNITS_CD] = s.[UNITS_CD],
+[END_DATE] = s.[END_DATE],
+[LOCATION_CD] = s.[LOCATION_CD],
+[OBSERVATION_BLOB] = s.[OBSERVATION_BLOB],
+[CONFIDENCE_NUM] = s.[CONFIDENCE_NUM],
+[UPDATE_DATE] = s.[UPDATE_DATE],
+[DOWNLOAD_DATE] = s.[DOWNLOAD_DATE],
+[IMPORT_DATE] = s.[IMPORT_DATE],
+[SOURCESYSTEM_CD] = s.[SOURCESYSTEM_CD],
+[UPLOAD_ID] = s.[UPLOAD_ID]
+WHEN NOT MATCHED BY TARGET THEN INSERT
+([ENCOUNTER_NUM], [PATIENT_NUM], [CONCEPT_CD], [PROVIDER_ID], [START_DATE], [MODIFIER_CD], [INSTANCE_NUM], [VALTYPE_CD], [TVAL_CHAR], [NVAL_NUM], [VALUEFLAG_CD], [QUANTITY_NUM], [UNITS_CD], [END_DATE], [LOCATION_CD], [OBSERVATION_BLOB], [CONFIDENCE_NUM], [UPDATE_DATE], [DOWNLOAD_DATE], [IMPORT_DATE], [SOURCESYSTEM_CD], [UPLOAD_ID])
+VALUES (s.[ENCOUNTER_NUM], s.[PATIENT_NUM], s.[CONCEPT_CD], s.[PROVIDER_ID], s.[START_DATE], s.[MODIFIER_CD], s.[INSTANCE_NUM], s.[VALTYPE_CD], s.[TVAL_CHAR], s.[NVAL_NUM], s.[VALUEFLAG_CD], s.[QUANTITY_NUM], s.[UNITS_CD], s.[END_DATE], s.[LOCATION_CD], s.[OBSERVATION_BLOB], s.[CONFIDENCE_NUM], s.[UPDATE_DATE], s.[DOWNLOAD_DATE], s.[IMPORT_DATE], s.[SOURCESYSTEM_CD], s.[UPLOAD_ID]);
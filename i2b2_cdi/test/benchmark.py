@@ -0,0 +1,345 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License, v.
+# 2.0 with a Healthcare Disclaimer.
+# A copy of the Mozilla Public License, v. 2.0 with the Healthcare Disclaimer can
+# be found under the top level directory, named LICENSE.
+# If a copy of the MPL was not distributed with this file, You can obtain one at
+# http://mozilla.org/MPL/2.0/.
+# If a copy of the Healthcare Disclaimer was not distributed with this file, You
+# can obtain one at the project website https://github.com/igia.
+#
+# Copyright (C) 2021-2022 Persistent Systems, Inc.
+#
+"""
+:mod:`benchmark` -- Throughput benchmark of the pipeline stages
+===============================================================
+
+.. module:: benchmark
+    :platform: Linux/Windows
+    :synopsis: module contains synthetic data generator and benchmark running each pipeline stage, results are reported as json
+
+"""
+
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime as DateTime, timedelta
+from dotenv import load_dotenv
+from i2b2_cdi.common.utils import fact_fields, get_peak_rss
+from i2b2_cdi.common.file_reader import open_csv, can_split
+from i2b2_cdi.common.id_map import IdMap
+from i2b2_cdi.common.uploader import OdbcUploader
+from i2b2_cdi.patient.deid_patient import DeidPatient
+from i2b2_cdi.patient.transform_file import TransformFile as PatientTransformFile
+from i2b2_cdi.encounter.deid_encounter import DeidEncounter
+from i2b2_cdi.encounter.transform_file import TransformFile as EncounterTransformFile
+from i2b2_cdi.fact.deid_fact import DeidFact
+from i2b2_cdi.fact.transform_file import TransformFile as FactTransformFile
+
+env_path = Path('i2b2_cdi/resources') / '.env'
+load_dotenv(dotenv_path=env_path)
+
+mrn_sources = ['SYNTHEA', 'EHR']
+patient_fields = ['PatientID', 'VitalStatusCD', 'BirthDate', 'DeathDate', 'SexCD', 'AgeInYears',
+                  'LanguageCD', 'RaceCD', 'MaritalStatusCD', 'ReligionCD', 'ZipCD', 'StateCityZipPath', 'IncomeCD']
+encounter_fields = ['EncounterID', 'PatientID', 'StartDate', 'EndDate',
+                    'ActivityTypeCD', 'ActivityStatusCD', 'ProgramCD']
+# Env knobs reported with the results, so reports of different settings are not compared by mistake
+reported_env = ['PIPELINE_ENABLED', 'PIPELINE_BLOCK_SIZE', 'DEID_WORKERS', 'TRANSFORM_CHUNK_SIZE', 'COMPACT_ID_MAP',
+                'WRITE_BUFFER_SIZE', 'ODBC_BATCH_SIZE', 'PROGRESS_EXACT_COUNT']
+
+
+def write_csv(file_path, header, rows):
+    """Write the header and rows to the csv file
+
+    Returns:
+        int: count of written rows
+
+    """
+    count = 0
+    with open(file_path, 'w') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',', lineterminator='\n')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def generate_data(data_dir, patients=1000, encounters_per_patient=5, facts_per_encounter=20, seed=1):
+    """Generate synthetic mrn, patients, encounters and facts csv files
+
+    Every patient has an id of each mrn source, encounters and facts refer to the SYNTHEA ids.
+    Fact values are numeric or text, so both value types are converted.
+
+    Args:
+        data_dir (:obj:`str`, mandatory): Directory of the generated files
+        patients (:obj:`int`, optional): Count of patients
+        encounters_per_patient (:obj:`int`, optional): Count of encounters of each patient
+        facts_per_encounter (:obj:`int`, optional): Count of facts of each encounter
+        seed (:obj:`int`, optional): Seed of the random values, the same seed generates the same files
+
+    Returns:
+        dict: path and row count of each generated file by name
+
+    """
+    rand = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    start_date = DateTime(2015, 1, 1)
+    concepts = ['LOINC:' + str(2000 + i) for i in range(200)]
+    units = ['mg/dL', 'mmol/L', 'kg', 'cm', '']
+
+    def patient_id(num):
+        return 'P' + str(num).zfill(8)
+
+    def encounter_id(num, index):
+        return 'E' + str(num).zfill(8) + '-' + str(index)
+
+    def mrn_rows():
+        for num in range(1, patients + 1):
+            yield [patient_id(num), 'MRN' + str(num).zfill(8)]
+
+    def patient_rows():
+        for num in range(1, patients + 1):
+            birth_date = start_date - timedelta(days=rand.randint(365, 36500))
+            yield [patient_id(num), rand.choice(['N', 'Y']), birth_date.strftime('%Y-%m-%d 00:00:00'), '',
+                   rand.choice(['M', 'F']), str(rand.randint(1, 99)), 'english', rand.choice(['white', 'black', 'asian']),
+                   rand.choice(['single', 'married']), '', '02139', 'MA\\Boston\\02139\\', '']
+
+    def encounter_rows():
+        for num in range(1, patients + 1):
+            for index in range(encounters_per_patient):
+                start = start_date + timedelta(minutes=rand.randint(0, 3000000))
+                yield [encounter_id(num, index), patient_id(num), start.strftime('%Y-%m-%d %H:%M:%S'),
+                       (start + timedelta(hours=rand.randint(1, 72))).strftime('%Y-%m-%d %H:%M:%S'),
+                       rand.choice(['ambulatory', 'inpatient', 'emergency']), 'finished', str(rand.randint(100000, 999999))]
+
+    def fact_rows():
+        for num in range(1, patients + 1):
+            for index in range(encounters_per_patient):
+                start = (start_date + timedelta(days=rand.randint(0, 2000))).strftime('%Y-%m-%d %H:%M:%S')
+                for _ in range(facts_per_encounter):
+                    if rand.random() < 0.7:
+                        value = str(round(rand.uniform(0, 500), 2))
+                    else:
+                        value = rand.choice(['positive', 'negative', 'Never smoker', 'normal'])
+                    yield [encounter_id(num, index), patient_id(num), rand.choice(concepts), 'SYNTHEA', start, '@', '',
+                           value, rand.choice(units)]
+
+    files = {}
+    for name, header, rows in [('mrn', mrn_sources, mrn_rows()), ('patients', patient_fields, patient_rows()),
+                               ('encounters', encounter_fields, encounter_rows()), ('facts', fact_fields, fact_rows())]:
+        file_path = os.path.join(data_dir, name + '.csv')
+        files[name] = {'path': file_path, 'rows': write_csv(file_path, header, rows)}
+    return files
+
+
+def create_mappings(mrn_file_path, encounter_file_path, delimiter=','):
+    """Create the patient and encounter mappings in memory, numbers are assigned in file order
+    like the mapping of a load into an empty database
+
+    Returns:
+        dict: patient mapping
+        dict: encounter mapping
+
+    """
+    patient_items = []
+    with open_csv(mrn_file_path, delimiter) as (csv_file, csv_reader):
+        next(csv_reader, None)
+        for patient_num, row in enumerate(csv_reader, 1):
+            patient_items.extend((pt_id, patient_num) for pt_id in row if pt_id != '')
+    encounter_items = []
+    with open_csv(encounter_file_path, delimiter) as (csv_file, csv_reader):
+        encounter_col = next(csv_reader).index('EncounterID')
+        for encounter_num, row in enumerate(csv_reader, 1):
+            encounter_items.append((row[encounter_col], encounter_num))
+    if str(os.getenv('COMPACT_ID_MAP')).lower() == 'true':
+        return IdMap.from_items(patient_items), IdMap.from_items(encounter_items)
+    return dict(patient_items), dict(encounter_items)
+
+
+class LocalDataSource:
+    """Stand-in of the DataSource context manager on a local sqlite database, used by the upload stage"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.db_path)
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.commit()
+        self.connection.close()
+
+
+def upload_bcp_file(db_path, table_name, bcp_file_path, delimiter):
+    """Upload the bcp file to a new table of the local database with the odbc upload engine
+
+    Returns:
+        int: count of inserted rows
+
+    """
+    with open(bcp_file_path, 'r') as bcp_file:
+        width = len(bcp_file.readline().rstrip('\n').split(delimiter))
+    with LocalDataSource(db_path) as cursor:
+        cursor.execute('DROP TABLE IF EXISTS ' + table_name)
+        cursor.execute('CREATE TABLE {0} ({1})'.format(
+            table_name, ', '.join('c' + str(i) for i in range(width))))
+    uploader = OdbcUploader(table_name, bcp_file_path, delimiter, 0, bcp_file_path + '.err',
+                            data_source=lambda: LocalDataSource(db_path))
+    return uploader.upload()
+
+
+def run_stage(report, name, rows, function, *args):
+    """Run the stage and add its wall time, cpu time, rows/sec and peak RSS to the report
+
+    Args:
+        report (:obj:`dict`, mandatory): Report of the run
+        name (:obj:`str`, mandatory): Name of the stage
+        rows (:obj:`int`, mandatory): Count of rows processed by the stage
+        function (:obj:`function`, mandatory): Stage, called with args
+
+    Returns:
+        object: result of the stage
+
+    """
+    start_time = time.time()
+    start_cpu = time.process_time()
+    result = function(*args)
+    wall_time = max(time.time() - start_time, 1e-6)
+    report['stages'][name] = {
+        'rows': rows,
+        'wall_time': round(wall_time, 3),
+        'cpu_time': round(time.process_time() - start_cpu, 3),
+        'rows_per_sec': round(rows / wall_time, 1),
+        'peak_rss': get_peak_rss()}
+    return result
+
+
+def get_commit():
+    """Provide the git commit of the working tree, None outside of a git checkout"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(data_dir=None, patients=1000, encounters_per_patient=5, facts_per_encounter=20, seed=1):
+    """Generate synthetic files and run each stage on them: mapping, de-identification, csv to bcp conversion,
+    fused fact de-identification to bcp and upload to a local sqlite stand-in of the database.
+    Mapping runs in memory, the stages reading or writing i2b2 tables need the database and are not run.
+
+    Args:
+        data_dir (:obj:`str`, optional): Directory of the generated and output files, a temporary directory
+            removed after the run if not provided
+        patients (:obj:`int`, optional): Count of patients
+        encounters_per_patient (:obj:`int`, optional): Count of encounters of each patient
+        facts_per_encounter (:obj:`int`, optional): Count of facts of each encounter
+        seed (:obj:`int`, optional): Seed of the generated values
+
+    Returns:
+        dict: report with the metrics of each stage
+
+    """
+    temp_dir = None
+    if data_dir is None:
+        temp_dir = data_dir = tempfile.mkdtemp(prefix='i2b2_cdi_benchmark_')
+    out_dir = os.path.join(data_dir, 'out')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    delimiter = str(os.getenv('CSV_DELIMITER', ','))
+    db_path = os.path.join(out_dir, 'benchmark.db')
+
+    def out(name):
+        return os.path.join(out_dir, name)
+
+    report = {'commit': get_commit(), 'time': DateTime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'scale': {'patients': patients, 'encounters_per_patient': encounters_per_patient,
+                        'facts_per_encounter': facts_per_encounter, 'seed': seed},
+              'env': {name: os.getenv(name) for name in reported_env}, 'stages': {}}
+    start_time = time.time()
+    try:
+        files = run_stage(report, 'generate', 0, generate_data, data_dir,
+                          patients, encounters_per_patient, facts_per_encounter, seed)
+        generate_stage = report['stages']['generate']
+        for name, file in files.items():
+            generate_stage[name] = file['rows']
+        generate_stage['rows'] = sum(file['rows'] for file in files.values())
+        generate_stage['rows_per_sec'] = round(generate_stage['rows'] / max(generate_stage['wall_time'], 1e-6), 1)
+        patient_rows = files['patients']['rows']
+        encounter_rows = files['encounters']['rows']
+        fact_rows = files['facts']['rows']
+
+        patient_map, encounter_map = run_stage(report, 'mapping', files['mrn']['rows'] + encounter_rows,
+                                               create_mappings, files['mrn']['path'], files['encounters']['path'], delimiter)
+
+        run_stage(report, 'deid_patient', patient_rows, DeidPatient().deidentify_patient, patient_map,
+                  files['patients']['path'], delimiter, out('patients_deid.csv'), delimiter, out('patients_error.csv'))
+        run_stage(report, 'transform_patient', patient_rows, PatientTransformFile().csv_to_bcp,
+                  out('patients_deid.csv'), delimiter, out('patient_dimension.bcp'), delimiter)
+        run_stage(report, 'upload_patient', patient_rows, upload_bcp_file, db_path,
+                  'patient_dimension', out('patient_dimension.bcp'), delimiter)
+
+        run_stage(report, 'deid_encounter', encounter_rows, DeidEncounter().deidentify_encounter, patient_map, encounter_map,
+                  files['encounters']['path'], delimiter, out('encounters_deid.csv'), delimiter, out('encounters_error.csv'))
+        run_stage(report, 'transform_encounter', encounter_rows, EncounterTransformFile().csv_to_bcp, out('encounters_deid.csv'),
+                  delimiter, out('visit_dimension.bcp'), delimiter, out('encounters_transform_error.csv'))
+        run_stage(report, 'upload_encounter', encounter_rows, upload_bcp_file, db_path,
+                  'visit_dimension', out('visit_dimension.bcp'), delimiter)
+
+        deid_fact = DeidFact()
+        fused_fact = DeidFact()
+        if deid_fact.workers > 1 and can_split(files['facts']['path']):
+            run_stage(report, 'deid_fact', fact_rows, deid_fact.deidentify_fact_parallel, patient_map, encounter_map,
+                      files['facts']['path'], delimiter, out('facts_deid.csv'), delimiter, out('facts_error.csv'),
+                      None, None, deid_fact.workers)
+            run_stage(report, 'fused_fact', fact_rows, fused_fact.deidentify_fact_parallel, patient_map, encounter_map,
+                      files['facts']['path'], delimiter, None, delimiter, out('facts_fused_error.csv'),
+                      out('observation_fact_fused.bcp'), delimiter, fused_fact.workers)
+        else:
+            run_stage(report, 'deid_fact', fact_rows, deid_fact.deidentify_fact, patient_map, encounter_map,
+                      files['facts']['path'], delimiter, out('facts_deid.csv'), delimiter, out('facts_error.csv'))
+            run_stage(report, 'fused_fact', fact_rows, fused_fact.deidentify_fact, patient_map, encounter_map,
+                      files['facts']['path'], delimiter, None, delimiter, out('facts_fused_error.csv'),
+                      out('observation_fact_fused.bcp'), delimiter)
+        run_stage(report, 'transform_fact', fact_rows, FactTransformFile().csv_to_bcp,
+                  out('facts_deid.csv'), delimiter, out('observation_fact.bcp'), delimiter)
+        run_stage(report, 'upload_fact', fact_rows, upload_bcp_file, db_path,
+                  'observation_fact_numbered', out('observation_fact.bcp'), delimiter)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    report['wall_time'] = round(time.time() - start_time, 3)
+    report['peak_rss'] = get_peak_rss()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline stages on synthetic data, the report is printed as json')
+    parser.add_argument('-p', '--patients', type=int, default=1000, help="Count of patients")
+    parser.add_argument('-e', '--encounters-per-patient', type=int, default=5,
+                        help="Count of encounters of each patient")
+    parser.add_argument('-f', '--facts-per-encounter', type=int, default=20,
+                        help="Count of facts of each encounter")
+    parser.add_argument('-s', '--seed', type=int, default=1, help="Seed of the generated values")
+    parser.add_argument('-d', '--data-dir', help="Directory of the generated files, kept after the run")
+    parser.add_argument('-o', '--output', help="File the json report is written to")
+    args = parser.parse_args()
+    result = json.dumps(run_benchmark(args.data_dir, args.patients, args.encounters_per_patient,
+                                      args.facts_per_encounter, args.seed), indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(result + '\n')
+    print(result)